@@ -0,0 +1,48 @@
+#!/usr/bin/env bash
+#
+# Builds the retrieval augmented tasks of every language from data/LANG/line_completion.jsonl:
+#   line_completion_rg1_RANKING_FN.jsonl     context retrieved with the last lines of the prompt
+#   line_completion_oracle_RANKING_FN.jsonl  context retrieved with the groundtruth
+# (with the ranker after rg1/oracle if it isn't sparse, e.g. line_completion_rg1_unixcoder_cosine_sim)
+#
+# Usage: ./build-retrieval-contexts.sh REPOSITORY_ROOT [extra build-context arguments...]
+
+set -e
+
+export PYTHONIOENCODING=utf-8
+
+repository_root=$1
+shift
+
+function generate_data() {
+    ranker=$1
+    ranking_fn=$2
+    shift 2
+
+    echo "$ranker, $ranking_fn"
+
+    # for RG-1
+    granite-completebench build-context \
+        --language python --language java --language typescript --language csharp \
+        --repository-root "$repository_root" \
+        --ranker $ranker \
+        --ranking-fn $ranking_fn \
+        --query-type last_n_lines \
+        --output-suffix rg1 \
+        "$@"
+
+    # for oracle experiment
+    granite-completebench build-context \
+        --language python --language java --language typescript --language csharp \
+        --repository-root "$repository_root" \
+        --ranker $ranker \
+        --ranking-fn $ranking_fn \
+        --query-type groundtruth \
+        --no-next-chunk-as-cfc \
+        --output-suffix oracle \
+        "$@"
+}
+
+generate_data sparse bm25 "$@"
+generate_data sparse jaccard_sim "$@"
+generate_data unixcoder cosine_sim "$@"
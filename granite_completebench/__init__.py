@@ -0,0 +1,10 @@
+__all__ = ["ScoreResult", "create_example_pool", "score"]
+
+
+def __getattr__(name: str):
+    # imported on first use, so that the command line doesn't load torch until it needs it
+    if name in __all__:
+        from . import scoring
+
+        return getattr(scoring, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,522 @@
+import json
+import math
+import platform
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+from .cli import BenchArgs
+from .file_utils import read_json, read_jsonl, write_json, write_jsonl
+from .profiling import Profiler
+from .types import Example, Prediction
+
+SYNTHETIC_TEMPLATES = {
+    "python": {
+        "file": "pkg/module_{i}.py",
+        "header": "import os\nimport sys\n\n\nclass Service{i}:\n",
+        "body": (
+            "    def method_{n}(self, value_{n}, items):\n"
+            "        result = self.helper_{n}(value_{n})\n"
+            "        for item in items:\n"
+            "            result += item.compute(value_{n})\n"
+            "        return result\n"
+            "\n"
+        ),
+        "open": "    def target(self, value):\n        result = self.helper_0(",
+        "groundtruth": "value, self.offset",
+        "right_context": ")\n        return result\n\n    def tail(self):\n        pass\n",
+    },
+    "java": {
+        "file": "src/main/java/com/example/Service{i}.java",
+        "header": "package com.example;\n\nimport java.util.List;\n\npublic class Service{i} {{\n",
+        "body": (
+            "    public int method{n}(int value{n}, List<Item> items) {{\n"
+            "        int result = this.helper{n}(value{n});\n"
+            "        for (Item item : items) {{\n"
+            "            result += item.compute(value{n});\n"
+            "        }}\n"
+            "        return result;\n"
+            "    }}\n"
+            "\n"
+        ),
+        "open": "    public int target(int value) {\n        int result = this.helper0(",
+        "groundtruth": "value + this.offset",
+        "right_context": ");\n        return result;\n    }\n}\n",
+    },
+    "csharp": {
+        "file": "src/Example/Service{i}.cs",
+        "header": "using System;\nusing System.Collections.Generic;\n\nnamespace Example\n{{\n"
+        "    public class Service{i}\n    {{\n",
+        "body": (
+            "        public int Method{n}(int value{n}, List<Item> items)\n"
+            "        {{\n"
+            "            var result = this.Helper{n}(value{n});\n"
+            "            foreach (var item in items)\n"
+            "            {{\n"
+            "                result += item.Compute(value{n});\n"
+            "            }}\n"
+            "            return result;\n"
+            "        }}\n"
+            "\n"
+        ),
+        "open": "        public int Target(int value)\n        {\n            var result = this.Helper0(",
+        "groundtruth": "value + this.Offset",
+        "right_context": ");\n            return result;\n        }\n    }\n}\n",
+    },
+    "typescript": {
+        "file": "src/service{i}.ts",
+        "header": "import {{ Item }} from './item';\n\nexport class Service{i} {{\n",
+        "body": (
+            "  method{n}(value{n}: number, items: Item[]): number {{\n"
+            "    let result = this.helper{n}(value{n});\n"
+            "    for (const item of items) {{\n"
+            "      result += item.compute(value{n});\n"
+            "    }}\n"
+            "    return result;\n"
+            "  }}\n"
+            "\n"
+        ),
+        "open": "  target(value: number): number {\n    const result = this.helper0(",
+        "groundtruth": "value + this.offset",
+        "right_context": ");\n    return result;\n  }\n}\n",
+    },
+}
+
+
+def synthetic_example(language: str, index: int, num_methods: int) -> Example:
+    template = SYNTHETIC_TEMPLATES[language]
+    prompt = (
+        template["header"].format(i=index)
+        + "".join(template["body"].format(n=n) for n in range(num_methods))
+        + template["open"]
+    )
+    snippet = template["body"].format(n=num_methods)
+    return Example(
+        prompt=prompt,
+        groundtruth=template["groundtruth"],
+        right_context=template["right_context"],
+        metadata={
+            "task_id": f"synthetic_{language}/{index}",
+            "repository": "synthetic",
+            "file": template["file"].format(i=index),
+            "context_start_lineno": 0,
+            "groundtruth_start_lineno": prompt.count("\n"),
+            "right_context_start_lineno": prompt.count("\n") + 1,
+        },
+        crossfile_context={
+            "text": snippet,
+            "list": [
+                {
+                    "retrieved_chunk": snippet,
+                    "filename": template["file"].format(i=index + 1),
+                    "score": 1.0,
+                }
+            ],
+        },
+    )
+
+
+def synthetic_output(example: Example) -> str:
+    # A completion that runs on into the suffix, so that the postprocessors have work to do
+    return example["groundtruth"] + example["right_context"][:200] + "\n    extra();\n"
+
+
+@dataclass
+class Fixture:
+    name: str
+    language: str
+    examples: list[Example]
+    outputs: list[str]
+
+
+def load_fixtures(args: BenchArgs, language: str) -> list[Fixture]:
+    fixtures = [
+        Fixture(
+            name="synthetic",
+            language=language,
+            examples=[
+                synthetic_example(language, i, args.synthetic_methods)
+                for i in range(args.num_examples)
+            ],
+            outputs=[],
+        )
+    ]
+
+    if args.task is not None:
+        prompt_file = Path(args.data_root_dir) / language / f"{args.task}.jsonl"
+        if prompt_file.exists():
+            examples: list[Example] = []
+            for example in read_jsonl(prompt_file):
+                examples.append(example)
+                if len(examples) == args.num_examples:
+                    break
+            fixtures.append(
+                Fixture(name=args.task, language=language, examples=examples, outputs=[])
+            )
+        else:
+            print(f"No data file found for {prompt_file}, only using synthetic data")
+
+    for fixture in fixtures:
+        fixture.outputs = [synthetic_output(example) for example in fixture.examples]
+
+    return fixtures
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    group: str
+    params: dict[str, Any]
+    timings: list[float] = field(default_factory=list)
+    iterations: int = 1
+
+    def stats(self):
+        timings = sorted(self.timings)
+        quartiles = statistics.quantiles(timings, n=4) if len(timings) > 1 else timings * 3
+        mean = statistics.fmean(timings)
+        return {
+            "min": timings[0],
+            "max": timings[-1],
+            "mean": mean,
+            "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            "median": statistics.median(timings),
+            "iqr": quartiles[2] - quartiles[0],
+            "q1": quartiles[0],
+            "q3": quartiles[2],
+            "ops": 1 / mean if mean > 0 else math.inf,
+            "rounds": len(timings),
+            "iterations": self.iterations,
+        }
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "group": self.group,
+            "params": self.params,
+            "stats": self.stats(),
+        }
+
+
+def run_benchmark(
+    args: BenchArgs, name: str, group: str, params: dict[str, Any], fn: Callable[[], Any]
+) -> BenchmarkResult:
+    # Calibrate the number of iterations per round so that each round is long enough
+    # for the timer resolution not to matter, in the style of pytest-benchmark
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= args.min_time or iterations >= 1 << 20:
+            break
+        iterations *= 2 if elapsed == 0 else max(2, math.ceil(args.min_time / elapsed))
+
+    result = BenchmarkResult(name=name, group=group, params=params, iterations=iterations)
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        result.timings.append((time.perf_counter() - start) / iterations)
+
+    stats = result.stats()
+    print(f"{name:<64} median {stats['median'] * 1000:10.3f} ms  (rounds={stats['rounds']})")
+    return result
+
+
+def bench_create_prompt(args: BenchArgs, fixture: Fixture) -> list[BenchmarkResult]:
+    from transformers import AutoTokenizer
+
+    from .granite_prompts import AutocompleteOptions, create_prompt
+
+    results = []
+    for model in args.model:
+        tokenizer = AutoTokenizer.from_pretrained(model, trust_remote_code=True)
+        for template in ["no_snippets", "inside", "outside", "comment"]:
+            options = AutocompleteOptions(template=template)
+
+            def fn():
+                for example in fixture.examples:
+                    create_prompt(example, tokenizer, options)
+
+            model_short = model.split("/")[-1]
+            results.append(
+                run_benchmark(
+                    args,
+                    f"create_prompt[{model_short}-{fixture.language}-{template}-{fixture.name}]",
+                    "create_prompt",
+                    {
+                        "model": model_short,
+                        "language": fixture.language,
+                        "template": template,
+                        "fixture": fixture.name,
+                        "examples": len(fixture.examples),
+                    },
+                    fn,
+                )
+            )
+
+    return results
+
+
+def bench_postprocessors(args: BenchArgs, fixture: Fixture) -> list[BenchmarkResult]:
+    from .postprocess import create_postprocessor, get_postprocessor_names
+
+    results = []
+    for postprocessor_name in get_postprocessor_names():
+        postprocessor = create_postprocessor(postprocessor_name, fixture.language)
+
+        def fn():
+            for example, output in zip(fixture.examples, fixture.outputs):
+                postprocessor.postprocess(example, output)
+
+        results.append(
+            run_benchmark(
+                args,
+                f"postprocess[{postprocessor_name}-{fixture.language}-{fixture.name}]",
+                "postprocess",
+                {
+                    "postprocess": postprocessor_name,
+                    "language": fixture.language,
+                    "fixture": fixture.name,
+                    "examples": len(fixture.examples),
+                },
+                fn,
+            )
+        )
+
+    return results
+
+
+def bench_parse_errors(args: BenchArgs, fixture: Fixture) -> list[BenchmarkResult]:
+    from tree_sitter import Parser
+
+    from .parse_errors import has_syntax_error
+    from .postprocess import get_treesitter_language
+
+    # The whole file with the completion in place, as parsed by truncate_close, which
+    # is what makes error detection slow on long files
+    parser = Parser(get_treesitter_language(fixture.language))
+    trees = [
+        parser.parse(bytes(example["prompt"] + output + example["right_context"], "utf8"))
+        for example, output in zip(fixture.examples, fixture.outputs)
+    ]
+
+    def fn():
+        for tree in trees:
+            has_syntax_error(tree)
+
+    return [
+        run_benchmark(
+            args,
+            f"parse_errors[{fixture.language}-{fixture.name}]",
+            "parse_errors",
+            {
+                "language": fixture.language,
+                "fixture": fixture.name,
+                "examples": len(fixture.examples),
+            },
+            fn,
+        )
+    ]
+
+
+def bench_scoring(args: BenchArgs, fixture: Fixture) -> list[BenchmarkResult]:
+    from .eval_utils import cal_edit_sim, extract_identifiers
+
+    params = {
+        "language": fixture.language,
+        "fixture": fixture.name,
+        "examples": len(fixture.examples),
+    }
+
+    def fn_extract_identifiers():
+        for output in fixture.outputs:
+            extract_identifiers(output, fixture.language)
+
+    def fn_cal_edit_sim():
+        for example, output in zip(fixture.examples, fixture.outputs):
+            cal_edit_sim([example["groundtruth"]], [output])
+
+    return [
+        run_benchmark(
+            args,
+            f"extract_identifiers[{fixture.language}-{fixture.name}]",
+            "extract_identifiers",
+            params,
+            fn_extract_identifiers,
+        ),
+        run_benchmark(
+            args,
+            f"cal_edit_sim[{fixture.language}-{fixture.name}]",
+            "cal_edit_sim",
+            params,
+            fn_cal_edit_sim,
+        ),
+    ]
+
+
+def bench_tokenizers(args: BenchArgs, fixture: Fixture) -> list[BenchmarkResult]:
+    from .prompt_builder.utils import TOKENIZERS
+
+    # The prompts and retrieved chunks, as tokenized when building retrieval contexts
+    texts = [example["prompt"] for example in fixture.examples] + [
+        item["retrieved_chunk"]
+        for example in fixture.examples
+        for item in example["crossfile_context"]["list"]
+    ]
+
+    results = []
+    for tokenizer_name, tokenize in TOKENIZERS.items():
+        try:
+            tokenize(texts[0])
+        except LookupError:
+            print(f"Skipping tokenizer {tokenizer_name}: NLTK data not found")
+            continue
+
+        def fn():
+            for text in texts:
+                tokenize(text)
+
+        results.append(
+            run_benchmark(
+                args,
+                f"tokenize[{tokenizer_name}-{fixture.language}-{fixture.name}]",
+                "tokenize",
+                {
+                    "tokenizer": tokenizer_name,
+                    "language": fixture.language,
+                    "fixture": fixture.name,
+                    "texts": len(texts),
+                },
+                fn,
+            )
+        )
+
+    return results
+
+
+def bench_compute_metric_stmt(args: BenchArgs, fixture: Fixture) -> list[BenchmarkResult]:
+    from .eval_metric import compute_metric_stmt
+    from .postprocess import create_postprocessor
+
+    postprocessor = create_postprocessor(args.postprocess, fixture.language)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        prompt_file = Path(tmpdir) / "prompts.jsonl"
+        output_file = Path(tmpdir) / "prediction.jsonl"
+        result_dir = Path(tmpdir) / "results"
+
+        with write_jsonl(prompt_file) as writer:
+            for example in fixture.examples:
+                writer.append(example)
+
+        with write_jsonl(output_file) as writer:
+            for example, output in zip(fixture.examples, fixture.outputs):
+                writer.append(
+                    Prediction(
+                        task_id=example["metadata"]["task_id"],
+                        templated="",
+                        output=output,
+                        stop_reason="length",
+                    )
+                )
+
+        def fn():
+            compute_metric_stmt(
+                output_file, result_dir, prompt_file, fixture.language, postprocessor
+            )
+
+        return [
+            run_benchmark(
+                args,
+                f"compute_metric_stmt[{args.postprocess}-{fixture.language}-{fixture.name}]",
+                "compute_metric_stmt",
+                {
+                    "postprocess": args.postprocess,
+                    "language": fixture.language,
+                    "fixture": fixture.name,
+                    "examples": len(fixture.examples),
+                },
+                fn,
+            )
+        ]
+
+
+def compare_results(args: BenchArgs, results: list[BenchmarkResult]) -> bool:
+    assert args.compare is not None
+    baseline = {b["name"]: b for b in read_json(Path(args.compare))["benchmarks"]}
+
+    ok = True
+    for result in results:
+        if result.name not in baseline:
+            continue
+        old = baseline[result.name]["stats"]["median"]
+        new = result.stats()["median"]
+        change = (new - old) / old if old > 0 else 0.0
+        if change > args.max_regression:
+            print(
+                f"REGRESSION {result.name}: {old * 1000:.3f} ms -> {new * 1000:.3f} ms ({change:+.1%})"
+            )
+            ok = False
+
+    return ok
+
+
+def command(args: BenchArgs) -> int:
+    results: list[BenchmarkResult] = []
+
+    profiler = Profiler.from_args(args)
+    profile_base = Path(args.output).with_suffix("") if args.output is not None else Path("bench")
+
+    with profiler.dump_to(profile_base):
+        for language in args.language:
+            with profiler.stage("load"):
+                fixtures = load_fixtures(args, language)
+            for fixture in fixtures:
+                if len(fixture.examples) == 0:
+                    continue
+                with profiler.stage("create_prompt"):
+                    results += bench_create_prompt(args, fixture)
+                with profiler.stage("postprocess"):
+                    results += bench_postprocessors(args, fixture)
+                    results += bench_parse_errors(args, fixture)
+                with profiler.stage("score"):
+                    results += bench_scoring(args, fixture)
+                with profiler.stage("tokenize"):
+                    results += bench_tokenizers(args, fixture)
+                if args.end_to_end:
+                    with profiler.stage("compute_metric_stmt"):
+                        results += bench_compute_metric_stmt(args, fixture)
+
+    report = {
+        "machine_info": {
+            "node": platform.node(),
+            "machine": platform.machine(),
+            "python_implementation": platform.python_implementation(),
+            "python_version": platform.python_version(),
+            "system": platform.system(),
+        },
+        "datetime": datetime.now(timezone.utc).isoformat(),
+        "benchmarks": [result.to_json() for result in results],
+    }
+
+    if args.output is not None:
+        write_json(Path(args.output), report, create_parents=True)
+        print(f"writing benchmark results to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    profiler.write(profile_base.with_name(profile_base.name + ".profile.json"))
+
+    if args.compare is not None and not compare_results(args, results):
+        return 1
+
+    return 0
+
+
+__all__ = ["command"]
@@ -1,10 +1,34 @@
 import argparse
+import os
 from dataclasses import dataclass
 from typing import Literal
 
+# relative, so that evaluate only delegates to a daemon started in the same directory
+DEFAULT_DAEMON_SOCKET = ".cache/evaluate.sock"
+
 
 @dataclass
-class BaseArgs:
+class ProfileArgs:
+    profile: bool
+    profile_dump: Literal["cprofile", "pyinstrument"] | None
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="write a JSON report with per-stage timings and per-example latencies",
+        )
+        parser.add_argument(
+            "--profile-dump",
+            type=str,
+            choices=["cprofile", "pyinstrument"],
+            help="with --profile, also write a cProfile or pyinstrument dump",
+        )
+
+
+@dataclass
+class BaseArgs(ProfileArgs):
     command: str
     model: list[str]
     language: list[Literal["csharp", "python", "java", "typescript"]]
@@ -15,6 +39,8 @@ class BaseArgs:
 
     @classmethod
     def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
         parser.add_argument(
             "--model", type=str, action="append", required=True, help="vLLM-supported model"
         )
@@ -53,10 +79,58 @@ class BaseArgs:
 
 
 @dataclass
-class EvaluateArgs(BaseArgs):
+class SampleArgs(BaseArgs):
+    sample_fraction: float | None
+    sample_size: int | None
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--sample-fraction",
+            type=float,
+            help="only use this fraction of the examples, stratified by repository, "
+            + "file type and groundtruth length",
+        )
+        parser.add_argument(
+            "--sample-size",
+            type=int,
+            help="only use this many of the examples, selected as with --sample-fraction",
+        )
+
+
+@dataclass
+class ShardArgs(SampleArgs):
+    shard_index: int
+    num_shards: int
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--shard-index",
+            type=int,
+            default=0,
+            help="with --num-shards, the shard of the examples to process, from 0",
+        )
+        parser.add_argument(
+            "--num-shards",
+            type=int,
+            default=1,
+            help="split the examples into this many shards by a hash of their task_id, "
+            + "each with its own output and results directory, to be combined with merge",
+        )
+
+
+@dataclass
+class EvaluateArgs(ShardArgs):
     postprocess: list[str]
     results_dir: str
     update_web: bool
+    replay_stream: bool
+    example_timeout: float
 
     @classmethod
     def add_arguments(cls, parser: argparse.ArgumentParser):
@@ -77,10 +151,47 @@ class EvaluateArgs(BaseArgs):
         parser.add_argument(
             "--update-web", action="store_true", help="update data files for the website"
         )
+        parser.add_argument(
+            "--replay-stream",
+            action="store_true",
+            help="replay the outputs token by token through each postprocessor, with the "
+            + "tokenizer of the model, to estimate the decode tokens and time saved by "
+            + "stopping generation as soon as the postprocessor cuts the output",
+        )
+        parser.add_argument(
+            "--example-timeout",
+            type=float,
+            default=30,
+            help="seconds after which the postprocessing of an example is abandoned, "
+            + "and it is scored as generated",
+        )
+
+
+@dataclass
+class EvaluateCommandArgs(EvaluateArgs):
+    daemon: bool
+    daemon_socket: str
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--no-daemon",
+            dest="daemon",
+            action="store_false",
+            help="evaluate in this process even if an evaluation daemon is running",
+        )
+        parser.add_argument(
+            "--daemon-socket",
+            type=str,
+            default=DEFAULT_DAEMON_SOCKET,
+            help="socket of the evaluation daemon to run the evaluation in, if it is running",
+        )
 
 
 @dataclass
-class GenerateArgs(BaseArgs):
+class GenerateArgs(ShardArgs):
     temperature: float
     top_p: float
     generation_max_tokens: int
@@ -120,6 +231,9 @@ class GenerateVllmArgs(GenerateArgs):
 @dataclass
 class GenerateOllamaArgs(GenerateArgs):
     ollama_model: list[str]
+    stream: bool
+    stream_postprocess: str | None
+    stream_abort: bool
 
     @classmethod
     def add_arguments(cls, parser: argparse.ArgumentParser):
@@ -132,6 +246,409 @@ class GenerateOllamaArgs(GenerateArgs):
             required=True,
             help="Ollama model (must be one for each --model argument)",
         )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="stream the response to measure time-to-first-token and inter-token latencies",
+        )
+        parser.add_argument(
+            "--stream-postprocess",
+            type=str,
+            help="with --stream, apply this postprocessor incrementally to measure "
+            + "how many tokens are generated after the completion is final",
+        )
+        parser.add_argument(
+            "--stream-abort",
+            action="store_true",
+            help="with --stream-postprocess, stop generation once the completion is final",
+        )
+
+
+@dataclass
+class RunVllmArgs(GenerateVllmArgs, EvaluateArgs):
+    pass
+
+
+@dataclass
+class RunOllamaArgs(GenerateOllamaArgs, EvaluateArgs):
+    pass
+
+
+@dataclass
+class MergeArgs(SampleArgs):
+    postprocess: list[str] | None
+    results_dir: str
+    num_shards: int
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--postprocess",
+            type=str,
+            action="append",
+            help="none or the name of a postprocessor whose results to merge",
+        )
+        parser.add_argument(
+            "--results-dir",
+            type=str,
+            default="./results",
+            help="path to directory where to evaluation results are stored",
+        )
+        parser.add_argument(
+            "--num-shards",
+            type=int,
+            required=True,
+            help="number of shards the examples were split into",
+        )
+
+
+@dataclass
+class BenchArgs(ProfileArgs):
+    command: str
+    model: list[str]
+    language: list[Literal["csharp", "python", "java", "typescript"]]
+    task: str | None
+    data_root_dir: str
+    postprocess: str
+    num_examples: int
+    synthetic_methods: int
+    rounds: int
+    min_time: float
+    end_to_end: bool
+    output: str | None
+    compare: str | None
+    max_regression: float
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--model",
+            type=str,
+            action="append",
+            default=[],
+            help="tokenizer to benchmark prompt creation with (create_prompt is skipped if none)",
+        )
+        parser.add_argument(
+            "--language",
+            type=str,
+            choices=["csharp", "python", "java", "typescript"],
+            action="append",
+        )
+        parser.add_argument(
+            "--task",
+            type=str,
+            help="also benchmark on examples from the data file for this task",
+        )
+        parser.add_argument(
+            "--data-root-dir",
+            type=str,
+            default="data/",
+            help="path to directory where data is organized in lang/task.jsonl format",
+        )
+        parser.add_argument(
+            "--postprocess",
+            type=str,
+            default="truncate_suffix_close",
+            help="postprocessor used for the end-to-end compute_metric_stmt benchmark",
+        )
+        parser.add_argument(
+            "--num-examples", type=int, default=50, help="number of examples in each fixture"
+        )
+        parser.add_argument(
+            "--synthetic-methods",
+            type=int,
+            default=50,
+            help="number of methods in the prefix of synthetic examples",
+        )
+        parser.add_argument("--rounds", type=int, default=5, help="number of timed rounds")
+        parser.add_argument(
+            "--min-time",
+            type=float,
+            default=0.05,
+            help="minimum time in seconds for a single round",
+        )
+        parser.add_argument(
+            "--no-end-to-end",
+            dest="end_to_end",
+            action="store_false",
+            help="skip the end-to-end compute_metric_stmt benchmark",
+        )
+        parser.add_argument("--output", type=str, help="path to write the JSON results to")
+        parser.add_argument(
+            "--compare",
+            type=str,
+            help="JSON results from a previous run; exit with an error on regressions",
+        )
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=0.2,
+            help="maximum allowed relative slowdown of the median when using --compare",
+        )
+
+
+@dataclass
+class ServeArgs(ProfileArgs):
+    command: str
+    daemon_socket: str
+    processes: int
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--daemon-socket",
+            type=str,
+            default=DEFAULT_DAEMON_SOCKET,
+            help="path of the Unix socket to listen on",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=max(1, (os.cpu_count() or 1) - 1),
+            help="number of worker processes that postprocess the examples",
+        )
+
+
+@dataclass
+class BuildContextArgs(ProfileArgs):
+    command: str
+    language: list[Literal["csharp", "python", "java", "typescript"]]
+    repository_root: str
+    data_root_dir: str
+    input_task: str
+    output_suffix: str
+    rerank: bool
+    ranker: Literal["sparse", "unixcoder"]
+    ranking_fn: Literal["tfidf", "bm25", "jaccard_sim", "cosine_sim"]
+    tokenizer: Literal["code", "code_subwords", "nltk"]
+    query_type: Literal["last_n_lines", "groundtruth"]
+    crossfile_distance: int
+    maximum_chunk_to_rerank: int
+    retrieval_budget_ms: float | None
+    maximum_cross_files: int
+    maximum_cross_file_chunk: int
+    use_next_chunk_as_cfc: bool
+    skip_if_no_cfc: bool
+    index_cache_dir: str | None
+    max_chunks_in_memory: int
+    workers: int
+    device: Literal["auto", "cpu", "cuda"]
+    ranker_path: str | None
+    encoder_batch_size: int
+    encoder_threads: int | None
+    quantize_int8: bool
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--language",
+            type=str,
+            required=True,
+            choices=["csharp", "python", "java", "typescript"],
+            action="append",
+        )
+        parser.add_argument(
+            "--repository-root",
+            type=str,
+            required=True,
+            help="path to directory with the repositories of the examples, in lang/repository format",
+        )
+        parser.add_argument(
+            "--data-root-dir",
+            type=str,
+            default="data/",
+            help="path to directory where data is organized in lang/task.jsonl format",
+        )
+        parser.add_argument(
+            "--input-task",
+            type=str,
+            default="line_completion",
+            help="task to add the retrieved context to",
+        )
+        parser.add_argument(
+            "--output-suffix",
+            type=str,
+            default="rg1",
+            help="suffix of the output task, followed by the ranker (unless sparse) and ranking function",
+        )
+        parser.add_argument(
+            "--no-rerank",
+            dest="rerank",
+            action="store_false",
+            help="keep the chunks in the order of the distance of their files",
+        )
+        parser.add_argument(
+            "--ranker",
+            type=str,
+            default="sparse",
+            choices=["sparse", "unixcoder"],
+        )
+        parser.add_argument(
+            "--ranking-fn",
+            type=str,
+            default="bm25",
+            choices=["tfidf", "bm25", "jaccard_sim", "cosine_sim"],
+        )
+        parser.add_argument(
+            "--tokenizer",
+            type=str,
+            default="code",
+            choices=["code", "code_subwords", "nltk"],
+            help="how the sparse rankings split text into terms: code (the same terms as nltk from "
+            "a single regex), code_subwords (also the parts of camelCase and snake_case "
+            "identifiers) or nltk (NLTK's word_tokenize, as used for the published contexts)",
+        )
+        parser.add_argument(
+            "--query-type",
+            type=str,
+            default="last_n_lines",
+            choices=["last_n_lines", "groundtruth"],
+            help="how to form the query from the prompt (groundtruth is the oracle experiment)",
+        )
+        parser.add_argument(
+            "--crossfile-distance",
+            type=int,
+            default=100,
+            help="max directory distance of the files to retrieve chunks from",
+        )
+        parser.add_argument(
+            "--maximum-chunk-to-rerank",
+            type=int,
+            default=1000,
+            help="max number of chunks to rank",
+        )
+        parser.add_argument(
+            "--retrieval-budget-ms",
+            type=float,
+            help="only rank as many of the nearest chunks as is expected to fit this time per "
+            "example, as an IDE would (the budget is added to the output task name)",
+        )
+        parser.add_argument(
+            "--maximum-cross-files",
+            type=int,
+            default=1000,
+            help="max number of files to retrieve chunks from",
+        )
+        parser.add_argument(
+            "--maximum-cross-file-chunk",
+            type=int,
+            default=5,
+            help="max number of chunks in the context",
+        )
+        parser.add_argument(
+            "--no-next-chunk-as-cfc",
+            dest="use_next_chunk_as_cfc",
+            action="store_false",
+            help="use the retrieved chunks rather than the chunks following them as context",
+        )
+        parser.add_argument(
+            "--skip-if-no-cfc",
+            action="store_true",
+            help="leave out the examples without any context",
+        )
+        parser.add_argument(
+            "--index-cache-dir",
+            type=str,
+            default=".cache/chunk_index",
+            help="directory to cache the per-repository chunk indexes and embeddings in, "
+            + "or empty to disable",
+        )
+        parser.add_argument(
+            "--max-chunks-in-memory",
+            type=int,
+            default=500000,
+            help="max number of chunks of the repositories processed together",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="number of worker processes",
+        )
+        parser.add_argument(
+            "--device",
+            type=str,
+            default="auto",
+            choices=["auto", "cpu", "cuda"],
+            help="device to run the ranker model on, auto uses all GPUs if there are any",
+        )
+        parser.add_argument(
+            "--ranker-path",
+            type=str,
+            help="local path or hub name of the ranker model, instead of the default one for --ranker",
+        )
+        parser.add_argument(
+            "--encoder-batch-size",
+            type=int,
+            default=64,
+            help="max number of texts encoded together by the ranker model",
+        )
+        parser.add_argument(
+            "--encoder-threads",
+            type=int,
+            help="number of torch threads of the ranker model on CPU",
+        )
+        parser.add_argument(
+            "--quantize-int8",
+            action="store_true",
+            help="dynamically quantize the ranker model to int8 (CPU only)",
+        )
+
+
+def check_ollama_args(parser: argparse.ArgumentParser, args: GenerateOllamaArgs):
+    if len(args.model) != len(args.ollama_model):
+        parser.error(
+            "Exactly one --ollama-model argument must be provided for each --model argument"
+        )
+    if args.stream_postprocess is not None:
+        from .postprocess import get_postprocessor_names
+
+        if not args.stream:
+            parser.error("--stream-postprocess requires --stream")
+        if args.stream_postprocess not in get_postprocessor_names():
+            parser.error(f"unknown postprocessor name `{args.stream_postprocess}`")
+    if args.stream_abort and args.stream_postprocess is None:
+        parser.error("--stream-abort requires --stream-postprocess")
+
+
+def check_sample_args(parser: argparse.ArgumentParser, args: SampleArgs):
+    if args.sample_fraction is not None and args.sample_size is not None:
+        parser.error("--sample-fraction and --sample-size are mutually exclusive")
+    if args.sample_fraction is not None and not 0 < args.sample_fraction <= 1:
+        parser.error("--sample-fraction must be between 0 and 1")
+    if args.sample_size is not None and args.sample_size < 1:
+        parser.error("--sample-size must be positive")
+    sampled = args.sample_fraction is not None or args.sample_size is not None
+    if sampled and getattr(args, "update_web", False):
+        parser.error("--update-web requires all the examples")
+
+
+def check_shard_args(parser: argparse.ArgumentParser, args: ShardArgs):
+    check_sample_args(parser, args)
+    if args.num_shards < 1:
+        parser.error("--num-shards must be positive")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error("--shard-index must be between 0 and --num-shards - 1")
+    if args.num_shards > 1 and getattr(args, "update_web", False):
+        parser.error("--update-web requires all the examples, run it after merge")
+
+
+def check_run_args(parser: argparse.ArgumentParser, args: EvaluateArgs):
+    from .postprocess import get_postprocessor_names
+
+    if args.postprocess is None:
+        parser.error("at least one --postprocess is required")
+    for postprocessor_name in args.postprocess:
+        if postprocessor_name not in get_postprocessor_names():
+            parser.error(f"unknown postprocessor name `{postprocessor_name}`")
 
 
 def main():
@@ -150,34 +667,142 @@ def main():
     GenerateOllamaArgs.add_arguments(generate_ollama_parser)
 
     evaluate_parser = subparsers.add_parser("evaluate", help="Evaluate generation results")
-    EvaluateArgs.add_arguments(evaluate_parser)
+    EvaluateCommandArgs.add_arguments(evaluate_parser)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run a daemon that keeps evaluate warm between invocations"
+    )
+    ServeArgs.add_arguments(serve_parser)
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Combine the outputs and results of the shards of a sharded run"
+    )
+    MergeArgs.add_arguments(merge_parser)
+
+    run_vllm_parser = subparsers.add_parser(
+        "run-vllm", help="Generate completions using vLLM and evaluate them as they complete"
+    )
+    RunVllmArgs.add_arguments(run_vllm_parser)
+
+    run_ollama_parser = subparsers.add_parser(
+        "run-ollama", help="Generate completions using Ollama and evaluate them as they complete"
+    )
+    RunOllamaArgs.add_arguments(run_ollama_parser)
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="Benchmark prompt creation, postprocessing and scoring"
+    )
+    BenchArgs.add_arguments(bench_parser)
+
+    build_context_parser = subparsers.add_parser(
+        "build-context", help="Add retrieved cross-file context to the examples of a task"
+    )
+    BuildContextArgs.add_arguments(build_context_parser)
 
     args = parser.parse_args()
 
+    if getattr(args, "profile_dump", None) == "pyinstrument":
+        try:
+            import pyinstrument
+        except ImportError as e:
+            print(f"Error importing pyinstrument: {e}, try: `pip install -e '.[profile]`")
+            return 1
+
     if args.command == "generate-vllm":
         try:
             from .generate_vllm import command as generate_vllm_command
         except ImportError as e:
             print(f"Error importing generate_vllm: {e}, try: `pip install -e '.[vllm]`")
             return 1
-        generate_vllm_command(GenerateVllmArgs(**vars(args)))
+        generate_vllm_args = GenerateVllmArgs(**vars(args))
+        check_shard_args(parser, generate_vllm_args)
+        generate_vllm_command(generate_vllm_args)
     elif args.command == "generate-ollama":
         from .generate_ollama import command as generate_ollama_command
 
         ollama_args = GenerateOllamaArgs(**vars(args))
-        if len(ollama_args.model) != len(ollama_args.ollama_model):
-            parser.error(
-                "Exactly one --ollama-model argument must be provided for each --model argument"
-            )
-
+        check_ollama_args(parser, ollama_args)
+        check_shard_args(parser, ollama_args)
         generate_ollama_command(ollama_args)
     elif args.command == "evaluate":
+        evaluate_args = EvaluateCommandArgs(**vars(args))
+        check_shard_args(parser, evaluate_args)
+        if evaluate_args.daemon:
+            from .daemon import submit_job
+
+            exit_code = submit_job(evaluate_args.daemon_socket, evaluate_args)
+            if exit_code is not None:
+                return exit_code
+
         from .evaluate import command as evaluate_command
 
         try:
-            evaluate_command(EvaluateArgs(**vars(args)))
+            evaluate_command(evaluate_args)
         except argparse.ArgumentTypeError as e:
             print(f"{e}")
             return 1
+    elif args.command == "run-vllm":
+        run_vllm_args = RunVllmArgs(**vars(args))
+        check_run_args(parser, run_vllm_args)
+        check_shard_args(parser, run_vllm_args)
+        try:
+            from .generate_vllm import run_command as run_vllm_command
+        except ImportError as e:
+            print(f"Error importing generate_vllm: {e}, try: `pip install -e '.[vllm]`")
+            return 1
+        run_vllm_command(run_vllm_args)
+    elif args.command == "run-ollama":
+        from .generate_ollama import run_command as run_ollama_command
+
+        run_ollama_args = RunOllamaArgs(**vars(args))
+        check_ollama_args(parser, run_ollama_args)
+        check_run_args(parser, run_ollama_args)
+        check_shard_args(parser, run_ollama_args)
+        run_ollama_command(run_ollama_args)
+    elif args.command == "merge":
+        from .merge import command as merge_command
+
+        merge_args = MergeArgs(**vars(args))
+        check_sample_args(parser, merge_args)
+        if merge_args.num_shards < 2:
+            parser.error("--num-shards must be at least 2")
+        if merge_args.postprocess is None:
+            merge_args.postprocess = []
+        return merge_command(merge_args)
+    elif args.command == "serve":
+        from .daemon import serve
+
+        return serve(ServeArgs(**vars(args)))
+    elif args.command == "bench":
+        from .bench import command as bench_command
+
+        if args.language is None:
+            args.language = ["csharp", "python", "java", "typescript"]
+
+        return bench_command(BenchArgs(**vars(args)))
+    elif args.command == "build-context":
+        build_context_args = BuildContextArgs(**vars(args))
+        if build_context_args.use_next_chunk_as_cfc:
+            if not build_context_args.rerank:
+                parser.error("using the next chunk as context requires reranking")
+            if build_context_args.query_type == "groundtruth":
+                parser.error("--query-type=groundtruth requires --no-next-chunk-as-cfc")
+        if build_context_args.retrieval_budget_ms is not None:
+            if not build_context_args.rerank:
+                parser.error("--retrieval-budget-ms requires reranking")
+            if build_context_args.retrieval_budget_ms <= 0:
+                parser.error("--retrieval-budget-ms must be positive")
+        model_ranker = build_context_args.ranker != "sparse"
+        if (build_context_args.ranking_fn == "cosine_sim") != model_ranker:
+            parser.error("--ranking-fn=cosine_sim requires a model --ranker, and vice versa")
+        if build_context_args.quantize_int8 and build_context_args.device == "cuda":
+            parser.error("--quantize-int8 is only supported on CPU")
+
+        try:
+            from .prompt_builder.augment_with_cfc import command as build_context_command
+        except ImportError as e:
+            print(f"Error importing prompt_builder: {e}, try: `pip install -e '.[prompt_builder]`")
+            return 1
+        build_context_command(build_context_args)
     else:
         parser.print_help()
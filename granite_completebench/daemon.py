@@ -0,0 +1,292 @@
+from argparse import ArgumentTypeError
+from contextlib import redirect_stderr, redirect_stdout
+import io
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+import os
+from pathlib import Path
+import signal
+import sys
+import time
+import traceback
+
+from .cli import EvaluateArgs, ServeArgs
+from .profiling import Profiler
+
+PACKAGE_DIR = Path(__file__).parent
+
+# Prefixes of the environment variables that the libraries read when they are
+# imported or initialized, which a job can't change in a process that already did
+FIXED_ENVIRONMENT_PREFIXES = (
+    "PYTHON",
+    "HF_",
+    "HUGGINGFACE_",
+    "TRANSFORMERS_",
+    "TOKENIZERS_",
+    "CUDA_",
+    "OMP_",
+    "MKL_",
+)
+
+
+def source_mtime() -> int:
+    """The latest modification time of the sources of the package"""
+    return max(path.stat().st_mtime_ns for path in PACKAGE_DIR.rglob("*.py"))
+
+
+def authkey_path(socket_path: str) -> Path:
+    return Path(socket_path).with_suffix(".key")
+
+
+def write_authkey(socket_path: str) -> bytes:
+    """
+    A new key that clients must authenticate with before the daemon unpickles what
+    they send, in a file only readable by the user who started it
+    """
+    authkey = os.urandom(32)
+    path = authkey_path(socket_path)
+    path.unlink(missing_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    return authkey
+
+
+def read_authkey(socket_path: str) -> bytes | None:
+    try:
+        return authkey_path(socket_path).read_bytes()
+    except OSError:
+        return None
+
+
+def fixed_environment(environ: dict[str, str]) -> dict[str, str]:
+    return {
+        name: value
+        for name, value in environ.items()
+        if name.startswith(FIXED_ENVIRONMENT_PREFIXES)
+    }
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class _ConnectionWriter(io.TextIOBase):
+    """A text stream that forwards what is written to it to the client of a job"""
+
+    def __init__(self, conn: Connection, name: str):
+        self.conn = conn
+        self.name = name
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        if len(s) > 0:
+            try:
+                self.conn.send((self.name, s))
+            except OSError as e:
+                raise ClientDisconnected() from e
+        return len(s)
+
+
+class EvaluationDaemon:
+    """
+    Runs evaluate commands sent over a Unix socket one at a time, in a process that
+    keeps the imported libraries, the parsed datasets, the tokenizers and a pool of
+    workers with their parsers between them.
+
+    Once the sources of the package change, the daemon exits rather than run a job
+    with the code it started with, and the client runs it locally instead.
+    Each job runs in the working directory and with the environment of its client;
+    the client also runs it locally if they differ in variables the libraries only
+    read when they start.
+    """
+
+    def __init__(self, args: ServeArgs, authkey: bytes):
+        # imported here rather than at the top, which the client also imports, and
+        # before the pool is started, so that its workers don't import them again
+        from .evaluate import command as evaluate_command
+
+        self.args = args
+        self.authkey = authkey
+        self.evaluate_command = evaluate_command
+        self.started = source_mtime()
+        self.environ = dict(os.environ)
+        # accumulated over the jobs of the daemon, and written after each of them
+        self.profiler = Profiler.from_args(args)
+        self.profile_path = Path(args.daemon_socket).with_suffix(".profile.json")
+        with self.profiler.stage("start_pool"):
+            self.pool = self.open_pool()
+
+    def open_pool(self):
+        from .eval_metric import create_example_pool
+
+        return create_example_pool(self.args.processes)
+
+    def close(self):
+        self.pool.close()
+
+    def serve_forever(self):
+        with Listener(self.args.daemon_socket, family="AF_UNIX", authkey=self.authkey) as listener:
+            os.chmod(self.args.daemon_socket, 0o600)
+            print(f"listening on {self.args.daemon_socket}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    print(f"rejected a client: {e!r}")
+                    continue
+                with conn:
+                    if not self.handle(conn):
+                        return
+
+    def handle(self, conn: Connection) -> bool:
+        """Runs the job sent on conn, returns whether to keep serving"""
+        try:
+            cwd, environ, job_args = conn.recv()
+        except EOFError:
+            # a client checking whether the daemon is running
+            return True
+
+        if source_mtime() != self.started:
+            conn.send(("stale", "the sources changed since the evaluation daemon started"))
+            print("the sources changed, exiting")
+            return False
+
+        client_fixed = fixed_environment(environ)
+        daemon_fixed = fixed_environment(self.environ)
+        if client_fixed != daemon_fixed:
+            names = sorted(
+                name
+                for name in client_fixed.keys() | daemon_fixed.keys()
+                if client_fixed.get(name) != daemon_fixed.get(name)
+            )
+            conn.send(
+                ("stale", f"the environment variables {', '.join(names)} differ from the daemon's")
+            )
+            print(f"refused a job with different {', '.join(names)}")
+            return True
+
+        print(f"job from {cwd}: model={job_args.model} language={job_args.language}")
+        start = time.perf_counter()
+        daemon_cwd = os.getcwd()
+        exit_code = None
+        try:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+            with self.profiler.stage("job"):
+                exit_code = self.run(conn, job_args)
+            conn.send(("exit", exit_code))
+        except (ClientDisconnected, OSError):
+            print("the client disconnected")
+        finally:
+            os.chdir(daemon_cwd)
+            os.environ.clear()
+            os.environ.update(self.environ)
+
+        if exit_code != 0 or self.pool.num_unfinished > 0:
+            # the tasks of an interrupted job would be mistaken for those of the next, and
+            # a failed job may leave its workers in any state
+            with self.profiler.stage("start_pool"):
+                self.pool.close()
+                self.pool = self.open_pool()
+
+        elapsed = time.perf_counter() - start
+        self.profiler.record_latency("job", elapsed)
+        self.profiler.write(self.profile_path)
+        print(f"job done in {elapsed:.2f}s")
+        return True
+
+    def run(self, conn: Connection, args: EvaluateArgs) -> int:
+        self.pool.timeout = args.example_timeout
+        stdout = _ConnectionWriter(conn, "stdout")
+        stderr = _ConnectionWriter(conn, "stderr")
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                self.evaluate_command(args, self.pool)
+            except ArgumentTypeError as e:
+                print(f"{e}")
+                return 1
+            except ClientDisconnected:
+                raise
+            except Exception:
+                traceback.print_exc()
+                return 1
+        return 0
+
+
+def is_running(socket_path: str) -> bool:
+    try:
+        Client(socket_path, family="AF_UNIX", authkey=read_authkey(socket_path)).close()
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    except (AuthenticationError, EOFError):
+        # listening, with another key
+        return True
+    return True
+
+
+def serve(args: ServeArgs):
+    if os.path.exists(args.daemon_socket):
+        if is_running(args.daemon_socket):
+            print(f"An evaluation daemon is already listening on {args.daemon_socket}")
+            return 1
+        # left behind by a daemon that was killed
+        os.unlink(args.daemon_socket)
+    Path(args.daemon_socket).parent.mkdir(parents=True, exist_ok=True)
+
+    daemon = EvaluationDaemon(args, write_authkey(args.daemon_socket))
+    # stop on kill as on Ctrl-C, removing the socket and the workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        with daemon.profiler.dump_to(daemon.profile_path.with_suffix("")):
+            daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+        authkey_path(args.daemon_socket).unlink(missing_ok=True)
+
+
+def submit_job(socket_path: str, args: EvaluateArgs) -> int | None:
+    """
+    Runs an evaluate command in the daemon listening on socket_path, printing its
+    output, and returns its exit code, or None if it should be run locally because
+    no daemon is running or it is out of date with the sources
+    """
+    authkey = read_authkey(socket_path)
+    if authkey is None:
+        return None
+    try:
+        conn = Client(socket_path, family="AF_UNIX", authkey=authkey)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    except (AuthenticationError, EOFError):
+        print(
+            f"Can't authenticate to the daemon on {socket_path}, running locally", file=sys.stderr
+        )
+        return None
+
+    with conn:
+        conn.send((os.getcwd(), dict(os.environ), args))
+        while True:
+            try:
+                kind, value = conn.recv()
+            except EOFError:
+                print("The evaluation daemon exited before the job was done", file=sys.stderr)
+                return 1
+
+            if kind == "stdout":
+                sys.stdout.write(value)
+            elif kind == "stderr":
+                sys.stderr.write(value)
+            elif kind == "stale":
+                print(f"{value}, running locally", file=sys.stderr)
+                return None
+            else:
+                return value
+
+
+__all__ = ["serve", "submit_job"]
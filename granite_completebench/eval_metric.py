@@ -1,16 +1,22 @@
-import json
-from functools import cache, partial
+from contextlib import nullcontext
+from functools import cache, lru_cache, partial
 from pathlib import Path
-from venv import create
+import time
+from typing import Iterable
 
+import numpy as np
 import torch.multiprocessing as mp
 from tqdm import tqdm
+from transformers import PreTrainedTokenizer
 
-from .eval_utils import postprocess_code_lines, extract_identifiers, cal_edit_sim, remove_comments
+from .eval_utils import extract_identifiers, cal_edit_sim, remove_comments
 from .file_utils import read_jsonl, write_json, write_jsonl
-from .postprocess import PostProcessor
-from .types import Example, Metrics, Prediction
-import os
+from .postprocess import PostProcessor, create_postprocessor
+from .profiling import Profiler, percentile
+from .sampling import Sample, bootstrap_ci, select_sample
+from .sharding import Shard, select_shard
+from .types import Example, Metrics, Prediction, RetrievalStats
+from .watchdog import TaskResult, WatchdogPool
 
 
 def compute_id_match(pred_ids, target_ids):
@@ -38,14 +44,139 @@ def compute_edit_sim(samples):
     return cal_edit_sim(refs, hyps)
 
 
-def process_examples(lang: str, postprocessor: PostProcessor, args: tuple[Prediction, Example]):
-    prediction, ex = args
+def compute_generation_stats(samples: list[Prediction]):
+    """Aggregate the per-prediction generation statistics, for the predictions that have them"""
+    stats = {}
+
+    for key in ["latency", "ttft"]:
+        values = sorted(s[key] * 1000 for s in samples if key in s)
+        if len(values) > 0:
+            for p in [50, 95, 99]:
+                stats[f"{key}_p{p}"] = round(percentile(values, p), 2)
+
+    inter_token_latencies = sorted(
+        latency * 1000 for s in samples for latency in s.get("inter_token_latencies", [])
+    )
+    if len(inter_token_latencies) > 0:
+        for p in [50, 95]:
+            stats[f"inter_token_latency_p{p}"] = round(percentile(inter_token_latencies, p), 2)
+
+    for key in ["tokens_per_second", "prompt_tokens", "generated_tokens", "tokens_saved"]:
+        values = [s[key] for s in samples if key in s]
+        if len(values) > 0:
+            stats[key] = round(sum(values) / len(values), 2)
+
+    time_saved = [s["time_saved"] * 1000 for s in samples if "time_saved" in s]
+    if len(time_saved) > 0:
+        stats["time_saved"] = round(sum(time_saved) / len(time_saved), 2)
+
+    return stats
+
+
+def compute_retrieval_stats(retrieval_stats: list[RetrievalStats]):
+    """Aggregate the retrieval statistics of the examples, if their context was built with them"""
+    stats = {}
+    if len(retrieval_stats) == 0:
+        return stats
+
+    values = sorted(s["latency"] * 1000 for s in retrieval_stats)
+    for p in [50, 95]:
+        stats[f"retrieval_latency_p{p}"] = round(percentile(values, p), 2)
+
+    scored = [s.get("num_scored", s["num_candidates"]) for s in retrieval_stats]
+    stats["retrieval_candidates"] = round(sum(scored) / len(scored), 2)
+
+    return stats
+
+
+def compute_stream_stats(truncated_samples: list[dict]):
+    """Aggregate the results of replaying the predictions through a streaming postprocessor"""
+    stats = {}
+    streamed = [s for s in truncated_samples if "stream_stop" in s]
+    if len(streamed) == 0:
+        return stats
+
+    stats["stream_stop"] = round(sum(s["stream_stop"] for s in streamed) / len(streamed) * 100, 2)
+    stats["stream_tokens_saved"] = round(
+        sum(s["stream_tokens_saved"] for s in streamed) / len(streamed), 2
+    )
+    time_saved = [s["stream_time_saved"] * 1000 for s in streamed if "stream_time_saved" in s]
+    if len(time_saved) > 0:
+        stats["stream_time_saved"] = round(sum(time_saved) / len(time_saved), 2)
+
+    return stats
+
+
+def estimate_wasted_tokens(prediction: Prediction, postprocessed: str) -> float | None:
+    """
+    Estimates how many of the generated tokens were discarded by postprocessing,
+    assuming tokens are spread evenly over the characters of the output.
+    """
+    if "generated_tokens" not in prediction:
+        return None
+
+    output = prediction["output"]
+    if len(output) == 0:
+        return 0.0
+    kept = len(postprocessed) if output.startswith(postprocessed) else len(output)
+
+    return prediction["generated_tokens"] * (len(output) - kept) / len(output)
+
+
+def token_end_offsets(tokenizer: PreTrainedTokenizer, outputs: list[str]) -> list[list[int]]:
+    """The offset of the end of each token of each output, as the model would stream them"""
+    encoded = tokenizer(outputs, add_special_tokens=False, return_offsets_mapping=True)
+
+    result = []
+    for output, offsets in zip(outputs, encoded["offset_mapping"]):
+        token_ends = []
+        end = 0
+        for _, token_end in offsets:
+            end = max(end, token_end)
+            token_ends.append(end)
+        if len(token_ends) > 0:
+            token_ends[-1] = len(output)
+        result.append(token_ends)
+
+    return result
+
+
+def replay_stream(
+    postprocessor: PostProcessor, example: Example, output: str, token_ends: list[int]
+) -> int | None:
+    """
+    Streams the tokens of output through the postprocessor, returning how many were
+    generated when it cut the output, or None if it never did
+    """
+    stream = postprocessor.stream(example)
+    start = 0
+    for num_tokens, end in enumerate(token_ends, 1):
+        if stream.feed(output[start:end]) is not None:
+            return num_tokens
+        start = end
+
+    return None
+
+
+def estimate_time_saved(prediction: Prediction, tokens_saved: int, num_tokens: int):
+    """Decode time of the last tokens_saved of the num_tokens tokens of the prediction"""
+    inter_token_latencies = prediction.get("inter_token_latencies")
+    if inter_token_latencies is not None and tokens_saved <= len(inter_token_latencies):
+        return sum(inter_token_latencies[len(inter_token_latencies) - tokens_saved :])
+    if prediction.get("tokens_per_second", 0) > 0:
+        return tokens_saved / prediction["tokens_per_second"]
+    if "latency" in prediction and num_tokens > 0:
+        return prediction["latency"] * tokens_saved / num_tokens
+    return None
+
+
+def match_output(lang: str, prediction: Prediction, ex: Example, output: str):
+    """Compares the postprocessed output of a prediction to the groundtruth"""
     if lang == "typescript" and ex["metadata"]["file"].endswith(".tsx"):
         lang = "tsx"
 
-    output = postprocessor.postprocess(ex, prediction["output"])
-
     stopped = prediction["stop_reason"] != "length" or len(output) < len(prediction["output"])
+    wasted_tokens = estimate_wasted_tokens(prediction, output)
 
     output = remove_comments(output)
     target = ex["groundtruth"]
@@ -66,85 +197,347 @@ def process_examples(lang: str, postprocessor: PostProcessor, args: tuple[Predic
         "pred_ids": pred_ids,
         "target_ids": target_ids,
     }
+    if wasted_tokens is not None:
+        trunc_s["wasted_tokens"] = wasted_tokens
     return trunc_s, em_label
 
 
-def compute_metric_stmt(
-    infile: Path, results_base: Path, prompt_file: Path, language: str, postprocessor: PostProcessor
-) -> Metrics:
-    samples = [d for d in read_jsonl(infile)]
-
-    examples = {}
-    for ex in read_jsonl(prompt_file):
-        examples[ex["metadata"]["task_id"]] = {
+def process_examples(
+    lang: str,
+    postprocessor: PostProcessor,
+    args: tuple[Prediction, Example, list[int] | None],
+):
+    prediction, ex, token_ends = args
+
+    output, timings = postprocessor.postprocess_with_timings(ex, prediction["output"])
+    latencies = {f"postprocess:{name}": t for name, t in timings.items()}
+
+    stream_stats = {}
+    if token_ends is not None:
+        start = time.perf_counter()
+        stop_tokens = replay_stream(postprocessor, ex, prediction["output"], token_ends)
+        latencies[f"stream:{postprocessor.name}"] = time.perf_counter() - start
+
+        stream_stats["stream_stop"] = stop_tokens is not None
+        tokens_saved = len(token_ends) - stop_tokens if stop_tokens is not None else 0
+        stream_stats["stream_tokens_saved"] = tokens_saved
+        time_saved = estimate_time_saved(prediction, tokens_saved, len(token_ends))
+        if time_saved is not None:
+            stream_stats["stream_time_saved"] = time_saved
+
+    start = time.perf_counter()
+    trunc_s, em_label = match_output(lang, prediction, ex, output)
+    latencies["match"] = time.perf_counter() - start
+
+    trunc_s.update(stream_stats)
+    return trunc_s, em_label, latencies
+
+
+@cache
+def _cached_postprocessor(name: str, lang: str) -> PostProcessor:
+    return create_postprocessor(name, lang)
+
+
+def process_named_example(task: tuple[str, str, tuple[Prediction, Example, list[int] | None]]):
+    """process_examples with the postprocessor given by name, for a pool shared by all of them"""
+    lang, postprocessor_name, args = task
+    return process_examples(lang, _cached_postprocessor(postprocessor_name, lang), args)
+
+
+def example_result(language: str, result: TaskResult, prediction: Prediction, ex: Example):
+    """The truncated sample, exact match label and latencies of an example processed in a pool"""
+    if result.outcome == "ok":
+        trunc_s, em_label, latencies = result.value
+    else:
+        # score the output as generated, as an IDE would show it if the
+        # postprocessor didn't return
+        print(f"{result.outcome} postprocessing {prediction['task_id']}")
+        trunc_s, em_label = match_output(language, prediction, ex, prediction["output"])
+        latencies = {}
+    trunc_s["outcome"] = result.outcome
+    return trunc_s, em_label, latencies
+
+
+def index_examples(examples: Iterable[Example]) -> tuple[dict[str, Example], list[RetrievalStats]]:
+    """The examples by task id, with the fields used for scoring, and their retrieval statistics"""
+    indexed = {}
+    retrieval_stats = []
+    for ex in examples:
+        indexed[ex["metadata"]["task_id"]] = {
             "metadata": ex["metadata"],
             "prompt": ex["prompt"],
             "groundtruth": ex["groundtruth"],
             "right_context": ex["right_context"],
         }
+        crossfile_context = ex.get("crossfile_context")
+        if isinstance(crossfile_context, dict) and "retrieval" in crossfile_context:
+            retrieval_stats.append(crossfile_context["retrieval"])
+
+    return indexed, retrieval_stats
+
+
+@lru_cache(maxsize=16)
+def _load_examples(
+    prompt_file: Path, mtime_ns: int, size: int, sample: Sample | None, shard: Shard | None
+):
+    examples = select_sample(list(read_jsonl(prompt_file)), sample)
+    return index_examples(select_shard(examples, shard))
+
+
+def load_examples(
+    prompt_file: Path, sample: Sample | None = None, shard: Shard | None = None
+) -> tuple[dict[str, Example], list[RetrievalStats]]:
+    """
+    index_examples of a prompt file, or of the examples of its sample and/or one of
+    their shards, kept in memory while the file is unchanged so that a long-running
+    process parses each dataset once. They must not be modified.
+    """
+    stat = prompt_file.stat()
+    return _load_examples(prompt_file, stat.st_mtime_ns, stat.st_size, sample, shard)
+
+
+def compute_confidence_intervals(detailed_results: list[dict]):
+    """95% bootstrap confidence intervals of em, es and stop, in their units"""
+    # the resamples pick examples by position, so the intervals would otherwise
+    # depend on the order the caller gave them in
+    ordered = sorted(detailed_results, key=lambda dr: dr["task_id"])
+    values = np.array(
+        [[dr["em"] * 100, dr["es"], dr["stop"] * 100] for dr in ordered],
+        dtype=np.float64,
+    )
+    low, high = bootstrap_ci(values.T)
+    stats = {}
+    for i, metric in enumerate(["em", "es", "stop"]):
+        stats[f"{metric}_ci_low"] = round(float(low[i]), 2)
+        stats[f"{metric}_ci_high"] = round(float(high[i]), 2)
+    return stats
+
+
+def compute_example_stats(example_latencies: list[float], outcomes: list[str]):
+    """Tail latencies of processing an example in the pool, and the examples that failed"""
+    stats = {}
+    values = sorted(latency * 1000 for latency in example_latencies)
+    for p in [50, 95, 99]:
+        stats[f"example_latency_p{p}"] = round(percentile(values, p), 2)
+    stats["example_latency_max"] = round(values[-1], 2) if len(values) > 0 else 0.0
+    stats["timeouts"] = outcomes.count("timeout")
+    stats["crashes"] = outcomes.count("crash")
+    return stats
 
-    assert len(samples) == len(examples), f"{len(samples)} != {len(examples)}"
 
-    truncated_samples = []
-    em_labels = []
+def compute_metric_stmt(
+    infile: Path,
+    results_base: Path,
+    prompt_file: Path,
+    language: str,
+    postprocessor: PostProcessor,
+    profiler: Profiler | None = None,
+    tokenizer: PreTrainedTokenizer | None = None,
+    timeout: float | None = None,
+    pool: WatchdogPool | None = None,
+    sample: Sample | None = None,
+    shard: Shard | None = None,
+) -> Metrics:
+    """
+    Scores the predictions of infile, which are those of the examples of the sample
+    and shard if given. If the tokenizer of the model is given, each prediction is also replayed
+    token by token through the postprocessor's stream to estimate how many tokens
+    stopping generation as soon as it cuts would save.
+    An example that takes longer than timeout seconds to postprocess is scored
+    without postprocessing, with a "timeout" outcome.
+    A pool running process_named_example can be given to reuse its warm workers,
+    in which case its own deadline applies rather than timeout.
+    """
+    if profiler is None:
+        profiler = Profiler()
+
+    with profiler.stage("load"):
+        samples = [d for d in read_jsonl(infile)]
+        examples, retrieval_stats = load_examples(prompt_file, sample, shard)
+
+    assert len(samples) == len(examples), f"{len(samples)} != {len(examples)}"
 
     print("post-processing samples ...")
+    truncated_samples, em_labels, example_latencies = postprocess_samples(
+        samples,
+        [examples[s["task_id"]] for s in samples],
+        language,
+        postprocessor,
+        profiler,
+        tokenizer,
+        timeout,
+        pool,
+    )
+
+    return write_metrics(
+        results_base,
+        samples,
+        truncated_samples,
+        em_labels,
+        example_latencies,
+        retrieval_stats,
+        profiler,
+    )
 
-    pool = mp.Pool(mp.cpu_count() - 1)
-    worker = partial(process_examples, language, postprocessor)
 
-    with tqdm(total=len(samples)) as pbar:
-        for output in pool.imap_unordered(
-            worker, zip(samples, [examples[s["task_id"]] for s in samples])
-        ):
-            trunc_s, em_label = output
-            em_labels.append(em_label)
-            truncated_samples.append(trunc_s)
+def create_example_pool(processes: int | None = None, timeout: float | None = None):
+    """A pool that postprocesses examples with any named postprocessor in any language"""
+    if processes is None:
+        processes = max(1, mp.cpu_count() - 1)
+    return WatchdogPool(process_named_example, processes, timeout)
+
+
+def postprocess_samples(
+    samples: list[Prediction],
+    examples: list[Example],
+    language: str,
+    postprocessor: PostProcessor,
+    profiler: Profiler,
+    tokenizer: PreTrainedTokenizer | None = None,
+    timeout: float | None = None,
+    pool: WatchdogPool | None = None,
+    progress: bool = True,
+) -> tuple[list[dict], list[int], list[float]]:
+    """
+    The truncated sample, exact match label and time taken in the pool of each
+    prediction, postprocessed and matched against its example, in their order
+    """
+    if tokenizer is not None:
+        with profiler.stage("tokenize"):
+            token_ends = token_end_offsets(tokenizer, [s["output"] for s in samples])
+    else:
+        token_ends = [None] * len(samples)
+
+    truncated_samples: list = [None] * len(samples)
+    em_labels: list = [None] * len(samples)
+    example_latencies: list = [None] * len(samples)
+
+    tasks = list(zip(samples, examples, token_ends))
+    if pool is None:
+        worker = partial(process_examples, language, postprocessor)
+        pool_context = WatchdogPool(worker, max(1, mp.cpu_count() - 1), timeout)
+        pool_tasks = tasks
+    else:
+        pool_context = nullcontext(pool)
+        pool_tasks = [(language, postprocessor.name, task) for task in tasks]
+
+    with (
+        profiler.stage("postprocess"),
+        pool_context as pool,
+        tqdm(total=len(samples), disable=not progress) as pbar,
+    ):
+        for result in pool.imap_unordered(pool_tasks):
+            prediction, ex, _ = tasks[result.index]
+            trunc_s, em_label, latencies = example_result(language, result, prediction, ex)
+            profiler.record_latencies(latencies)
+            truncated_samples[result.index] = trunc_s
+            em_labels[result.index] = em_label
+            example_latencies[result.index] = result.elapsed
             pbar.update()
 
-    exact_match = 0
-    stop = 0
+    return truncated_samples, em_labels, example_latencies
+
+
+def write_metrics(
+    results_base: Path,
+    samples: list[Prediction],
+    truncated_samples: list[dict],
+    em_labels: list[int],
+    example_latencies: list[float],
+    retrieval_stats: list[RetrievalStats],
+    profiler: Profiler,
+) -> Metrics:
+    """
+    Writes the truncated samples and their scores to results_base, and aggregates
+    them with the statistics of the predictions into the results.json metrics
+    """
+    res, detailed_results = score_samples(
+        samples, truncated_samples, em_labels, example_latencies, retrieval_stats, profiler
+    )
+    print_metrics(res)
+
+    print(f'writing results to {results_base}/results.json")')
+    with profiler.stage("write"):
+        write_result_files(results_base, truncated_samples, detailed_results, res)
+
+    return res
+
+
+def write_result_files(
+    results_base: Path, truncated_samples: list[dict], detailed_results: list[dict], res: Metrics
+):
     with write_jsonl(results_base / "prediction_truncated.jsonl", create_parents=True) as pt:
-        for trunc_s, em_label in zip(truncated_samples, em_labels):
+        for trunc_s in truncated_samples:
             pt.append(trunc_s)
-            if em_label == 1:
-                exact_match += 1
-            if trunc_s["stop"]:
-                stop += 1
 
-    ### Score calculation
+    with write_jsonl(results_base / "detailed_results.jsonl", create_parents=True) as writer:
+        for dr in detailed_results:
+            writer.append(dr)
 
-    id_em = []
-    edit_similarities = []
+    write_json(results_base / "results.json", res, create_parents=True)
+
+
+def score_samples(
+    samples: list[Prediction],
+    truncated_samples: list[dict],
+    em_labels: list[int],
+    example_latencies: list[float],
+    retrieval_stats: list[RetrievalStats],
+    profiler: Profiler,
+) -> tuple[Metrics, list[dict]]:
+    """
+    The scores of each truncated sample, as in detailed_results.jsonl, and the
+    metrics aggregating them with the statistics of the predictions
+    """
     detailed_results = []
 
-    for idx, trunc_s in enumerate(truncated_samples):
-        identifier_em = int(trunc_s["pred_ids"] == trunc_s["target_ids"])
-        es = cal_edit_sim([trunc_s["target"]], [trunc_s["pred"]])
-        id_tp, id_fp, id_fn = compute_id_match(trunc_s["pred_ids"], trunc_s["target_ids"])
-        id_em.append(identifier_em)
-        edit_similarities.append(es)
-
-        detailed_results.append(
-            {
-                "task_id": trunc_s["task_id"],
-                "em": em_labels[idx],
-                "es": es,
-                "stop": trunc_s["stop"],
-                "id_em": identifier_em,
-                "id_precision": id_tp / (id_tp + id_fp) if (id_tp + id_fp) != 0 else 0,
-                "id_recall": id_tp / (id_tp + id_fn) if (id_tp + id_fn) != 0 else 0,
-                "id_f1": (
-                    2 * id_tp / (2 * id_tp + id_fp + id_fn)
-                    if (2 * id_tp + id_fp + id_fn) != 0
-                    else 0
-                ),
-            }
-        )
+    with profiler.stage("score"):
+        for idx, trunc_s in enumerate(truncated_samples):
+            identifier_em = int(trunc_s["pred_ids"] == trunc_s["target_ids"])
+            start = time.perf_counter()
+            es = cal_edit_sim([trunc_s["target"]], [trunc_s["pred"]])
+            profiler.record_latency("edit_sim", time.perf_counter() - start)
+            id_tp, id_fp, id_fn = compute_id_match(trunc_s["pred_ids"], trunc_s["target_ids"])
+
+            detailed_results.append(
+                {
+                    "task_id": trunc_s["task_id"],
+                    "em": em_labels[idx],
+                    "es": es,
+                    "stop": trunc_s["stop"],
+                    "outcome": trunc_s["outcome"],
+                    "example_latency": example_latencies[idx],
+                    "id_em": identifier_em,
+                    "id_precision": id_tp / (id_tp + id_fp) if (id_tp + id_fp) != 0 else 0,
+                    "id_recall": id_tp / (id_tp + id_fn) if (id_tp + id_fn) != 0 else 0,
+                    "id_f1": (
+                        2 * id_tp / (2 * id_tp + id_fp + id_fn)
+                        if (2 * id_tp + id_fp + id_fn) != 0
+                        else 0
+                    ),
+                }
+            )
+
+    res = aggregate_metrics(samples, truncated_samples, detailed_results, retrieval_stats)
+    return res, detailed_results
+
+
+def aggregate_metrics(
+    samples: list[Prediction],
+    truncated_samples: list[dict],
+    detailed_results: list[dict],
+    retrieval_stats: list[RetrievalStats],
+) -> Metrics:
+    """
+    The results.json metrics of scored samples. Since they only depend on the files
+    written for each example, the results of shards can be combined exactly.
+    """
+    exact_match = sum(1 for dr in detailed_results if dr["em"] == 1)
+    stop = sum(1 for dr in detailed_results if dr["stop"])
 
     em_ratio = round(exact_match / len(samples) * 100, 2)
     stop_ratio = round(stop / len(samples) * 100, 2)
-    edit_sim = round(sum(edit_similarities) / len(edit_similarities), 2)
+    edit_sim = round(sum(dr["es"] for dr in detailed_results) / len(detailed_results), 2)
 
     id_em_ratio = round(
         sum(detailed_results[idx]["id_em"] for idx in range(len(detailed_results)))
@@ -171,20 +564,6 @@ def compute_metric_stmt(
         2,
     )
 
-    print(f"Code Matching: " f"EM {em_ratio:.2f}, " f"ES {edit_sim:.2f}")
-
-    print(
-        f"ID matching: "
-        f"EM {id_em_ratio}, "
-        # f"Precision {id_precision}, "
-        # f"Recall {id_recall}, "
-        f"F1 {id_f1}"
-    )
-
-    with write_jsonl(results_base / "detailed_results.jsonl", create_parents=True) as writer:
-        for dr in detailed_results:
-            writer.append(dr)
-
     res: Metrics = {
         "em": em_ratio,
         "es": edit_sim,
@@ -195,9 +574,54 @@ def compute_metric_stmt(
         "id_f1": id_f1,
         "total": len(truncated_samples),
     }
+    res.update(compute_confidence_intervals(detailed_results))
+    res.update(compute_generation_stats(samples))
+    res.update(compute_retrieval_stats(retrieval_stats))
+    res.update(compute_stream_stats(truncated_samples))
+    res.update(
+        compute_example_stats(
+            [dr["example_latency"] for dr in detailed_results],
+            [dr["outcome"] for dr in detailed_results],
+        )
+    )
+
+    wasted_tokens = [s["wasted_tokens"] for s in truncated_samples if "wasted_tokens" in s]
+    if len(wasted_tokens) > 0:
+        res["wasted_tokens"] = round(sum(wasted_tokens) / len(wasted_tokens), 2)
 
-    # write the results to a file
-    print(f'writing results to {results_base}/results.json")')
-    write_json(results_base / "results.json", res, create_parents=True)
-               
     return res
+
+
+def print_metrics(res: Metrics):
+    if "em_ci_low" in res:
+        print(
+            f"Code Matching: "
+            f"EM {res['em']:.2f} [{res['em_ci_low']:.2f}, {res['em_ci_high']:.2f}], "
+            f"ES {res['es']:.2f} [{res['es_ci_low']:.2f}, {res['es_ci_high']:.2f}]"
+        )
+    else:
+        print(f"Code Matching: " f"EM {res['em']:.2f}, " f"ES {res['es']:.2f}")
+
+    print(
+        f"ID matching: "
+        f"EM {res['id_em']}, "
+        # f"Precision {res['id_precision']}, "
+        # f"Recall {res['id_recall']}, "
+        f"F1 {res['id_f1']}"
+    )
+
+    print(
+        f"Per-example latency: p50 {res['example_latency_p50']:.2f} ms, "
+        f"p99 {res['example_latency_p99']:.2f} ms, max {res['example_latency_max']:.2f} ms, "
+        f"timeouts {res['timeouts']}, crashes {res['crashes']}"
+    )
+    if "wasted_tokens" in res:
+        print(
+            f"Tokens: generated {res.get('generated_tokens', 0):.2f}, "
+            f"discarded by postprocessing {res['wasted_tokens']:.2f} per example"
+        )
+    if "stream_tokens_saved" in res:
+        print(
+            f"Streaming: stopped early {res['stream_stop']:.2f}%, "
+            f"tokens saved {res['stream_tokens_saved']:.2f} per example"
+        )
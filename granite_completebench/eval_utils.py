@@ -17,7 +17,6 @@ import re
 from functools import lru_cache
 from typing import List
 
-import timeout_decorator
 import torch
 from fuzzywuzzy import fuzz
 from nltk.tokenize import RegexpTokenizer
@@ -25,6 +24,7 @@ from sacrebleu.tokenizers.tokenizer_intl import TokenizerV14International
 from tree_sitter import Parser
 
 from .keywords.keywordlist import get_language_keywords
+from .parse_errors import find_error
 
 IDENTIFIER_REGEX = re.compile("[_a-zA-Z][_a-zA-Z0-9]*")
 REGEX_TEXT = (
@@ -114,7 +114,6 @@ def get_bracket_lang_statement(completion):
     return completion[: end_idx + 1] if end_idx else completion
 
 
-@timeout_decorator.timeout(5)
 def get_ast(parser, code):
     assert isinstance(code, str) or isinstance(code, bytes)
     if isinstance(code, str):
@@ -133,21 +132,9 @@ def remove_comments(code):
 
 
 def is_parse_valid(parser, code):
-    def syntax_error(node):
-        if node.type == "ERROR":
-            return True
-        try:
-            for child in node.children:
-                if syntax_error(child):
-                    return True
-        except RecursionError as err:
-            return True
-
-        return False
-
     tree = get_ast(parser, code)
     if tree is not None:
-        return not syntax_error(tree.root_node)
+        return find_error(tree.root_node, include_missing=False) is None
     return False
 
 
@@ -160,12 +147,12 @@ def is_code_parseable(code):
 
 
 def get_python_one_statement(prompt, completion, parser):
-    for i in range(len(completion)):
-        code = prompt + completion[: i + 1]
-        if not is_parse_valid(parser, code):
-            continue
-        if completion[i + 1] == "\n":
-            return completion[: i + 1].rstrip()
+    # A statement can only end before a newline, so the code is only parsed there
+    i = completion.find("\n", 1)
+    while i >= 0:
+        if is_parse_valid(parser, prompt + completion[:i]):
+            return completion[:i].rstrip()
+        i = completion.find("\n", i + 1)
 
     return completion
 
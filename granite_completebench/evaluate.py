@@ -12,6 +12,7 @@
 # limitations under the License.
 
 from argparse import ArgumentTypeError
+from functools import cache
 import json
 import os
 from pathlib import Path
@@ -19,36 +20,70 @@ import random
 from venv import create
 
 import pandas
+from transformers import AutoTokenizer, PreTrainedTokenizer
 
-from .cli import EvaluateArgs
+from .cli import BaseArgs, EvaluateArgs
 from .eval_metric import compute_metric_stmt
 from .file_utils import read_json, read_jsonl, write_json, write_jsonl
 from .postprocess import PostProcessor, create_postprocessor
 from .paths import get_output_path, get_prompt_path, get_result_dir
+from .profiling import Profiler
+from .sampling import Sample
+from .sharding import Shard
 from .types import Example, LabelledMetrics, LabelledPrediction, LabelledResult, Metrics, Prediction
+from .watchdog import WatchdogPool
 
 
 def evaluate(
-    args: EvaluateArgs, model: str, language: str, template: str, postprocessor: PostProcessor
+    args: EvaluateArgs,
+    model: str,
+    language: str,
+    template: str,
+    postprocessor: PostProcessor,
+    tokenizer: PreTrainedTokenizer | None = None,
+    pool: WatchdogPool | None = None,
 ) -> LabelledMetrics | None:
     results: list[LabelledMetrics] = []
 
     model_short = model.split("/")[-1]
     prompt_file = get_prompt_path(args, language)
-    output_file = get_output_path(args, model, language, template)
+    sample = Sample.from_args(args)
+    shard = Shard.from_args(args)
+    output_file = get_output_path(args, model, language, template, sample=sample, shard=shard)
     if not output_file.exists():
         print("No output file found for", output_file)
         return None
 
     result_dir = get_result_dir(
-        args, model, language, template, postprocessor.name, create_dir=True
+        args,
+        model,
+        language,
+        template,
+        postprocessor.name,
+        create_dir=True,
+        sample=sample,
+        shard=shard,
     )
 
     results_file = result_dir / "results.json"
-    if results_file.exists():
-        res: Metrics = read_json(results_file)
-    else:
-        res = compute_metric_stmt(output_file, result_dir, prompt_file, language, postprocessor)
+    res: Metrics | None = read_json(results_file) if results_file.exists() else None
+    if res is None or (tokenizer is not None and "stream_tokens_saved" not in res):
+        profiler = Profiler.from_args(args)
+        with profiler.dump_to(result_dir / "profile"):
+            res = compute_metric_stmt(
+                output_file,
+                result_dir,
+                prompt_file,
+                language,
+                postprocessor,
+                profiler,
+                tokenizer,
+                args.example_timeout,
+                pool,
+                sample,
+                shard,
+            )
+        profiler.write(result_dir / "profile.json")
     return LabelledMetrics(
         **res,
         model=model_short,
@@ -59,11 +94,32 @@ def evaluate(
     )
 
 
-def print_metrics_table(args: EvaluateArgs, results: list[LabelledMetrics]):
-    metrics = ["em", "es", "stop"]
+def print_metrics_table(args: BaseArgs, results: list[LabelledMetrics]):
     short_models = [model.split("/")[-1] for model in args.model]
 
     dataframe = pandas.DataFrame(results)
+    metrics = []
+    for metric in ["em", "es", "stop"]:
+        metrics.append(metric)
+        if f"{metric}_ci_low" in dataframe.columns:
+            # half the width of the 95% confidence interval; its average over languages
+            # is wider than the interval of the average
+            dataframe[f"{metric}_ci"] = (
+                (dataframe[f"{metric}_ci_high"] - dataframe[f"{metric}_ci_low"]) / 2
+            ).round(2)
+            metrics.append(f"{metric}_ci")
+    for metric in [
+        "latency_p50",
+        "latency_p95",
+        "latency_p99",
+        "generated_tokens",
+        "wasted_tokens",
+        "stream_tokens_saved",
+        "stream_time_saved",
+        "retrieval_latency_p95",
+    ]:
+        if metric in dataframe.columns:
+            metrics.append(metric)
     grouped = pandas.pivot_table(
         dataframe, values=metrics, index=["model", "template"], columns=["language"]
     )
@@ -98,7 +154,23 @@ def print_metrics_table(args: EvaluateArgs, results: list[LabelledMetrics]):
         key=lambda ind: ind.map(lambda v: short_models.index(v)),
     )
     grouped = grouped.rename(
-        columns={"em": "Exact Match %", "es": "Edit Similarity", "stop": "Stop %"}, level=0
+        columns={
+            "em": "Exact Match %",
+            "em_ci": "Exact Match ±",
+            "es": "Edit Similarity",
+            "es_ci": "Edit Similarity ±",
+            "stop": "Stop %",
+            "stop_ci": "Stop ±",
+            "latency_p50": "Latency p50 (ms)",
+            "latency_p95": "Latency p95 (ms)",
+            "latency_p99": "Latency p99 (ms)",
+            "generated_tokens": "Generated Tokens",
+            "wasted_tokens": "Wasted Tokens",
+            "stream_tokens_saved": "Stream Tokens Saved",
+            "stream_time_saved": "Stream Time Saved (ms)",
+            "retrieval_latency_p95": "Retrieval p95 (ms)",
+        },
+        level=0,
     )
 
     #    If we want to sort first by language, then by metric type
@@ -108,8 +180,9 @@ def print_metrics_table(args: EvaluateArgs, results: list[LabelledMetrics]):
 
 
 def write_metrics_json(results: list[LabelledMetrics]):
-    json_results = [
-        {
+    json_results = []
+    for result in results:
+        json_result = {
             "model": result["model"].split("/")[-1],
             "language": result["language"],
             "template": result["template"],
@@ -118,8 +191,17 @@ def write_metrics_json(results: list[LabelledMetrics]):
             "editSimilarity": result["es"],
             "stop": result["stop"],
         }
-        for result in results
-    ]
+        for key, json_key in [
+            ("latency_p50", "latencyP50"),
+            ("latency_p95", "latencyP95"),
+            ("latency_p99", "latencyP99"),
+            ("retrieval_latency_p50", "retrievalLatencyP50"),
+            ("retrieval_latency_p95", "retrievalLatencyP95"),
+            ("retrieval_candidates", "retrievalCandidates"),
+        ]:
+            if key in result:
+                json_result[json_key] = result[key]
+        json_results.append(json_result)
 
     write_json(Path("web/public/metrics.json"), json_results, create_parents=True)
 
@@ -218,12 +300,21 @@ def write_samples(args: EvaluateArgs):
                             )
 
 
-def command(args: EvaluateArgs):
+@cache
+def load_tokenizer(model: str) -> PreTrainedTokenizer:
+    return AutoTokenizer.from_pretrained(model, trust_remote_code=True)
+
+
+def command(args: EvaluateArgs, pool: WatchdogPool | None = None):
     os.makedirs(args.results_dir, exist_ok=True)
 
     results: list[LabelledMetrics] = []
 
     for model in args.model:
+        tokenizer = None
+        if args.replay_stream:
+            tokenizer = load_tokenizer(model)
+
         for language in args.language:
             postprocessors: list[PostProcessor] = []
             for postprocessor_name in args.postprocess:
@@ -234,10 +325,16 @@ def command(args: EvaluateArgs):
 
             for template in args.template:
                 for postprocessor in postprocessors:
-                    result = evaluate(args, model, language, template, postprocessor)
+                    result = evaluate(
+                        args, model, language, template, postprocessor, tokenizer, pool
+                    )
                     if result:
                         results.append(result)
 
+    report_results(args, results)
+
+
+def report_results(args: EvaluateArgs, results: list[LabelledMetrics]):
     if args.update_web:
         write_metrics_json(results)
         write_samples(args)
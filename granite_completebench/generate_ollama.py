@@ -4,7 +4,8 @@ from multiprocessing import Pool
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import cast
+import time
+from typing import Iterator
 
 import requests
 from tqdm import tqdm
@@ -13,51 +14,180 @@ from transformers import AutoTokenizer, PreTrainedTokenizer
 from granite_completebench.granite_prompts import (
     AutocompleteOptions,
     create_prompt,
-    get_filename_token,
-    get_fim_pad_token,
+    get_tokenizer_profile,
 )
 
-from .cli import GenerateOllamaArgs
+from .cli import GenerateOllamaArgs, RunOllamaArgs
+from .evaluate import report_results
 from .file_utils import read_jsonl, write_jsonl
-from .types import Example, Prediction
+from .pipeline import open_pool, run_model
+from .postprocess import PostProcessor, create_postprocessor
+from .paths import get_output_path
+from .profiling import Profiler
+from .sampling import Sample, select_sample
+from .sharding import Shard, select_shard
+from .types import Example, LabelledMetrics, Prediction
 
 
 def generate_one(
-    args: GenerateOllamaArgs, ollama_model: str, stop: list[str], item: tuple[Example, str]
+    args: GenerateOllamaArgs,
+    ollama_model: str,
+    stop: list[str],
+    postprocessor: PostProcessor | None,
+    item: tuple[Example, str],
 ):
     d, prompt = item
 
-    ollama_host = os.getenv("OLLAMA_HOST", default="http://localhost:11434")
-    response = requests.post(
-        f"{ollama_host}/api/generate",
-        json={
-            "raw": True,
-            "model": ollama_model,
-            "prompt": prompt,
-            "options": {
-                "temperature": args.temperature,
-                "top_p": args.top_p,
-                "num_predict": args.generation_max_tokens,
-                "stop": stop,
-            },
-            "stream": False,  # Return a single response object
+    request = {
+        "raw": True,
+        "model": ollama_model,
+        "prompt": prompt,
+        "options": {
+            "temperature": args.temperature,
+            "top_p": args.top_p,
+            "num_predict": args.generation_max_tokens,
+            "stop": stop,
         },
-    )
+        "stream": args.stream,
+    }
+
+    if args.stream:
+        return generate_one_streaming(args, d, prompt, request, postprocessor)
+
+    ollama_host = os.getenv("OLLAMA_HOST", default="http://localhost:11434")
+    response = requests.post(f"{ollama_host}/api/generate", json=request)
 
     response.raise_for_status()
     json_response = response.json()
 
-    if json_response["prompt_eval_count"] == args.generation_max_tokens:
-        stop_reason = "length"
+    prediction = Prediction(
+        task_id=d["metadata"]["task_id"],
+        templated=prompt,
+        output=json_response["response"],
+        stop_reason=get_stop_reason(args, json_response),
+    )
+    prediction.update(get_generation_stats(json_response))
+
+    return prediction
+
+
+def generate_one_streaming(
+    args: GenerateOllamaArgs,
+    d: Example,
+    prompt: str,
+    request: dict,
+    postprocessor: PostProcessor | None,
+):
+    """
+    Generates a completion by consuming Ollama's NDJSON stream, recording the time
+    at which each token arrives. If a postprocessor is given, each token is streamed
+    through it; once it cuts the output, the completion is final, and the number of
+    tokens and time after that point are recorded as saved (or, with --stream-abort,
+    generation is stopped there.)
+    """
+    ollama_host = os.getenv("OLLAMA_HOST", default="http://localhost:11434")
+
+    output = ""
+    stream = postprocessor.stream(d) if postprocessor is not None else None
+    token_times: list[float] = []
+    early_stop_tokens: int | None = None
+    early_stop_time = 0.0
+    aborted = False
+    json_response = None
+
+    start = time.perf_counter()
+    with requests.post(f"{ollama_host}/api/generate", json=request, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                token_times.append(time.perf_counter() - start)
+                output += chunk["response"]
+
+                if stream is not None and early_stop_tokens is None:
+                    if stream.feed(chunk["response"]) is not None:
+                        early_stop_tokens = len(token_times)
+                        early_stop_time = token_times[-1]
+                        if args.stream_abort:
+                            # Closing the connection makes Ollama cancel the request
+                            aborted = True
+                            break
+
+            if chunk.get("done"):
+                json_response = chunk
+                break
+    latency = time.perf_counter() - start
+
+    if aborted:
+        stop_reason = "stop:postprocess"
+        stats: dict = {"generated_tokens": len(token_times)}
     else:
-        stop_reason = "stop"
+        assert json_response is not None, "Ollama stream ended without a final response"
+        stop_reason = get_stop_reason(args, json_response)
+        stats = get_generation_stats(json_response)
 
-    return Prediction(
+    stats["latency"] = latency
+    if len(token_times) > 0:
+        stats["ttft"] = token_times[0]
+        stats["inter_token_latencies"] = [
+            round(b - a, 6) for a, b in zip(token_times, token_times[1:])
+        ]
+    if early_stop_tokens is not None:
+        stats["early_stop_tokens"] = early_stop_tokens
+        if not aborted:
+            stats["tokens_saved"] = len(token_times) - early_stop_tokens
+            stats["time_saved"] = token_times[-1] - early_stop_time
+
+    prediction = Prediction(
         task_id=d["metadata"]["task_id"],
         templated=prompt,
-        output=json_response["response"],
+        output=output,
         stop_reason=stop_reason,
     )
+    prediction.update(stats)
+
+    return prediction
+
+
+def get_stop_reason(args: GenerateOllamaArgs, json_response) -> str:
+    # done_reason is "length" when num_predict was reached. Older Ollama versions don't
+    # report it, so fall back to comparing the number of generated tokens to the limit.
+    done_reason = json_response.get("done_reason")
+    if done_reason is None:
+        if json_response.get("eval_count", 0) >= args.generation_max_tokens:
+            return "length"
+    elif done_reason == "length":
+        return "length"
+
+    # Ollama strips the matched stop sequence from the response and doesn't report
+    # which one it was, so an end-of-sequence token can't be told apart from the
+    # filename or pad tokens the way the vLLM path does.
+    return "stop"
+
+
+def get_generation_stats(json_response) -> dict:
+    # Durations in the Ollama response are in nanoseconds. prompt_eval_count and
+    # prompt_eval_duration are omitted when the prompt was entirely cached.
+    stats = {
+        "prompt_tokens": json_response.get("prompt_eval_count", 0),
+        "generated_tokens": json_response.get("eval_count", 0),
+    }
+    if "total_duration" in json_response:
+        stats["latency"] = json_response["total_duration"] / 1e9
+        # Without streaming, the best estimate of the time to first token is the time
+        # spent before decoding started
+        stats["ttft"] = (
+            json_response.get("load_duration", 0) + json_response.get("prompt_eval_duration", 0)
+        ) / 1e9
+    if json_response.get("eval_duration", 0) > 0:
+        stats["tokens_per_second"] = (
+            json_response.get("eval_count", 0) / json_response["eval_duration"] * 1e9
+        )
+
+    return stats
 
 
 def generate(
@@ -66,56 +196,113 @@ def generate(
     ollama_model: str,
     tokenizer: PreTrainedTokenizer,
     options: AutocompleteOptions,
+    postprocessor: PostProcessor | None,
     output_file: Path,
+    profiler: Profiler,
 ):
-    ollama_host = os.getenv("OLLAMA_HOST", default="http://localhost:11434")
-
-    stop: list[str] = [
-        cast(str, tokenizer.eos_token),
-        get_filename_token(tokenizer),
-    ]
-    fim_pad_token = get_fim_pad_token(tokenizer)
-    if fim_pad_token is not None:
-        stop.append(fim_pad_token)
+    stop = get_tokenizer_profile(tokenizer).stop_tokens
 
     prompts = []
-    for d in tqdm(data, desc="Generating prompts"):
-        prompt = create_prompt(d, tokenizer, options)
-        prompts.append(prompt)
+    with profiler.stage("prompt"):
+        for d in tqdm(data, desc="Generating prompts"):
+            prompt = create_prompt(d, tokenizer, options)
+            prompts.append(prompt)
 
     predictions: list[Prediction] = []
 
-    process_item = partial(generate_one, args, ollama_model, stop)
-    with Pool(4) as pool:
+    process_item = partial(generate_one, args, ollama_model, stop, postprocessor)
+    with profiler.stage("generate"), Pool(4) as pool:
         predictions = list(tqdm(pool.imap(process_item, zip(data, prompts)), total=len(prompts)))
 
-    with write_jsonl(output_file, create_parents=True) as writer:
+    with profiler.stage("write"), write_jsonl(output_file, create_parents=True) as writer:
         for d in predictions:
             writer.append(d)
 
 
-def generate_for_model(args: GenerateOllamaArgs, model: str, ollama_model: str):
-    model_short = model.split("/")[-1]
+def generate_one_indexed(
+    args: GenerateOllamaArgs,
+    ollama_model: str,
+    stop: list[str],
+    postprocessor: PostProcessor | None,
+    item: tuple[int, tuple[Example, str]],
+):
+    index, example_item = item
+    return index, generate_one(args, ollama_model, stop, postprocessor, example_item)
+
+
+def stream_predictions(
+    args: GenerateOllamaArgs,
+    ollama_model: str,
+    tokenizer: PreTrainedTokenizer,
+    language: str,
+    data: list[Example],
+    options: AutocompleteOptions,
+    profiler: Profiler,
+) -> Iterator[tuple[int, Prediction]]:
+    """Yields each prediction with the index of its example as soon as it is complete"""
+    stop = get_tokenizer_profile(tokenizer).stop_tokens
 
+    postprocessor = None
+    if args.stream_postprocess is not None:
+        postprocessor = create_postprocessor(args.stream_postprocess, language)
+
+    prompts = []
+    with profiler.stage("prompt"):
+        for d in tqdm(data, desc="Generating prompts"):
+            prompts.append(create_prompt(d, tokenizer, options))
+
+    process_item = partial(generate_one_indexed, args, ollama_model, stop, postprocessor)
+    with Pool(4) as pool:
+        yield from pool.imap_unordered(process_item, enumerate(zip(data, prompts)))
+
+
+def load_tokenizer(model: str) -> PreTrainedTokenizer:
     tokenizer = AutoTokenizer.from_pretrained(model, trust_remote_code=True)
     if tokenizer is None:
         raise ValueError(f"Could not load tokenizer for {model}")
+    return tokenizer
+
+
+def generate_for_model(args: GenerateOllamaArgs, model: str, ollama_model: str):
+    tokenizer = load_tokenizer(model)
 
     # generation
+    sample = Sample.from_args(args)
+    shard = Shard.from_args(args)
     for language in args.language:
         data_path = Path(args.data_root_dir) / language / (args.task + ".jsonl")
-        data = [l for l in read_jsonl(data_path)]
+        load_profiler = Profiler.from_args(args)
+        with load_profiler.stage("load"):
+            data = [l for l in read_jsonl(data_path)]
+            data = select_shard(select_sample(data, sample), shard)
+
+        postprocessor = None
+        if args.stream_postprocess is not None:
+            postprocessor = create_postprocessor(args.stream_postprocess, language)
 
         for template in args.template:
             print(f"====== model={ollama_model} language={language} template={template}")
-            output_file = (
-                Path(args.output_dir) / model_short / language / template / "prediction.jsonl"
+            output_file = get_output_path(
+                args, model, language, template, sample=sample, shard=shard
             )
             if os.path.exists(output_file):
                 continue
 
+            profiler = Profiler.from_args(args)
+            profiler.stages.update(load_profiler.stages)
             options = AutocompleteOptions(template=template)
-            generate(args, data, ollama_model, tokenizer, options, output_file)
+            with profiler.dump_to(output_file.parent / "profile"):
+                generate(
+                    args,
+                    data,
+                    ollama_model,
+                    tokenizer,
+                    options,
+                    postprocessor,
+                    output_file,
+                    profiler,
+                )
+            profiler.write(output_file.parent / "profile.json")
 
 
 def command(args: GenerateOllamaArgs):
@@ -124,4 +311,18 @@ def command(args: GenerateOllamaArgs):
         generate_for_model(args, model, ollama_model)
 
 
-__all__ = ["command"]
+def run_command(args: RunOllamaArgs):
+    print(json.dumps(vars(args), indent=4))
+    os.makedirs(args.results_dir, exist_ok=True)
+
+    results: list[LabelledMetrics] = []
+    with open_pool(args) as pool:
+        for model, ollama_model in zip(args.model, args.ollama_model):
+            tokenizer = load_tokenizer(model)
+            generate_cell = partial(stream_predictions, args, ollama_model, tokenizer)
+            results.extend(run_model(args, pool, model, tokenizer, generate_cell))
+
+    report_results(args, results)
+
+
+__all__ = ["command", "run_command"]
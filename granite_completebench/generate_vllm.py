@@ -1,22 +1,29 @@
+from functools import partial
 import json
 import os
 from pathlib import Path
-from typing import cast
+from typing import Iterator
 
 from tqdm import tqdm
-from transformers import AutoTokenizer, PreTrainedTokenizer
+from transformers import PreTrainedTokenizer
 from transformers.utils import logging
-from vllm import LLM, SamplingParams
+from vllm import LLM, RequestOutput, SamplingParams
 
-from .cli import GenerateVllmArgs
+from .cli import GenerateVllmArgs, RunVllmArgs
+from .evaluate import report_results
 from .file_utils import read_jsonl, write_jsonl
 from .granite_prompts import (
     create_prompt,
     AutocompleteOptions,
-    get_filename_token,
-    get_fim_pad_token,
+    get_tokenizer_profile,
+    TokenizerProfile,
 )
-from .types import Example, Prediction
+from .pipeline import open_pool, run_model
+from .paths import get_output_path
+from .profiling import Profiler
+from .sampling import Sample, select_sample
+from .sharding import Shard, select_shard
+from .types import Example, LabelledMetrics, Prediction
 
 
 def generate(
@@ -26,88 +33,171 @@ def generate(
     sampling_params: SamplingParams,
     llm: LLM,
     output_file: Path,
+    profiler: Profiler,
 ):
     prompts = []
-    for d in tqdm(data, desc="Generating prompts"):
-        prompt = create_prompt(d, tokenizer, options)
-        prompts.append(prompt)
+    with profiler.stage("prompt"):
+        for d in tqdm(data, desc="Generating prompts"):
+            prompt = create_prompt(d, tokenizer, options)
+            prompts.append(prompt)
 
-    outputs = llm.generate(prompts, sampling_params, use_tqdm=True)
+    with profiler.stage("generate"):
+        outputs = llm.generate(prompts, sampling_params, use_tqdm=True)
 
-    filename_token = get_filename_token(tokenizer)
-    fim_pad_token = get_fim_pad_token(tokenizer)
-    eos_token = tokenizer.eos_token
-    assert isinstance(eos_token, str)
-
-    with write_jsonl(output_file, create_parents=True) as writer:
+    profile = get_tokenizer_profile(tokenizer)
+    with profiler.stage("write"), write_jsonl(output_file, create_parents=True) as writer:
         for d, prompt, response in tqdm(zip(data, prompts, outputs)):
-            output = response.outputs[0].text
-            if output.endswith(eos_token):
-                output = output.removesuffix(eos_token)
-                stop_reason = "stop:eos"
-            elif output.endswith(filename_token):
-                output = output.removesuffix(filename_token)
-                stop_reason = "stop:filename"
-            elif fim_pad_token is not None and output.endswith(fim_pad_token):
-                output = output.removesuffix(fim_pad_token)
-                stop_reason = "stop:pad"
-            else:
-                assert len(response.outputs[0].token_ids) == sampling_params.max_tokens
-                stop_reason = "length"
-
-            prediction: Prediction = {
-                "task_id": d["metadata"]["task_id"],
-                "templated": prompt,
-                "output": output,
-                "stop_reason": stop_reason,
-            }
-            writer.append(prediction)
-
+            writer.append(make_prediction(d, prompt, response, profile, sampling_params))
 
-def generate_for_model(args: GenerateVllmArgs, model: str):
-    model_short = model.split("/")[-1]
 
-    # load model
+def make_prediction(
+    d: Example,
+    prompt: str,
+    response: RequestOutput,
+    profile: TokenizerProfile,
+    sampling_params: SamplingParams,
+) -> Prediction:
+    output = response.outputs[0].text
+    if output.endswith(profile.eos_token):
+        output = output.removesuffix(profile.eos_token)
+        stop_reason = "stop:eos"
+    elif output.endswith(profile.filename_token):
+        output = output.removesuffix(profile.filename_token)
+        stop_reason = "stop:filename"
+    elif profile.fim_pad_token is not None and output.endswith(profile.fim_pad_token):
+        output = output.removesuffix(profile.fim_pad_token)
+        stop_reason = "stop:pad"
+    else:
+        assert len(response.outputs[0].token_ids) == sampling_params.max_tokens
+        stop_reason = "length"
+
+    prediction: Prediction = {
+        "task_id": d["metadata"]["task_id"],
+        "templated": prompt,
+        "output": output,
+        "stop_reason": stop_reason,
+    }
+    prediction.update(get_generation_stats(response))
+    return prediction
+
+
+def stream_outputs(
+    llm: LLM, prompts: list[str], sampling_params: SamplingParams
+) -> Iterator[tuple[int, RequestOutput]]:
+    """
+    Like llm.generate, but steps the engine directly to yield each output with the
+    index of its prompt as soon as it is finished, rather than all of them at the end
+    """
+    engine = llm.llm_engine
+    # the requests of a call all finish before the next call, so their ids can be reused
+    for i, prompt in enumerate(prompts):
+        engine.add_request(str(i), prompt, sampling_params)
+
+    while engine.has_unfinished_requests():
+        for output in engine.step():
+            if output.finished:
+                yield int(output.request_id), output
+
+
+def stream_predictions(
+    llm: LLM,
+    tokenizer: PreTrainedTokenizer,
+    sampling_params: SamplingParams,
+    language: str,
+    data: list[Example],
+    options: AutocompleteOptions,
+    profiler: Profiler,
+) -> Iterator[tuple[int, Prediction]]:
+    prompts = []
+    with profiler.stage("prompt"):
+        for d in tqdm(data, desc="Generating prompts"):
+            prompts.append(create_prompt(d, tokenizer, options))
+
+    profile = get_tokenizer_profile(tokenizer)
+    for i, response in stream_outputs(llm, prompts, sampling_params):
+        yield i, make_prediction(data[i], prompts[i], response, profile, sampling_params)
+
+
+def get_generation_stats(response: RequestOutput) -> dict:
+    generated_tokens = len(response.outputs[0].token_ids)
+    stats = {
+        "prompt_tokens": len(response.prompt_token_ids or []),
+        "generated_tokens": generated_tokens,
+    }
+
+    # Request metrics are not reported by all vLLM versions. Since all requests are
+    # submitted at once, times are measured from when the request was first scheduled
+    # rather than from its arrival, to exclude time spent waiting in the queue.
+    metrics = getattr(response, "metrics", None)
+    if metrics is None or metrics.first_scheduled_time is None:
+        return stats
+
+    if metrics.first_token_time is not None:
+        stats["ttft"] = metrics.first_token_time - metrics.first_scheduled_time
+    end_time = metrics.finished_time or metrics.last_token_time
+    if end_time is not None:
+        stats["latency"] = end_time - metrics.first_scheduled_time
+    if metrics.first_token_time is not None and generated_tokens > 1:
+        decode_time = metrics.last_token_time - metrics.first_token_time
+        if decode_time > 0:
+            stats["tokens_per_second"] = (generated_tokens - 1) / decode_time
+
+    return stats
+
+
+def load_model(args: GenerateVllmArgs, model: str):
     llm = LLM(model=model, tensor_parallel_size=args.tp_size, max_model_len=args.model_max_tokens)
-    tokenizer: PreTrainedTokenizer = AutoTokenizer.from_pretrained(
-        args.model, trust_remote_code=True
-    )
+    # the tokenizer the engine loaded for the model
+    tokenizer: PreTrainedTokenizer = llm.get_tokenizer()
+    return llm, tokenizer
 
-    stop_token_ids = [
-        tokenizer.eos_token_id,
-        cast(int, tokenizer.convert_tokens_to_ids(get_filename_token(tokenizer))),
-    ]
-    fim_pad_token = get_fim_pad_token(tokenizer)
-    if fim_pad_token is not None:
-        stop_token_ids.append(cast(int, tokenizer.convert_tokens_to_ids(fim_pad_token)))
-    sampling_params = SamplingParams(
+
+def create_sampling_params(args: GenerateVllmArgs, profile: TokenizerProfile):
+    return SamplingParams(
         temperature=args.temperature,
         top_p=args.top_p,
-        stop_token_ids=stop_token_ids,
+        stop_token_ids=profile.stop_token_ids,
         skip_special_tokens=False,
         include_stop_str_in_output=True,
         max_tokens=args.generation_max_tokens,
     )
 
+
+def generate_for_model(args: GenerateVllmArgs, model: str):
+    llm, tokenizer = load_model(args, model)
+    profile = get_tokenizer_profile(tokenizer)
+
+    sampling_params = create_sampling_params(args, profile)
+
     # setup paths
     if not os.path.isdir(args.output_dir):
         print(f"==== Output dir does not exist. Creating: {args.output_dir} ====")
         os.makedirs(args.output_dir)
 
     # generation
+    sample = Sample.from_args(args)
+    shard = Shard.from_args(args)
     for language in args.language:
         data_path = Path(args.data_root_dir) / language / (args.task + ".jsonl")
-        data = [l for l in read_jsonl(data_path)]
+        load_profiler = Profiler.from_args(args)
+        with load_profiler.stage("load"):
+            data = [l for l in read_jsonl(data_path)]
+            data = select_shard(select_sample(data, sample), shard)
 
         for template in args.template:
             print(f"====== model={model} language={language} template={template}")
-            output_file = (
-                Path(args.output_dir) / model_short / language / template / "prediction.jsonl"
+            output_file = get_output_path(
+                args, model, language, template, sample=sample, shard=shard
             )
             if os.path.exists(output_file):
                 continue
+
+            profiler = Profiler.from_args(args)
+            profiler.stages.update(load_profiler.stages)
             options = AutocompleteOptions(template=template)
-            generate(data, tokenizer, options, sampling_params, llm, output_file)
+            with profiler.dump_to(output_file.parent / "profile"):
+                generate(data, tokenizer, options, sampling_params, llm, output_file, profiler)
+            profiler.write(output_file.parent / "profile.json")
 
 
 def command(args: GenerateVllmArgs):
@@ -116,4 +206,19 @@ def command(args: GenerateVllmArgs):
         generate_for_model(args, model)
 
 
-__all__ = ["command"]
+def run_command(args: RunVllmArgs):
+    print(json.dumps(vars(args), indent=4))
+    os.makedirs(args.results_dir, exist_ok=True)
+
+    results: list[LabelledMetrics] = []
+    with open_pool(args) as pool:
+        for model in args.model:
+            llm, tokenizer = load_model(args, model)
+            sampling_params = create_sampling_params(args, get_tokenizer_profile(tokenizer))
+            generate_cell = partial(stream_predictions, llm, tokenizer, sampling_params)
+            results.extend(run_model(args, pool, model, tokenizer, generate_cell))
+
+    report_results(args, results)
+
+
+__all__ = ["command", "run_command"]
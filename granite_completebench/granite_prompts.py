@@ -1,8 +1,9 @@
 from dataclasses import dataclass
+from functools import cache
 import json
 from pathlib import Path
 from textwrap import dedent
-from typing import Literal, TypedDict
+from typing import Literal, TypedDict, cast
 
 from transformers import AutoTokenizer, PreTrainedTokenizer
 
@@ -105,30 +106,47 @@ def prune_prefix_suffix(
     )
 
 
-def get_fim_pad_token(tokenizer: PreTrainedTokenizer):
+@dataclass(frozen=True)
+class TokenizerProfile:
+    """
+    The special tokens of a model, looked up once in its tokenizer's added tokens
+    """
+
+    fim_prefix: str
+    fim_suffix: str
+    fim_middle: str
+    filename_token: str
+    fim_pad_token: str | None
+    eos_token: str
+    filename_token_id: int
+    fim_pad_token_id: int | None
+    eos_token_id: int
+
+    @property
+    def stop_tokens(self) -> list[str]:
+        """Tokens that end a completion, in the order they are checked for"""
+        stop = [self.eos_token, self.filename_token]
+        if self.fim_pad_token is not None:
+            stop.append(self.fim_pad_token)
+        return stop
+
+    @property
+    def stop_token_ids(self) -> list[int]:
+        stop_ids = [self.eos_token_id, self.filename_token_id]
+        if self.fim_pad_token_id is not None:
+            stop_ids.append(self.fim_pad_token_id)
+        return stop_ids
+
+    @staticmethod
+    def comment_prefix(file: str) -> str:
+        """Line comment marker of the language of file"""
+        return "# " if file.endswith(".py") else "// "
+
+
+@cache
+def get_tokenizer_profile(tokenizer: PreTrainedTokenizer) -> TokenizerProfile:
     all_added_tokens = set(v.content for v in tokenizer.added_tokens_decoder.values())
 
-    if "<|fim_pad|>" in all_added_tokens:
-        return "<|fim_pad|>"
-    else:
-        return None
-
-
-def get_filename_token(tokenizer: PreTrainedTokenizer):
-    all_added_tokens = set(v.content for v in tokenizer.added_tokens_decoder.values())
-
-    if "<filename>" in all_added_tokens:
-        return "<filename>"
-    elif "<|file_sep|>" in all_added_tokens:
-        return "<|file_sep|>"
-    else:
-        raise RuntimeError("Can't find filename special token")
-
-
-def create_prompt(
-    example: Example, tokenizer: PreTrainedTokenizer, options: AutocompleteOptions = DEFAULT_CONFIG
-):
-    all_added_tokens = set(v.content for v in tokenizer.added_tokens_decoder.values())
     if "<fim_prefix>" in all_added_tokens:
         fim_prefix = "<fim_prefix>"
         fim_suffix = "<fim_suffix>"
@@ -140,7 +158,51 @@ def create_prompt(
     else:
         raise RuntimeError("Can't find special FIM tokens")
 
-    filename = get_filename_token(tokenizer)
+    if "<filename>" in all_added_tokens:
+        filename_token = "<filename>"
+    elif "<|file_sep|>" in all_added_tokens:
+        filename_token = "<|file_sep|>"
+    else:
+        raise RuntimeError("Can't find filename special token")
+
+    fim_pad_token = "<|fim_pad|>" if "<|fim_pad|>" in all_added_tokens else None
+
+    eos_token = tokenizer.eos_token
+    assert isinstance(eos_token, str)
+
+    return TokenizerProfile(
+        fim_prefix=fim_prefix,
+        fim_suffix=fim_suffix,
+        fim_middle=fim_middle,
+        filename_token=filename_token,
+        fim_pad_token=fim_pad_token,
+        eos_token=eos_token,
+        filename_token_id=cast(int, tokenizer.convert_tokens_to_ids(filename_token)),
+        fim_pad_token_id=(
+            cast(int, tokenizer.convert_tokens_to_ids(fim_pad_token))
+            if fim_pad_token is not None
+            else None
+        ),
+        eos_token_id=cast(int, tokenizer.eos_token_id),
+    )
+
+
+def get_fim_pad_token(tokenizer: PreTrainedTokenizer):
+    return get_tokenizer_profile(tokenizer).fim_pad_token
+
+
+def get_filename_token(tokenizer: PreTrainedTokenizer):
+    return get_tokenizer_profile(tokenizer).filename_token
+
+
+def create_prompt(
+    example: Example, tokenizer: PreTrainedTokenizer, options: AutocompleteOptions = DEFAULT_CONFIG
+):
+    profile = get_tokenizer_profile(tokenizer)
+    fim_prefix = profile.fim_prefix
+    fim_suffix = profile.fim_suffix
+    fim_middle = profile.fim_middle
+    filename = profile.filename_token
 
     prefix, suffix = prune_prefix_suffix(
         example["prompt"], example["right_context"], tokenizer, options
@@ -156,7 +218,7 @@ def create_prompt(
             + fim_middle
         )
     elif options.template == "comment":
-        comment = "# " if example["metadata"]["file"].endswith(".py") else "// "
+        comment = profile.comment_prefix(example["metadata"]["file"])
 
         def add_comment_markers(text):
             return "\n".join(comment + line for line in text.strip().split("\n"))
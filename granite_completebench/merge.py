@@ -0,0 +1,136 @@
+import json
+from pathlib import Path
+
+from .cli import MergeArgs
+from .eval_metric import aggregate_metrics, load_examples, print_metrics, write_result_files
+from .evaluate import print_metrics_table
+from .file_utils import read_jsonl, write_jsonl
+from .paths import get_output_path, get_prompt_path, get_result_dir
+from .profiling import Profiler
+from .sampling import Sample
+from .sharding import Shard
+from .types import LabelledMetrics
+
+
+class IncompleteShardsError(Exception):
+    pass
+
+
+def read_shards(paths: list[Path], shards: list[Shard], task_ids: list[str]) -> list[dict]:
+    """
+    The records of the files of all the shards in the order of task_ids, checking that
+    the file of each shard has a record for each of its examples and nothing else
+    """
+    records: dict[str, dict] = {}
+    for shard, path in zip(shards, paths):
+        if not path.exists():
+            raise IncompleteShardsError(f"{path} is missing")
+        for record in read_jsonl(path):
+            task_id = record["task_id"]
+            if not shard.contains(task_id):
+                raise IncompleteShardsError(f"{path} has {task_id} of another shard")
+            if task_id in records:
+                raise IncompleteShardsError(f"{path} has {task_id} more than once")
+            records[task_id] = record
+
+    missing = [task_id for task_id in task_ids if task_id not in records]
+    if len(missing) > 0:
+        raise IncompleteShardsError(
+            f"{len(missing)} examples are missing from {paths[0].name}, e.g. {missing[0]}"
+        )
+    if len(records) != len(task_ids):
+        raise IncompleteShardsError(f"{paths[0].name} has examples that aren't in the data")
+
+    return [records[task_id] for task_id in task_ids]
+
+
+def merge_cell(
+    args: MergeArgs, model: str, language: str, template: str, profiler: Profiler
+) -> list[LabelledMetrics]:
+    """
+    Writes the prediction.jsonl of a cell and the result files of each postprocessor
+    from those of its shards, as if they had been generated and evaluated at once
+    """
+    sample = Sample.from_args(args)
+    shards = [Shard(index, args.num_shards) for index in range(args.num_shards)]
+    with profiler.stage("load"):
+        examples, retrieval_stats = load_examples(get_prompt_path(args, language), sample)
+        task_ids = list(examples)
+        samples = read_shards(
+            [
+                get_output_path(args, model, language, template, sample=sample, shard=shard)
+                for shard in shards
+            ],
+            shards,
+            task_ids,
+        )
+
+    output_file = get_output_path(args, model, language, template, sample=sample)
+    with profiler.stage("write"), write_jsonl(output_file) as writer:
+        for prediction in samples:
+            writer.append(prediction)
+    print(f"wrote {len(samples)} predictions to {output_file}")
+
+    results = []
+    for postprocess in args.postprocess:
+        print(f"====== postprocess={postprocess}")
+        shard_dirs = [
+            get_result_dir(args, model, language, template, postprocess, sample=sample, shard=shard)
+            for shard in shards
+        ]
+        with profiler.stage("load"):
+            truncated_samples = read_shards(
+                [path / "prediction_truncated.jsonl" for path in shard_dirs], shards, task_ids
+            )
+            detailed_results = read_shards(
+                [path / "detailed_results.jsonl" for path in shard_dirs], shards, task_ids
+            )
+
+        with profiler.stage("merge"):
+            res = aggregate_metrics(samples, truncated_samples, detailed_results, retrieval_stats)
+        print_metrics(res)
+        result_dir = get_result_dir(
+            args, model, language, template, postprocess, create_dir=True, sample=sample
+        )
+        print(f"writing results to {result_dir}/results.json")
+        with profiler.stage("write"):
+            write_result_files(result_dir, truncated_samples, detailed_results, res)
+
+        results.append(
+            LabelledMetrics(
+                **res,
+                model=model.split("/")[-1],
+                task=args.task,
+                language=language,
+                template=template,
+                postprocess=postprocess,
+            )
+        )
+
+    return results
+
+
+def command(args: MergeArgs):
+    print(json.dumps(vars(args), indent=4))
+
+    results: list[LabelledMetrics] = []
+    for model in args.model:
+        for language in args.language:
+            for template in args.template:
+                print(f"====== model={model} language={language} template={template}")
+                # next to the merged prediction.jsonl, apart from the profiles of evaluate
+                profile_path = get_output_path(
+                    args, model, language, template, sample=Sample.from_args(args)
+                ).with_name("merge.profile")
+                profiler = Profiler.from_args(args)
+                try:
+                    with profiler.dump_to(profile_path):
+                        results += merge_cell(args, model, language, template, profiler)
+                except IncompleteShardsError as e:
+                    print(f"Can't merge the shards: {e}")
+                    return 1
+                profiler.write(profile_path.with_suffix(".profile.json"))
+
+    if len(results) > 0:
+        print_metrics_table(args, results)
+    return 0
@@ -0,0 +1,25 @@
+from tree_sitter import Node, Tree
+
+
+def find_error(node: Node, include_missing: bool = True) -> Node | None:
+    """
+    The first ERROR node, or MISSING node if include_missing, in the subtree of node.
+
+    Tree-sitter flags every node whose subtree contains an error with has_error, so
+    only those are descended into, and the valid parts of the tree, like the prefix of
+    the file before a completion, are skipped without visiting their nodes.
+    """
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if not node.has_error:
+            continue
+        if node.is_error or (include_missing and node.is_missing):
+            return node
+        stack.extend(reversed(node.children))
+
+    return None
+
+
+def has_syntax_error(tree: Tree, include_missing: bool = True) -> bool:
+    return find_error(tree.root_node, include_missing) is not None
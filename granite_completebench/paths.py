@@ -1,6 +1,8 @@
 from pathlib import Path
 
-from .cli import BaseArgs, EvaluateArgs
+from .cli import BaseArgs, EvaluateArgs, MergeArgs
+from .sampling import Sample
+from .sharding import Shard
 
 
 def model_short(model):
@@ -12,9 +14,20 @@ def get_prompt_path(args: BaseArgs, language):
 
 
 def get_output_path(
-    args: BaseArgs, model: str, language: str, snippet_type: str, create_dir: bool = False
+    args: BaseArgs,
+    model: str,
+    language: str,
+    snippet_type: str,
+    create_dir: bool = False,
+    sample: Sample | None = None,
+    shard: Shard | None = None,
 ):
-    path = Path(args.output_dir) / model_short(model) / language / snippet_type / "prediction.jsonl"
+    path = Path(args.output_dir) / model_short(model) / language / snippet_type
+    if sample is not None:
+        path = path / sample.name
+    if shard is not None:
+        path = path / shard.name
+    path = path / "prediction.jsonl"
     if create_dir:
         path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -22,14 +35,20 @@ def get_output_path(
 
 
 def get_result_dir(
-    args: EvaluateArgs,
+    args: EvaluateArgs | MergeArgs,
     model: str,
     language: str,
     snippet_type: str,
     truncate: str,
     create_dir: bool = False,
+    sample: Sample | None = None,
+    shard: Shard | None = None,
 ):
     path = Path(args.results_dir) / model_short(model) / language / snippet_type / truncate
+    if sample is not None:
+        path = path / sample.name
+    if shard is not None:
+        path = path / shard.name
     if create_dir:
         path.mkdir(parents=True, exist_ok=True)
 
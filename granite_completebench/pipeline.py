@@ -0,0 +1,202 @@
+from typing import Callable, Iterator
+
+from tqdm import tqdm
+from transformers import PreTrainedTokenizer
+
+from .cli import EvaluateArgs
+from .eval_metric import (
+    create_example_pool,
+    example_result,
+    index_examples,
+    token_end_offsets,
+    write_metrics,
+)
+from .evaluate import evaluate
+from .file_utils import read_jsonl, write_jsonl
+from .granite_prompts import AutocompleteOptions
+from .paths import get_output_path, get_prompt_path, get_result_dir
+from .postprocess import create_postprocessor
+from .profiling import Profiler
+from .sampling import Sample, select_sample
+from .sharding import Shard, select_shard
+from .types import Example, LabelledMetrics, Prediction
+from .watchdog import WatchdogPool
+
+# Generation waits for the pool once it has this many tasks per worker queued or running
+MAX_QUEUED_PER_WORKER = 4
+
+# Generates the predictions for the examples of a language with a template, yielding
+# each with the index of its example as soon as it is complete
+CellGenerator = Callable[
+    [str, list[Example], AutocompleteOptions, Profiler], Iterator[tuple[int, Prediction]]
+]
+
+
+def open_pool(args: EvaluateArgs) -> WatchdogPool:
+    """
+    The pool that postprocesses and scores the predictions of all the cells of a run.
+    It should be opened before the model is loaded, so that its workers don't inherit it.
+    """
+    return create_example_pool(timeout=args.example_timeout)
+
+
+def run_cell(
+    args: EvaluateArgs,
+    pool: WatchdogPool,
+    model: str,
+    language: str,
+    template: str,
+    data: list[Example],
+    predictions: Iterator[tuple[int, Prediction]],
+    tokenizer: PreTrainedTokenizer | None,
+    profiler: Profiler,
+):
+    """
+    Writes the predictions of a cell as they are generated, while the pool postprocesses
+    and scores each of them with every postprocessor, then writes the results of each
+    postprocessor. The files are the same as those of generate followed by evaluate,
+    in the directories of the sample and shard of args if any, of which data are the
+    examples. If the tokenizer is given, the outputs are also replayed as with
+    --replay-stream.
+    """
+    sample = Sample.from_args(args)
+    shard = Shard.from_args(args)
+    output_file = get_output_path(
+        args, model, language, template, create_dir=True, sample=sample, shard=shard
+    )
+    examples, retrieval_stats = index_examples(data)
+
+    samples: list[Prediction | None] = [None] * len(data)
+    # the results of each postprocessor, in the order of the examples like the samples
+    truncated_samples: list[list] = [[None] * len(data) for _ in args.postprocess]
+    em_labels: list[list] = [[None] * len(data) for _ in args.postprocess]
+    example_latencies: list[list] = [[None] * len(data) for _ in args.postprocess]
+    # index of a task in the pool -> (index of its postprocessor, index of its example)
+    submitted: dict[int, tuple[int, int]] = {}
+
+    def collect(results):
+        for result in results:
+            i, index = submitted.pop(result.index)
+            prediction = samples[index]
+            assert prediction is not None
+            ex = examples[prediction["task_id"]]
+            trunc_s, em_label, latencies = example_result(language, result, prediction, ex)
+            profiler.record_latencies(latencies)
+            truncated_samples[i][index] = trunc_s
+            em_labels[i][index] = em_label
+            example_latencies[i][index] = result.elapsed
+
+    max_queued = MAX_QUEUED_PER_WORKER * len(pool.workers)
+    # predictions complete out of order, but are written in the order of the examples;
+    # the file only gets its final name once it is complete, so that an interrupted run
+    # is generated again rather than evaluated on part of the examples
+    partial_file = output_file.with_suffix(".jsonl.partial")
+    num_written = 0
+    with (
+        profiler.stage("run"),
+        write_jsonl(partial_file) as writer,
+        tqdm(total=len(data)) as pbar,
+    ):
+        for index, prediction in predictions:
+            samples[index] = prediction
+            while num_written < len(samples) and samples[num_written] is not None:
+                writer.append(samples[num_written])
+                num_written += 1
+
+            token_ends = None
+            if tokenizer is not None:
+                token_ends = token_end_offsets(tokenizer, [prediction["output"]])[0]
+            ex = examples[prediction["task_id"]]
+            for i, postprocessor_name in enumerate(args.postprocess):
+                task = (language, postprocessor_name, (prediction, ex, token_ends))
+                submitted[pool.submit(task)] = (i, index)
+
+            collect(pool.results(timeout=0))
+            while pool.num_unfinished > max_queued:
+                collect(pool.results())
+            pbar.update()
+
+        while pool.num_unfinished > 0:
+            collect(pool.results())
+
+    assert num_written == len(samples), f"{num_written} != {len(samples)}"
+    for i in range(len(args.postprocess)):
+        assert all(trunc_s is not None for trunc_s in truncated_samples[i])
+    partial_file.replace(output_file)
+
+    for i, postprocessor_name in enumerate(args.postprocess):
+        print(f"====== postprocess={postprocessor_name}")
+        write_metrics(
+            get_result_dir(
+                args,
+                model,
+                language,
+                template,
+                postprocessor_name,
+                create_dir=True,
+                sample=sample,
+                shard=shard,
+            ),
+            samples,  # type: ignore[arg-type]
+            truncated_samples[i],
+            em_labels[i],
+            example_latencies[i],
+            retrieval_stats,
+            profiler,
+        )
+
+
+def run_model(
+    args: EvaluateArgs,
+    pool: WatchdogPool,
+    model: str,
+    tokenizer: PreTrainedTokenizer,
+    generate_cell: CellGenerator,
+) -> list[LabelledMetrics]:
+    """
+    Runs the cells of a model that weren't generated yet through the pipeline, and
+    evaluates the others as the evaluate command would
+    """
+    replay_tokenizer = tokenizer if args.replay_stream else None
+    sample = Sample.from_args(args)
+    shard = Shard.from_args(args)
+
+    results: list[LabelledMetrics] = []
+    for language in args.language:
+        load_profiler = Profiler.from_args(args)
+        with load_profiler.stage("load"):
+            data = [l for l in read_jsonl(get_prompt_path(args, language))]
+            data = select_shard(select_sample(data, sample), shard)
+        postprocessors = [create_postprocessor(name, language) for name in args.postprocess]
+
+        for template in args.template:
+            print(f"====== model={model} language={language} template={template}")
+            output_file = get_output_path(
+                args, model, language, template, sample=sample, shard=shard
+            )
+            if not output_file.exists():
+                profiler = Profiler.from_args(args)
+                profiler.stages.update(load_profiler.stages)
+                options = AutocompleteOptions(template=template)
+                with profiler.dump_to(output_file.parent / "profile"):
+                    run_cell(
+                        args,
+                        pool,
+                        model,
+                        language,
+                        template,
+                        data,
+                        generate_cell(language, data, options, profiler),
+                        replay_tokenizer,
+                        profiler,
+                    )
+                profiler.write(output_file.parent / "profile.json")
+
+            for postprocessor in postprocessors:
+                result = evaluate(
+                    args, model, language, template, postprocessor, replay_tokenizer, pool
+                )
+                if result:
+                    results.append(result)
+
+    return results
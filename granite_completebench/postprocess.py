@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from functools import cache
+import time
 from typing import ClassVar
 
 from tree_sitter import Language, Parser
@@ -33,6 +34,38 @@ def get_treesitter_language(lang: str):
         raise RuntimeError(f"Unknown language {lang}")
 
 
+class PostProcessorStream(ABC):
+    """
+    Applies a postprocessor to a completion as it is generated, the way Continue applies
+    its stream transforms. feed returns None until postprocessing the completion so far
+    would cut it, and then the length of the postprocessed completion: the rest of the
+    generation would be discarded, so it can stop there.
+    """
+
+    def __init__(self, example: Example):
+        self.example = example
+        self.text = ""
+
+    @abstractmethod
+    def feed(self, chunk: str) -> int | None:
+        pass
+
+
+class RerunPostProcessorStream(PostProcessorStream):
+    """Reruns postprocess on the whole completion after each chunk"""
+
+    def __init__(self, postprocessor: "PostProcessor", example: Example):
+        super().__init__(example)
+        self.postprocessor = postprocessor
+
+    def feed(self, chunk: str) -> int | None:
+        self.text += chunk
+        postprocessed = self.postprocessor.postprocess(self.example, self.text)
+        if len(postprocessed) < len(self.text):
+            return len(postprocessed)
+        return None
+
+
 class PostProcessor(ABC):
     name: ClassVar[str]
 
@@ -54,6 +87,43 @@ class PostProcessor(ABC):
     def postprocess(self, example: Example, prediction: str) -> str:
         pass
 
+    def postprocess_with_timings(
+        self, example: Example, prediction: str
+    ) -> tuple[str, dict[str, float]]:
+        start = time.perf_counter()
+        prediction = self.postprocess(example, prediction)
+        return prediction, {self.name: time.perf_counter() - start}
+
+    def stream(self, example: Example) -> PostProcessorStream:
+        return RerunPostProcessorStream(self, example)
+
+
+class ChainedPostProcessorStream(PostProcessorStream):
+    """
+    Streams the completion through the first postprocessor of a chain. Until it cuts,
+    the completion is unchanged and goes through the rest of the chain as is; once it
+    does, the rest of the chain applies to what it kept.
+    """
+
+    def __init__(self, processors: list[PostProcessor], example: Example):
+        super().__init__(example)
+        first, *self.rest = processors
+        self.first = first.stream(example)
+        self.rest_stream = (
+            ChainedPostProcessorStream(self.rest, example) if len(self.rest) > 0 else None
+        )
+
+    def feed(self, chunk: str) -> int | None:
+        self.text += chunk
+        cut = self.first.feed(chunk)
+        if cut is not None:
+            prediction = self.text[0:cut]
+            for processor in self.rest:
+                prediction = processor.postprocess(self.example, prediction)
+            return len(prediction)
+
+        return self.rest_stream.feed(chunk) if self.rest_stream is not None else None
+
 
 class ChainedPostProcessor(PostProcessor):
     processor_classes: ClassVar[list[type[PostProcessor]]]
@@ -67,6 +137,21 @@ class ChainedPostProcessor(PostProcessor):
 
         return prediction
 
+    def postprocess_with_timings(
+        self, example: Example, prediction: str
+    ) -> tuple[str, dict[str, float]]:
+        timings: dict[str, float] = {}
+        for processor in self.processors:
+            prediction, processor_timings = processor.postprocess_with_timings(example, prediction)
+            timings.update(processor_timings)
+
+        return prediction, timings
+
+    def stream(self, example: Example) -> PostProcessorStream:
+        if len(self.processors) == 0:
+            return RerunPostProcessorStream(self, example)
+        return ChainedPostProcessorStream(self.processors, example)
+
 
 @cache
 def _get_postprocessor_map():
@@ -86,5 +171,9 @@ def _get_postprocessor_map():
     return postprocessor_map
 
 
+def get_postprocessor_names() -> list[str]:
+    return list(_get_postprocessor_map().keys())
+
+
 def create_postprocessor(name: str, lang: str) -> PostProcessor:
     return _get_postprocessor_map()[name](lang)
@@ -1,28 +1,10 @@
-from tree_sitter import Tree
-from ..types import Example
-from ..postprocess import PostProcessor
-
-
-def check_for_errors(tree: Tree):
-    cursor = tree.walk()
-    has_error: bool = False
-
-    def traverse():
-        nonlocal has_error
+from typing import Callable
 
-        node = cursor.node
-        if node and (node.is_error or node.is_missing):
-            has_error = True
+from tree_sitter import Parser
 
-        if cursor.goto_first_child():
-            traverse()
-            while not has_error and cursor.goto_next_sibling():
-                traverse()
-
-            cursor.goto_parent()
-
-    traverse()
-    return has_error
+from ..parse_errors import has_syntax_error
+from ..types import Example
+from ..postprocess import PostProcessor, PostProcessorStream
 
 
 def truncate_to_dedent(prefix, pred, suffix):
@@ -50,25 +32,68 @@ def truncate_to_dedent(prefix, pred, suffix):
     return pred
 
 
-class TruncateClose(PostProcessor):
-    name = "truncate_close"
+def get_indents(example: Example) -> tuple[int, int]:
+    """Indentation of the line of the cursor and of the first non-blank line of the suffix"""
+    prefix = example["prompt"]
+    suffix = example["right_context"]
+
+    last_prefix_line = prefix.split("\n")[-1]
+    try:
+        first_suffix_line = next(l for l in suffix.split("\n") if l.strip() != "")
+    except StopIteration:
+        first_suffix_line = None
+
+    indent = len(last_prefix_line) - len(last_prefix_line.lstrip())
+    next_indent = (
+        len(first_suffix_line) - len(first_suffix_line.lstrip())
+        if first_suffix_line is not None
+        else 0
+    )
+    return indent, next_indent
+
+
+class CloseMatcher:
+    """
+    Finds where a completion can be cut before the bracket that starts the suffix,
+    so that the file parses without errors
+    """
+
+    def __init__(self, example: Example, get_parser: Callable[[Example], Parser]):
+        self.close_bytes = None
 
-    def truncate_to_dedent(self, example: Example, prediction: str) -> str:
-        prefix = example["prompt"]
         suffix = example["right_context"]
+        suffix_stripped = suffix.lstrip()
+        if len(suffix_stripped) == 0:
+            return
+        close_char = suffix_stripped[0]
+        if close_char not in "]})":
+            return
+
+        self.parser = get_parser(example)
+        self.prefix_bytes = bytes(example["prompt"], "utf8")
+        self.close_bytes = bytes(close_char, "utf8")
+        suffix_bytes = bytes(suffix, "utf8")
+        self.suffix_close_offset = suffix_bytes.find(self.close_bytes)
+        self.suffix_whitespace = suffix_bytes[0 : self.suffix_close_offset]
+        self.suffix_tail = suffix_bytes[self.suffix_close_offset :]
+
+    def cut(self, pred_bytes: bytes, pred_close_offset: int) -> str | None:
+        """The completion before the close character at pred_close_offset, if it parses"""
+        pred_selection = pred_bytes[0:pred_close_offset]
+        tree = self.parser.parse(self.prefix_bytes + pred_selection + self.suffix_tail)
+        if has_syntax_error(tree):
+            return None
+
+        if pred_selection.endswith(self.suffix_whitespace):
+            pred_selection = pred_selection[0 : -self.suffix_close_offset]
+        return pred_selection.decode("utf-8")
 
-        last_prefix_line = prefix.split("\n")[-1]
-        try:
-            first_suffix_line = next(l for l in suffix.split("\n") if l.strip() != "")
-        except StopIteration:
-            first_suffix_line = None
 
-        indent = len(last_prefix_line) - len(last_prefix_line.lstrip())
-        next_indent = (
-            len(first_suffix_line) - len(first_suffix_line.lstrip())
-            if first_suffix_line is not None
-            else 0
-        )
+class TruncateClose(PostProcessor):
+    name = "truncate_close"
+
+    def truncate_to_dedent(self, example: Example, prediction: str) -> str:
+        indent, next_indent = get_indents(example)
 
         pos = 0
         for line in prediction.split("\n"):
@@ -81,35 +106,18 @@ class TruncateClose(PostProcessor):
         return prediction
 
     def truncate_to_close(self, example: Example, prediction: str):
-        prefix = example["prompt"]
-        suffix = example["right_context"]
-
-        suffix_stripped = suffix.lstrip()
-        if len(suffix_stripped) == 0:
-            return prediction
-        close_char = suffix_stripped[0]
-        if close_char not in "]})":
+        matcher = CloseMatcher(example, self.get_parser)
+        if matcher.close_bytes is None:
             return prediction
 
-        parser = self.get_parser(example)
-
-        prefix_bytes = bytes(prefix, "utf8")
         pred_bytes = bytes(prediction, "utf8")
-        close_bytes = bytes(close_char, "utf8")
-        suffix_bytes = bytes(suffix, "utf8")
-        suffix_close_offset = suffix_bytes.find(close_bytes)
-
-        pred_close_offset = pred_bytes.find(close_bytes)
+        pred_close_offset = pred_bytes.find(matcher.close_bytes)
         while pred_close_offset >= 0:
-            pred_selection = pred_bytes[0:pred_close_offset]
-            contents = prefix_bytes + pred_selection + suffix_bytes[suffix_close_offset:]
-            tree = parser.parse(contents)
-            if not check_for_errors(tree):
-                if pred_selection.endswith(suffix_bytes[0:suffix_close_offset]):
-                    pred_selection = pred_selection[0:-suffix_close_offset]
-                return pred_selection.decode("utf-8")
+            cut = matcher.cut(pred_bytes, pred_close_offset)
+            if cut is not None:
+                return cut
 
-            pred_close_offset = pred_bytes.find(close_bytes, pred_close_offset + 1)
+            pred_close_offset = pred_bytes.find(matcher.close_bytes, pred_close_offset + 1)
 
         return prediction
 
@@ -120,3 +128,66 @@ class TruncateClose(PostProcessor):
             prediction = self.truncate_to_close(example, prediction)
 
         return prediction
+
+    def stream(self, example: Example) -> PostProcessorStream:
+        if self.lang == "python":
+            return TruncateDedentStream(example)
+        else:
+            return TruncateCloseStream(example, CloseMatcher(example, self.get_parser))
+
+
+class TruncateDedentStream(PostProcessorStream):
+    """
+    Checks each line of the completion once, as soon as its indentation is known,
+    that is when it has a non-blank character
+    """
+
+    def __init__(self, example: Example):
+        super().__init__(example)
+        self.indent, self.next_indent = get_indents(example)
+        self.line_start = 0
+        self.line_checked = False
+
+    def feed(self, chunk: str) -> int | None:
+        self.text += chunk
+        if not self.next_indent < self.indent:
+            return None
+
+        while True:
+            end = self.text.find("\n", self.line_start)
+            line = self.text[self.line_start : end if end >= 0 else len(self.text)]
+            if not self.line_checked and self.line_start > 0 and line.strip() != "":
+                self.line_checked = True
+                if len(line) - len(line.lstrip()) <= self.next_indent:
+                    return len(self.text[0 : self.line_start].rstrip())
+            if end < 0:
+                return None
+            self.line_start = end + 1
+            self.line_checked = False
+
+
+class TruncateCloseStream(PostProcessorStream):
+    """Parses the completion once at each close character, as it arrives"""
+
+    def __init__(self, example: Example, matcher: CloseMatcher):
+        super().__init__(example)
+        self.matcher = matcher
+        self.pred_bytes = b""
+
+    def feed(self, chunk: str) -> int | None:
+        if self.matcher.close_bytes is None:
+            return None
+
+        start = len(self.pred_bytes)
+        self.pred_bytes += bytes(chunk, "utf8")
+        pred_close_offset = self.pred_bytes.find(self.matcher.close_bytes, start)
+        while pred_close_offset >= 0:
+            cut = self.matcher.cut(self.pred_bytes, pred_close_offset)
+            if cut is not None:
+                return len(cut)
+
+            pred_close_offset = self.pred_bytes.find(
+                self.matcher.close_bytes, pred_close_offset + 1
+            )
+
+        return None
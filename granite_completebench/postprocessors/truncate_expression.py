@@ -1,7 +1,11 @@
-from ..eval_utils import postprocess_code_lines
-from ..postprocess import PostProcessor
+import re
+
+from ..eval_utils import is_parse_valid, postprocess_code_lines
+from ..postprocess import PostProcessor, PostProcessorStream
 from ..types import Example
 
+STATEMENT_END_REGEX = re.compile("[;{}]")
+
 
 class TruncateExpression(PostProcessor):
     name = "truncate_expression"
@@ -10,3 +14,59 @@ class TruncateExpression(PostProcessor):
         return postprocess_code_lines(
             example["prompt"], prediction, self.get_parser(example), self.lang
         )
+
+    def stream(self, example: Example) -> PostProcessorStream:
+        if self.lang == "python":
+            return TruncateStatementStream(example, self)
+        else:
+            return TruncateBracketStream(example)
+
+
+class TruncateStatementStream(PostProcessorStream):
+    """Parses the completion once before each newline, as it arrives"""
+
+    def __init__(self, example: Example, postprocessor: TruncateExpression):
+        super().__init__(example)
+        self.parser = postprocessor.get_parser(example)
+        self.failed = False
+
+    def feed(self, chunk: str) -> int | None:
+        start = max(len(self.text), 1)
+        self.text += chunk
+        if self.failed:
+            return None
+
+        i = self.text.find("\n", start)
+        while i >= 0:
+            try:
+                if is_parse_valid(self.parser, self.example["prompt"] + self.text[:i]):
+                    return len(self.text[:i].rstrip())
+            except Exception:
+                # postprocess_code_lines keeps the whole completion when parsing fails
+                self.failed = True
+                return None
+            i = self.text.find("\n", i + 1)
+
+        return None
+
+
+class TruncateBracketStream(PostProcessorStream):
+    """Waits for the first character that ends a statement in languages with brackets"""
+
+    def __init__(self, example: Example):
+        super().__init__(example)
+        self.end_idx: int | None = None
+
+    def feed(self, chunk: str) -> int | None:
+        start = len(self.text)
+        self.text += chunk
+
+        if self.end_idx is None:
+            match = STATEMENT_END_REGEX.search(self.text, start)
+            if match is not None:
+                self.end_idx = match.start()
+
+        # as in get_bracket_lang_statement, a completion that starts with one is kept
+        if self.end_idx and len(self.text) > self.end_idx + 1:
+            return self.end_idx + 1
+        return None
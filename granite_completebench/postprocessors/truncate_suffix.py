@@ -1,23 +1,105 @@
+from functools import lru_cache
+
 from ..types import Example
-from ..postprocess import PostProcessor
+from ..postprocess import PostProcessor, PostProcessorStream
 
+SEQUENCE_LENGTH = 20
 
-class TruncateSuffix(PostProcessor):
-    name = "truncate_suffix"
 
-    def postprocess(self, example: Example, prediction: str) -> str:
+class SuffixMatcher:
+    """
+    Finds where a completion starts repeating the text that follows the cursor: the
+    first window of SEQUENCE_LENGTH characters that occurs at the start of the suffix
+    """
+
+    def __init__(self, suffix: str, sequence_length: int = SEQUENCE_LENGTH):
+        self.sequence_length = sequence_length
+
         # This duplicates the handling in
         # continue/autocomplete/filtering/streamTransforms/charStream.ts:stopAtStartOf
-
-        suffix = example["right_context"]
-        sequence_length = 20
         if len(suffix) < sequence_length:
+            target_part = ""
+        else:
+            target_part = suffix.lstrip()[0 : int(sequence_length * 1.5)]
+
+        # a window is a substring of target_part exactly when it is one of its n-grams
+        self.grams = frozenset(
+            target_part[i : i + sequence_length]
+            for i in range(len(target_part) - sequence_length + 1)
+        )
+
+    def find(self, prediction: str, start: int = 0) -> int | None:
+        """
+        Start of the first matching window of prediction at or after start, or None.
+        As in Continue, the window that ends the prediction is never checked.
+        """
+        end = len(prediction) - 1
+        positions = (prediction.find(gram, start, end) for gram in self.grams)
+        return min((i for i in positions if i >= 0), default=None)
+
+    def stream(self) -> "SuffixStream":
+        return SuffixStream(self)
+
+
+class SuffixStream:
+    """
+    Incremental SuffixMatcher.find over a completion that arrives in chunks, checking
+    each window once
+    """
+
+    def __init__(self, matcher: SuffixMatcher):
+        self.matcher = matcher
+        # the last sequence_length characters fed, which start at tail_start in the completion
+        self.tail = ""
+        self.tail_start = 0
+        self.match: int | None = None
+
+    def feed(self, chunk: str) -> int | None:
+        """
+        Adds chunk to the completion; returns the position to cut the completion at
+        once a window matches, that is SuffixMatcher.find of the completion so far
+        """
+        if self.match is not None or len(self.matcher.grams) == 0:
+            return self.match
+
+        n = self.matcher.sequence_length
+        text = self.tail + chunk
+        i = self.matcher.find(text)
+        if i is not None:
+            self.match = self.tail_start + i
+            return self.match
+
+        # keep the windows that weren't checked yet, the last one is never complete
+        keep = min(len(text), n)
+        self.tail_start += len(text) - keep
+        self.tail = text[len(text) - keep :]
+        return None
+
+
+@lru_cache(maxsize=1024)
+def suffix_matcher(suffix: str) -> SuffixMatcher:
+    """The matcher of the suffix of an example, shared by all its predictions"""
+    return SuffixMatcher(suffix)
+
+
+class TruncateSuffix(PostProcessor):
+    name = "truncate_suffix"
+
+    def postprocess(self, example: Example, prediction: str) -> str:
+        i = suffix_matcher(example["right_context"]).find(prediction)
+        if i is None:
             return prediction
 
-        targetPart = suffix.lstrip()[0 : int(sequence_length * 1.5)]
+        return prediction[0:i]
+
+    def stream(self, example: Example) -> PostProcessorStream:
+        return TruncateSuffixStream(example)
+
 
-        for i in range(0, len(prediction) - sequence_length):
-            if prediction[i : i + sequence_length] in targetPart:
-                return prediction[0:i]
+class TruncateSuffixStream(PostProcessorStream):
+    def __init__(self, example: Example):
+        super().__init__(example)
+        self.suffix_stream = suffix_matcher(example["right_context"]).stream()
 
-        return prediction
+    def feed(self, chunk: str) -> int | None:
+        return self.suffix_stream.feed(chunk)
@@ -0,0 +1,146 @@
+import bisect
+import cProfile
+import statistics
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Literal
+
+from .file_utils import write_json
+
+# Upper bounds (in milliseconds) of the buckets of the per-example latency histograms
+HISTOGRAM_BUCKETS_MS = [0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3000, 10000]
+
+
+@dataclass
+class StageTime:
+    wall: float = 0.0
+    cpu: float = 0.0
+    calls: int = 0
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if len(sorted_values) == 0:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(values: list[float]):
+    values_ms = sorted(v * 1000 for v in values)
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for v in values_ms:
+        counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, v)] += 1
+
+    return {
+        "count": len(values_ms),
+        "total_ms": sum(values_ms),
+        "mean_ms": statistics.fmean(values_ms) if values_ms else 0.0,
+        "p50_ms": percentile(values_ms, 50),
+        "p90_ms": percentile(values_ms, 90),
+        "p99_ms": percentile(values_ms, 99),
+        "max_ms": values_ms[-1] if values_ms else 0.0,
+        "histogram": {
+            "le_ms": HISTOGRAM_BUCKETS_MS + ["inf"],
+            "counts": counts,
+        },
+    }
+
+
+@dataclass
+class Profiler:
+    """
+    Collects per-stage wall/CPU times and per-example latencies. When not enabled,
+    all the recording methods are cheap no-ops so callers don't need to check.
+    """
+
+    enabled: bool = False
+    dump: Literal["cprofile", "pyinstrument"] | None = None
+    stages: dict[str, StageTime] = field(default_factory=dict)
+    latencies: dict[str, list[float]] = field(default_factory=dict)
+
+    @classmethod
+    def from_args(cls, args) -> "Profiler":
+        return cls(enabled=args.profile, dump=args.profile_dump if args.profile else None)
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_stage_time(
+                name, time.perf_counter() - wall_start, time.process_time() - cpu_start
+            )
+
+    def add_stage_time(self, name: str, wall: float, cpu: float):
+        if not self.enabled:
+            return
+
+        stage = self.stages.setdefault(name, StageTime())
+        stage.wall += wall
+        stage.cpu += cpu
+        stage.calls += 1
+
+    def record_latency(self, name: str, seconds: float):
+        if self.enabled:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def record_latencies(self, latencies: dict[str, float]):
+        if self.enabled:
+            for name, seconds in latencies.items():
+                self.latencies.setdefault(name, []).append(seconds)
+
+    def report(self):
+        return {
+            "stages": {
+                name: {"wall_s": stage.wall, "cpu_s": stage.cpu, "calls": stage.calls}
+                for name, stage in self.stages.items()
+            },
+            "latencies": {
+                name: summarize_latencies(values) for name, values in self.latencies.items()
+            },
+        }
+
+    def write(self, path: Path):
+        if not self.enabled:
+            return
+
+        print(f"writing profile to {path}")
+        write_json(path, self.report(), create_parents=True)
+
+    @contextmanager
+    def dump_to(self, path: Path):
+        """
+        Runs the body under cProfile or pyinstrument, if requested, and writes the
+        result to path with a suitable suffix. Only the current process is profiled.
+        """
+        if self.dump == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                path.parent.mkdir(parents=True, exist_ok=True)
+                profile.dump_stats(path.with_suffix(".prof"))
+        elif self.dump == "pyinstrument":
+            from pyinstrument import Profiler as PyinstrumentProfiler
+
+            profiler = PyinstrumentProfiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.with_suffix(".html").write_text(profiler.output_html(), encoding="utf8")
+        else:
+            yield
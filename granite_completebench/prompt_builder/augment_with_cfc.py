@@ -0,0 +1,490 @@
+# Copyright Amazon.com, Inc. or its affiliates. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import tempfile
+import itertools
+import dataclasses
+import multiprocessing as mp
+from pathlib import Path
+from tqdm import tqdm
+from functools import partial
+from ..cli import BuildContextArgs
+from ..file_utils import write_json, write_jsonl
+from ..profiling import Profiler, summarize_latencies
+from .rerank_utils import lexical_scores, ranked_indices
+from .encoder_service import EncoderService
+from .chunk_index import load_repository_index
+from .embedding_index import EmbeddingIndex, create_embedding_file, embedding_index_path, write_embeddings
+
+QUERY_LENGTH = 10  # last N lines from prompt will be query
+
+# with a retrieval budget, the candidates are scored in stages of 64, 128, 256...
+# of the nearest ones, for as long as the next stage is expected to fit the budget
+FIRST_STAGE_CANDIDATES = 64
+
+
+def score_candidates(
+        args,
+        query,
+        candidate_code_chunks,
+        candidate_code_chunk_rows,
+        semantic_ranker,
+        sparse_index,
+        embedding_index,
+        query_embedding
+):
+    if args.ranking_fn == "cosine_sim":
+        return semantic_ranker.scores(
+            query,
+            candidate_code_chunks,
+            embedding_index=embedding_index,
+            doc_rows=candidate_code_chunk_rows,
+            query_embedding=query_embedding
+        )
+    else:
+        return lexical_scores(
+            query,
+            candidate_code_chunks,
+            args.ranking_fn,
+            sparse_index=sparse_index,
+            doc_rows=candidate_code_chunk_rows
+        )
+
+
+def get_crossfile_context_from_chunks(
+        args,
+        language,
+        prompt,
+        code_chunks,
+        code_chunk_ids,
+        groundtruth,
+        semantic_ranker,
+        sparse_index=None,
+        code_chunk_rows=None,
+        embedding_index=None
+):
+    assert len(code_chunks) != 0
+    candidate_code_chunks = code_chunks[:args.maximum_chunk_to_rerank]
+    candidate_code_chunk_ids = code_chunk_ids[:args.maximum_chunk_to_rerank]
+    candidate_code_chunk_rows = None
+    if code_chunk_rows is not None:
+        candidate_code_chunk_rows = code_chunk_rows[:args.maximum_chunk_to_rerank]
+
+    ranking_scores = None
+    meta_data = {"num_candidates": len(candidate_code_chunks)}
+    # indices of the candidates, best first
+    ranking = range(len(candidate_code_chunks))
+
+    if args.rerank:
+        if args.query_type == "groundtruth":
+            # oracle experiment
+            prompt_lines = [pl for pl in prompt.split("\n") if pl.strip()]
+            groundtruth_lines = [gt for gt in groundtruth.split("\n") if gt.strip()]
+            code_lines = prompt_lines + groundtruth_lines
+            query = "\n".join(code_lines[-QUERY_LENGTH:])
+        elif args.query_type == "last_n_lines":
+            prompt_lines = [pl for pl in prompt.split("\n") if pl.strip()]
+            query = "\n".join(prompt_lines[-QUERY_LENGTH:])
+        else:
+            raise NotImplementedError
+
+        meta_data["query"] = query
+        start = time.perf_counter()
+
+        num_candidates = len(candidate_code_chunks)
+        num_scored = num_candidates
+        query_embedding = None
+        if args.retrieval_budget_ms is not None:
+            num_scored = min(FIRST_STAGE_CANDIDATES, num_candidates)
+            if args.ranking_fn == "cosine_sim" and embedding_index is not None:
+                # encoded once for all the stages
+                query_embedding = semantic_ranker.encode([query])[0]
+
+        while True:
+            stage_start = time.perf_counter()
+            ranking_scores = score_candidates(
+                args,
+                query,
+                candidate_code_chunks[:num_scored],
+                candidate_code_chunk_rows[:num_scored] if candidate_code_chunk_rows is not None else None,
+                semantic_ranker,
+                sparse_index,
+                embedding_index,
+                query_embedding
+            )
+            now = time.perf_counter()
+            if num_scored == num_candidates:
+                break
+            # the next stage scores twice as many candidates, so takes about twice as long
+            if (now - start + 2 * (now - stage_start)) * 1000 > args.retrieval_budget_ms:
+                break
+            num_scored = min(2 * num_scored, num_candidates)
+
+        # ranked lazily, since usually only the first few are needed
+        candidate_code_chunk_ids = candidate_code_chunk_ids[:num_scored]
+        ranking = ranked_indices(ranking_scores, candidate_code_chunk_ids, args.maximum_cross_file_chunk)
+
+        meta_data["latency"] = time.perf_counter() - start
+        meta_data["num_scored"] = num_scored
+
+    top_k = min(args.maximum_cross_file_chunk, len(candidate_code_chunk_ids))
+    if top_k == 0:
+        return [], "", meta_data
+
+    selected_chunks = []
+    selected_chunks_filename = []
+    selected_chunks_scores = []
+
+    if args.use_next_chunk_as_cfc:
+        # the chunks of each file are consecutive in code_chunks and the candidates are
+        # the first ones, so the next chunk of a candidate, if any, is the one after it
+        selected = set()
+        for cidx in ranking:
+            _id = candidate_code_chunk_ids[cidx]
+            fname, c_id = _id.rsplit("|", 1)
+            next_id = f"{fname}|{int(c_id) + 1}"
+            if cidx + 1 < len(code_chunk_ids) and code_chunk_ids[cidx + 1] == next_id:
+                to_add = code_chunks[cidx + 1]
+            else:
+                to_add = code_chunks[cidx]
+
+            # identical chunks from different places are only included once
+            if to_add not in selected:
+                selected.add(to_add)
+                selected_chunks.append(to_add)
+                selected_chunks_filename.append(fname)
+                if args.rerank:
+                    selected_chunks_scores.append(ranking_scores[cidx])
+                if len(selected_chunks) == top_k:
+                    break
+    else:
+        for cidx in itertools.islice(ranking, top_k):
+            selected_chunks.append(candidate_code_chunks[cidx])
+            selected_chunks_filename.append(candidate_code_chunk_ids[cidx].rsplit("|", 1)[0])
+            if args.rerank:
+                selected_chunks_scores.append(ranking_scores[cidx])
+
+    cross_file_context = []
+    for idx in range(len(selected_chunks)):
+        cross_file_context.append({
+            "retrieved_chunk": selected_chunks[idx],
+            "filename": selected_chunks_filename[idx],
+            "score": selected_chunks_scores[idx] if args.rerank else None
+        })
+
+    line_start_sym = "#" if language == "python" else "//"
+    cfc_text = f"{line_start_sym} Here are some relevant code fragments from other files of the repo:\n\n"
+    for sc, scf in zip(selected_chunks, selected_chunks_filename):
+        cfc_text += f"{line_start_sym} the below code fragment can be found in:\n{line_start_sym} {scf}" + "\n"
+        cfc_text += "\n".join([f"{line_start_sym} {cl}" for cl in sc.strip('\n').splitlines()]) + "\n\n"
+
+    return cross_file_context, cfc_text, meta_data
+
+
+# The repositories of the batch being processed and, in each pool worker, the client
+# of the encoder service. The pool workers are forked for each batch of repositories
+# and inherit them, instead of having them pickled with every task.
+repositories = {}
+semantic_ranker = None
+
+
+def init_worker(encoder_service):
+    global semantic_ranker
+    if encoder_service is not None:
+        semantic_ranker = encoder_service.connect()
+
+
+def get_cfc(example, args, language, embedding_indexes):
+    repository_index = repositories[example["metadata"]["repository"]]
+    status = None
+    current_filepath = example["metadata"]["file"]
+    if len(repository_index) == 0:
+        example["crossfile_context"] = ""
+        status = "project_not_found"
+    else:
+        if current_filepath not in repository_index:
+            example["crossfile_context"] = {}
+            print(current_filepath)
+            status = "file_not_found_in_project"
+
+        else:
+            start = time.perf_counter()
+            pyfiles = repository_index.files_within_distance(
+                example["metadata"]["file"],
+                k=args.crossfile_distance
+            )
+            pyfiles = pyfiles[:args.maximum_cross_files]
+
+            chunk_indices = repository_index.chunk_indices(pyfiles)
+            code_chunks = [repository_index.chunks[i] for i in chunk_indices]
+            code_chunk_ids = [repository_index.chunk_ids[i] for i in chunk_indices]
+
+            if len(code_chunks) == 0:
+                example["crossfile_context"] = {}
+                status = "no_crossfile_context"
+
+            else:
+                cfc, cfc_text, meta_data = get_crossfile_context_from_chunks(
+                    args=args,
+                    language=language,
+                    prompt=example["prompt"],
+                    code_chunks=code_chunks,
+                    code_chunk_ids=code_chunk_ids,
+                    groundtruth=example["groundtruth"],
+                    semantic_ranker=semantic_ranker,
+                    sparse_index=repository_index.sparse_index,
+                    code_chunk_rows=chunk_indices,
+                    embedding_index=embedding_indexes.get(example["metadata"]["repository"])
+                )
+                retrieval = {
+                    "latency": time.perf_counter() - start,
+                    "num_files": len(pyfiles),
+                    "num_candidates": meta_data["num_candidates"],
+                }
+                if args.rerank:
+                    retrieval["ranking_latency"] = meta_data["latency"]
+                    retrieval["num_scored"] = meta_data["num_scored"]
+
+                example["crossfile_context"] = {}
+                example["crossfile_context"]["text"] = cfc_text
+                example["crossfile_context"]["list"] = cfc
+                example["crossfile_context"]["retrieval"] = retrieval
+
+    return example, status
+
+
+def embed_chunks(task):
+    repo_name, embedding_file, start, end = task
+    write_embeddings(embedding_file, start, semantic_ranker.encode(repositories[repo_name].chunks[start:end]))
+
+
+def embed_repositories(args, language, pool, encoder_service, embedding_dir, batch_size=64):
+    """Encodes the chunks of the current repositories that aren't in embedding_dir yet"""
+    embedding_indexes = {}
+    tasks = []
+    new_files = []
+    for repo_name, repository_index in repositories.items():
+        num_chunks = len(repository_index.chunks)
+        if num_chunks == 0:
+            continue
+
+        encoder_config = f"{args.ranker_path}|{encoder_service.max_sequence_length}|int8={args.quantize_int8}"
+        path = embedding_index_path(embedding_dir, language, repository_index, args.ranker, encoder_config)
+        if not os.path.exists(path):
+            embedding_file = create_embedding_file(path, num_chunks, encoder_service.hidden_size)
+            tasks += [
+                (repo_name, embedding_file, start, min(start + batch_size, num_chunks))
+                for start in range(0, num_chunks, batch_size)
+            ]
+            new_files.append((embedding_file, path))
+        embedding_indexes[repo_name] = EmbeddingIndex(path)
+
+    for _ in pool.imap_unordered(embed_chunks, tasks):
+        pass
+    for embedding_file, path in new_files:
+        os.replace(embedding_file, path)
+
+    return embedding_indexes
+
+
+def repository_batches(args, language, repo_names, index_stats, profiler):
+    """
+    Loads the repositories in order, in batches of at most args.max_chunks_in_memory
+    chunks, or a single repository if it's larger than that. The size of each index
+    and the time taken to build and load it are added to index_stats.
+    """
+    batch = {}
+    num_chunks = 0
+    for repo_name in repo_names:
+        start = time.perf_counter()
+        with profiler.stage("index"):
+            repository_index = load_repository_index(
+                args.repository_root, repo_name, language, cache_dir=args.index_cache_dir,
+                tokenizer=args.tokenizer
+            )
+        index_stats[repo_name] = {
+            "num_chunks": len(repository_index.chunks),
+            "build_time": repository_index.build_time,
+            "load_time": time.perf_counter() - start,
+        }
+        if batch and num_chunks + len(repository_index.chunks) > args.max_chunks_in_memory:
+            yield batch
+            batch = {}
+            num_chunks = 0
+        batch[repo_name] = repository_index
+        num_chunks += len(repository_index.chunks)
+
+    if batch:
+        yield batch
+
+
+def attach_data(args: BuildContextArgs, language, srcfile, profiler: Profiler):
+    empty_cfc = 0
+    error_freq = {
+        "project_not_found": 0,
+        "file_not_found_in_project": 0,
+        "no_crossfile_context": 0
+    }
+    output_examples = []
+
+    # examples grouped by repository, in the order the repositories first appear
+    examples = dict()
+    num_examples = 0
+    with profiler.stage("load"), open(srcfile) as f:
+        for line in f:
+            ex = json.loads(line)
+            examples.setdefault(ex["metadata"]["repository"], []).append(ex)
+            num_examples += 1
+
+    encoder_service = None
+    if args.ranking_fn == "cosine_sim":
+        encoder_service = EncoderService(
+            args.ranker,
+            num_clients=args.workers,
+            device=args.device,
+            model_path=args.ranker_path,
+            max_sequence_length=256,
+            batch_size=args.encoder_batch_size,
+            quantize_int8=args.quantize_int8,
+            num_threads=args.encoder_threads
+        )
+
+    # the chunks of each repository are encoded once and only the queries are encoded
+    # per example; without a cache directory, the embeddings only live for this run
+    tmp_dir = None
+    embedding_dir = args.index_cache_dir
+    if args.ranking_fn == "cosine_sim" and embedding_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        embedding_dir = tmp_dir.name
+
+    # the workers rely on inheriting the repositories, whatever the default start method
+    ctx = mp.get_context("fork")
+    index_stats = {}
+
+    with tqdm(total=num_examples) as pbar:
+        for batch in repository_batches(args, language, examples.keys(), index_stats, profiler):
+            repositories.update(batch)
+            batch_examples = [ex for repo_name in batch for ex in examples[repo_name]]
+
+            if encoder_service is not None:
+                encoder_service.reset_clients()
+            num_processes = min(args.workers, len(batch_examples))
+            with ctx.Pool(num_processes, initializer=init_worker, initargs=(encoder_service,)) as pool:
+                embedding_indexes = {}
+                if args.ranking_fn == "cosine_sim":
+                    with profiler.stage("embed"):
+                        embedding_indexes = embed_repositories(args, language, pool, encoder_service, embedding_dir)
+
+                worker = partial(get_cfc, args=args, language=language, embedding_indexes=embedding_indexes)
+                with profiler.stage("retrieve"):
+                    for (d, stat) in pool.imap_unordered(worker, batch_examples):
+                        if stat in error_freq:
+                            error_freq[stat] += 1
+                        if isinstance(d["crossfile_context"], dict) and "retrieval" in d["crossfile_context"]:
+                            retrieval = d["crossfile_context"]["retrieval"]
+                            profiler.record_latency("retrieval", retrieval["latency"])
+                            if "ranking_latency" in retrieval:
+                                profiler.record_latency("ranking", retrieval["ranking_latency"])
+                        if len(d["crossfile_context"]) == 0:
+                            empty_cfc += 1
+                            if not args.skip_if_no_cfc:
+                                output_examples.append(d)
+                        else:
+                            output_examples.append(d)
+                        pbar.update()
+
+            repositories.clear()
+
+    if encoder_service is not None:
+        encoder_service.close()
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+    print("Total examples with empty CFC: ", empty_cfc)
+    print(error_freq)
+    return output_examples, summarize_retrieval(args, output_examples, index_stats)
+
+
+def summarize_retrieval(args: BuildContextArgs, output_examples, index_stats):
+    stats = [
+        ex["crossfile_context"]["retrieval"] for ex in output_examples
+        if isinstance(ex["crossfile_context"], dict) and "retrieval" in ex["crossfile_context"]
+    ]
+
+    def mean(key):
+        return sum(s[key] for s in stats) / len(stats) if stats else 0.0
+
+    summary = {
+        "examples": len(stats),
+        "latency": summarize_latencies([s["latency"] for s in stats]),
+        "num_files": mean("num_files"),
+        "num_candidates": mean("num_candidates"),
+    }
+    if args.rerank:
+        summary["ranking_latency"] = summarize_latencies([s["ranking_latency"] for s in stats])
+        summary["num_scored"] = mean("num_scored")
+        # examples for which the retrieval budget didn't allow scoring all the candidates
+        summary["budget_exhausted"] = sum(s["num_scored"] < s["num_candidates"] for s in stats)
+    summary["index"] = {
+        "build_time": sum(s["build_time"] for s in index_stats.values()),
+        "load_time": sum(s["load_time"] for s in index_stats.values()),
+        "repositories": index_stats,
+    }
+    return summary
+
+
+def get_output_task(args: BuildContextArgs):
+    parts = [args.input_task]
+    if args.output_suffix:
+        parts.append(args.output_suffix)
+    if args.ranker != "sparse":
+        parts.append(args.ranker)
+    if args.retrieval_budget_ms is not None:
+        parts.append(f"{args.retrieval_budget_ms:g}ms")
+    if args.rerank:
+        parts.append(args.ranking_fn)
+    return "_".join(parts)
+
+
+def command(args: BuildContextArgs):
+    if not args.index_cache_dir:
+        args = dataclasses.replace(args, index_cache_dir=None)
+
+    print(json.dumps(vars(args), indent=4))
+    output_task = get_output_task(args)
+    for language in args.language:
+        input_file = Path(args.data_root_dir) / language / f"{args.input_task}.jsonl"
+        output_file = Path(args.data_root_dir) / language / f"{output_task}.jsonl"
+        print(f"{language}: adding context to {input_file}")
+
+        profiler = Profiler.from_args(args)
+        with profiler.dump_to(output_file.with_suffix(".profile")):
+            output_examples, summary = attach_data(args, language, input_file, profiler)
+            with profiler.stage("write"), write_jsonl(output_file) as writer:
+                for ex in output_examples:
+                    writer.append(ex)
+        profiler.write(output_file.with_suffix(".profile.json"))
+        print(f"{language}: wrote {len(output_examples)} examples to {output_file}")
+
+        summary_file = output_file.with_suffix(".retrieval.json")
+        write_json(summary_file, summary)
+        latency = summary["latency"]
+        print(
+            f"{language}: retrieval latency p50 {latency['p50_ms']:.2f} ms, "
+            f"p99 {latency['p99_ms']:.2f} ms, max {latency['max_ms']:.2f} ms; "
+            f"indexes built in {summary['index']['build_time']:.1f} s, "
+            f"loaded in {summary['index']['load_time']:.1f} s; summary in {summary_file}"
+        )
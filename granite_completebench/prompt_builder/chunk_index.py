@@ -0,0 +1,225 @@
+import os
+import glob
+import time
+import pickle
+import hashlib
+import subprocess
+from .utils import TOKENIZERS
+from .sparse_index import SparseIndex
+
+CHUNK_SIZE = 10
+SLIDING_WINDOW_SIZE = 10  # non-overlapping chunks if SLIDING_WINDOW_SIZE=CHUNK_SIZE
+
+# bumped whenever the layout of RepositoryIndex changes, to invalidate the cache
+INDEX_VERSION = 5
+
+file_ext = {"python": "py", "java": "java", "typescript": "ts", "csharp": "cs"}
+
+
+def list_source_files(root_dir, lang):
+    if lang == "typescript":
+        src_files = []
+        src_files += glob.glob(os.path.join(root_dir, f'src/**/*.ts'), recursive=True)
+        src_files += glob.glob(os.path.join(root_dir, f'src/**/*.tsx'), recursive=True)
+    else:
+        src_files = glob.glob(os.path.join(root_dir, f'**/*.{file_ext[lang]}'), recursive=True)
+
+    return src_files
+
+
+def read_source_files(root_dir, src_files):
+    project_context = {}
+    for filename in src_files:
+        if os.path.exists(filename):  # weird but some files cannot be opened to read
+            if os.path.isfile(filename):
+                try:
+                    with open(filename, "r") as file:
+                        file_content = file.read()
+                except:
+                    with open(filename, "rb") as file:
+                        file_content = file.read().decode(errors='replace')
+
+                fileid = os.path.relpath(filename, root_dir)
+                project_context[fileid] = file_content
+
+    return project_context
+
+
+def chunk_file(content, tokenize):
+    lines = content.split("\n")
+    lines = [l for l in lines if l.strip()]  # removing empty lines
+    chunks = []
+    for i in range(0, len(lines), SLIDING_WINDOW_SIZE):
+        c = "\n".join(lines[i:i + CHUNK_SIZE])
+        tokenized_c = tokenize(c)
+        if len(tokenized_c) > 0:
+            chunks.append((c, tokenized_c))
+    return chunks
+
+
+class DirectoryTree:
+    """
+    The directories of the files of a repository, to find all the files near a given
+    file in a single traversal
+    """
+
+    def __init__(self, filelist):
+        # a directory is a (subdirectories, files) pair
+        self.root = ({}, [])
+        for filepath in filelist:
+            subdirs, files = self.root
+            for d in filepath.split(os.sep)[:-1]:
+                subdirs, files = subdirs.setdefault(d, ({}, []))
+            files.append(filepath)
+
+    def files_within_distance(self, filepath, k):
+        """
+        (distance, file) pairs of all the files at most k away from filepath, where the
+        distance is the number of directories between them as in utils.file_distance
+        """
+        path = filepath.split(os.sep)[:-1]
+        result = []
+        node = self.root
+        for depth in range(len(path) + 1):
+            # the files under this ancestor, but not under the next one, are up
+            # directories up from filepath and then down from here
+            up = len(path) - depth
+            subdirs, files = node
+            if up <= k:
+                result.extend((up, f) for f in files)
+                next_dir = path[depth] if depth < len(path) else None
+                for name, subdir in subdirs.items():
+                    if name != next_dir:
+                        self._collect(subdir, up + 1, k, result)
+            if depth < len(path):
+                node = subdirs[path[depth]]
+
+        return result
+
+    def _collect(self, node, distance, k, result):
+        if distance > k:
+            return
+        subdirs, files = node
+        result.extend((distance, f) for f in files)
+        for subdir in subdirs.values():
+            self._collect(subdir, distance + 1, k, result)
+
+
+class RepositoryIndex:
+    """
+    The chunks of all the source files of a repository, built once and shared by
+    all the examples from that repository.
+    """
+
+    def __init__(self, repo_name, project_context, tokenizer="code"):
+        build_start = time.perf_counter()
+        self.repo_name = repo_name
+        self.tokenizer = tokenizer
+        tokenize = TOKENIZERS[tokenizer]
+        self.filelist = list(project_context.keys())
+
+        self.chunks = []
+        self.chunk_ids = []
+        tokenized_chunks = []
+        # file -> (start, end) range of its chunks in the lists above
+        self.file_chunk_range = {}
+
+        for filepath, content in project_context.items():
+            start = len(self.chunks)
+            for c_id, (c, tokenized_c) in enumerate(chunk_file(content, tokenize)):
+                self.chunks.append(c)
+                self.chunk_ids.append(f"{filepath}|{c_id}")
+                tokenized_chunks.append(tokenized_c)
+            self.file_chunk_range[filepath] = (start, len(self.chunks))
+
+        self.sparse_index = SparseIndex(self.chunks, tokenized_chunks, tokenize)
+        self.directory_tree = DirectoryTree(self.filelist)
+
+        self._distance_cache = {}
+        # seconds taken to chunk and index the files, when the index was first built
+        self.build_time = time.perf_counter() - build_start
+
+    def __len__(self):
+        return len(self.filelist)
+
+    def __contains__(self, filepath):
+        return filepath in self.file_chunk_range
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_distance_cache"] = {}
+        return state
+
+    def files_within_distance(self, current_file_path, k):
+        key = (current_file_path, k)
+        if key not in self._distance_cache:
+            files = self.directory_tree.files_within_distance(current_file_path, k)
+            # sorting in ascending order
+            self._distance_cache[key] = [x for _, x in sorted(files) if x != current_file_path]
+
+        return self._distance_cache[key]
+
+    def chunk_indices(self, files):
+        """Indices of the chunks of the given files, in the order of the files"""
+        indices = []
+        for filepath in files:
+            start, end = self.file_chunk_range[filepath]
+            indices.extend(range(start, end))
+        return indices
+
+
+def repository_fingerprint(root_dir, src_files):
+    # Prefer the commit of a clean git checkout; fall back to the names, sizes and
+    # modification times of the source files
+    if os.path.exists(os.path.join(root_dir, ".git")):
+        try:
+            commit = subprocess.run(
+                ["git", "-C", root_dir, "rev-parse", "HEAD"],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+            status = subprocess.run(
+                ["git", "-C", root_dir, "status", "--porcelain"],
+                capture_output=True, text=True, check=True
+            ).stdout
+            if commit and not status:
+                return commit
+        except (OSError, subprocess.CalledProcessError):
+            pass
+
+    h = hashlib.sha1()
+    for filename in sorted(src_files):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        h.update(f"{filename}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def load_repository_index(repository_root, repo_name, lang, cache_dir=None, tokenizer="code"):
+    root_dir = os.path.join(repository_root, lang, repo_name)
+    if not os.path.isdir(root_dir):
+        print(f"Repository not found: {root_dir}")
+        return RepositoryIndex(repo_name, {}, tokenizer)
+
+    src_files = list_source_files(root_dir, lang)
+
+    cache_file = None
+    if cache_dir is not None:
+        fingerprint = repository_fingerprint(root_dir, src_files)
+        key = hashlib.sha1(f"{INDEX_VERSION}|{CHUNK_SIZE}|{SLIDING_WINDOW_SIZE}|{tokenizer}|{fingerprint}".encode()).hexdigest()
+        cache_file = os.path.join(cache_dir, lang, f"{repo_name}-{key[:16]}.pkl")
+        if os.path.exists(cache_file):
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+
+    index = RepositoryIndex(repo_name, read_source_files(root_dir, src_files), tokenizer)
+
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
+    return index
@@ -0,0 +1,77 @@
+import os
+import hashlib
+import numpy as np
+
+
+def cosine_similarity(query_embedding, embeddings, norms=None):
+    """Cosine similarity between a query embedding and each row of embeddings"""
+    query_embedding = np.asarray(query_embedding, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if norms is None:
+        norms = np.linalg.norm(embeddings, axis=1)
+    # same eps as torch.nn.functional.cosine_similarity
+    denom = np.maximum(norms * np.linalg.norm(query_embedding), 1e-8)
+    return embeddings @ query_embedding / denom
+
+
+class EmbeddingIndex:
+    """
+    Embeddings of all the chunks of a repository, in the order of the chunks of its
+    RepositoryIndex, stored as a float16 .npy file and memory-mapped on first use so
+    that all the workers share the same pages. Only the path is pickled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._embeddings = None
+        self._norms = None
+
+    def __getstate__(self):
+        return {"path": self.path, "_embeddings": None, "_norms": None}
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = np.load(self.path, mmap_mode="r")
+        return self._embeddings
+
+    @property
+    def norms(self):
+        if self._norms is None:
+            self._norms = np.linalg.norm(np.asarray(self.embeddings, dtype=np.float32), axis=1)
+        return self._norms
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def cosine_similarity(self, query_embedding, rows):
+        """Cosine similarity between the query embedding and the chunks at rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return cosine_similarity(query_embedding, self.embeddings[rows], self.norms[rows])
+
+
+def embedding_index_path(cache_dir, lang, repository_index, model_type, encoder_config):
+    h = hashlib.sha1()
+    for c in repository_index.chunks:
+        h.update(c.encode(errors="replace"))
+        h.update(b"\0")
+    key = hashlib.sha1(f"{model_type}|{encoder_config}|{h.hexdigest()}".encode()).hexdigest()
+    return os.path.join(cache_dir, lang, f"{repository_index.repo_name}-{key[:16]}.{model_type}.npy")
+
+
+def create_embedding_file(path, num_docs, hidden_size):
+    """Creates a temporary embedding file for path, to be filled with write_embeddings"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    embedding_file = f"{path}.{os.getpid()}.tmp.npy"
+    embeddings = np.lib.format.open_memmap(
+        embedding_file, mode="w+", dtype=np.float16, shape=(num_docs, hidden_size)
+    )
+    embeddings.flush()
+    return embedding_file
+
+
+def write_embeddings(embedding_file, start, embeddings):
+    """Writes the embeddings of the docs from start on; safe to call from several processes"""
+    m = np.load(embedding_file, mmap_mode="r+")
+    m[start:start + len(embeddings)] = embeddings
+    m.flush()
@@ -0,0 +1,149 @@
+import time
+import queue
+import multiprocessing as mp
+from typing import List
+from .rerank_utils import EmbeddingReranking, SemanticReranking, encoder_devices
+
+
+def serve(model_type, device, options, requests, responses, ready, max_wait):
+    import torch
+    if options.get("num_threads"):
+        torch.set_num_threads(options["num_threads"])
+
+    encoder = SemanticReranking(model_type, device=device, **options)
+    ready.put(encoder.hidden_size)
+
+    stop = False
+    while not stop:
+        item = requests.get()
+        if item is None:
+            break
+
+        # gather the requests of the other workers that arrive shortly after, so that
+        # they are encoded together
+        pending = [item]
+        num_texts = len(item[2])
+        deadline = time.monotonic() + max_wait
+        while num_texts < encoder.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            pending.append(item)
+            num_texts += len(item[2])
+
+        texts = [t for _, _, request_texts in pending for t in request_texts]
+        try:
+            embeddings = encoder.encode(texts)
+        except Exception as e:
+            for client_id, request_id, _ in pending:
+                responses[client_id].put((request_id, e))
+            continue
+
+        offset = 0
+        for client_id, request_id, request_texts in pending:
+            responses[client_id].put((request_id, embeddings[offset:offset + len(request_texts)]))
+            offset += len(request_texts)
+
+
+class EncoderClient(EmbeddingReranking):
+    """Encodes texts by sending them to an EncoderService process"""
+
+    def __init__(self, client_id, requests, responses, hidden_size, max_sequence_length):
+        self.client_id = client_id
+        self.requests = requests
+        self.responses = responses
+        self.hidden_size = hidden_size
+        self.max_sequence_length = max_sequence_length
+        self.request_id = 0
+
+    def encode(self, texts: List[str]):
+        self.request_id += 1
+        self.requests.put((self.client_id, self.request_id, list(texts)))
+        request_id, result = self.responses.get()
+        assert request_id == self.request_id
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class EncoderService:
+    """
+    Loads the encoder once per device in its own process, and batches the encode
+    requests of all the workers connected to it. The workers must be started after
+    the service (e.g. from a Pool initializer calling connect) so they inherit its
+    queues.
+    """
+
+    def __init__(
+            self,
+            model_type,
+            num_clients,
+            device="auto",
+            max_wait=0.005,
+            **options
+    ):
+        self.model_type = model_type
+        self.max_sequence_length = options.get("max_sequence_length", 256)
+        self.devices = encoder_devices(device)
+        if options.get("quantize_int8") and any(d.type == "cuda" for d in self.devices):
+            raise ValueError("int8 quantization is only supported on CPU")
+
+        # CUDA can't be used in forked processes
+        ctx = mp.get_context("spawn")
+        self.requests = [ctx.Queue() for _ in self.devices]
+        self.responses = [ctx.Queue() for _ in range(num_clients)]
+        self.num_clients = ctx.Value("i", 0)
+
+        ready = ctx.Queue()
+        self.processes = []
+        for device, requests in zip(self.devices, self.requests):
+            p = ctx.Process(
+                target=serve,
+                args=(model_type, device, options, requests, self.responses, ready, max_wait),
+                daemon=True
+            )
+            p.start()
+            self.processes.append(p)
+
+        hidden_sizes = []
+        while len(hidden_sizes) < len(self.processes):
+            try:
+                hidden_sizes.append(ready.get(timeout=1))
+            except queue.Empty:
+                if not all(p.is_alive() for p in self.processes):
+                    raise RuntimeError("the encoder service failed to start")
+        self.hidden_size = hidden_sizes[0]
+
+    def connect(self):
+        """A client for the calling process, spreading the clients over the devices"""
+        with self.num_clients.get_lock():
+            client_id = self.num_clients.value
+            self.num_clients.value += 1
+        if client_id >= len(self.responses):
+            raise RuntimeError(f"more than {len(self.responses)} clients connected")
+
+        return EncoderClient(
+            client_id,
+            self.requests[client_id % len(self.requests)],
+            self.responses[client_id],
+            self.hidden_size,
+            self.max_sequence_length
+        )
+
+    def reset_clients(self):
+        """Lets new workers connect once all the previous ones are gone"""
+        with self.num_clients.get_lock():
+            self.num_clients.value = 0
+
+    def close(self):
+        for requests in self.requests:
+            requests.put(None)
+        for p in self.processes:
+            p.join()
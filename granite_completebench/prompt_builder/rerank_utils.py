@@ -0,0 +1,273 @@
+# Copyright Amazon.com, Inc. or its affiliates. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import torch
+import numpy as np
+from rank_bm25 import BM25Okapi
+from typing import List
+from multiprocessing import Pool, cpu_count
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+from .utils import TOKENIZERS
+from .embedding_index import cosine_similarity as cosine_similarity_to_query
+from transformers import AutoModel, AutoTokenizer, AutoConfig
+
+
+def jaccard_similarity(tokenized_query, tokenized_doc, containment=False):
+    set1 = set(tokenized_query)
+    set2 = set(tokenized_doc)
+    intersection = len(set1.intersection(set2))
+    union = len(set1) if containment else len(set1.union(set2))
+    return float(intersection) / union
+
+
+def tokenize_corpus(corpus, tokenizer_fn):
+    pool = Pool(cpu_count())
+    tokenized_corpus = pool.map(tokenizer_fn, corpus)
+    return tokenized_corpus
+
+
+def tokenize_query_and_docs(query, docs, tokenize):
+    tokenized_query = tokenize(query)
+    tokenized_docs = [tokenize(d) for d in docs]
+    return tokenized_query, tokenized_docs
+
+
+def top_k_indices(scores, doc_ids, k):
+    """
+    Indices of the k highest scores, best first. Ties are broken by doc id, highest
+    first as with sorted(zip(scores, doc_ids), reverse=True), or by index if there are
+    no ids. Only the scores tied with the k-th highest or above are sorted.
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k == 0:
+        return []
+    # tfidf scores are single-element lists
+    score_array = np.asarray(scores, dtype=np.float64).reshape(n)
+    if k < n:
+        kth_score = score_array[np.argpartition(score_array, n - k)[n - k]]
+        indices = np.flatnonzero(score_array >= kth_score).tolist()
+    else:
+        indices = list(range(n))
+
+    score_list = score_array.tolist()
+    if doc_ids is None:
+        indices.sort(key=lambda i: (score_list[i], i), reverse=True)
+    else:
+        indices.sort(key=lambda i: (score_list[i], doc_ids[i]), reverse=True)
+    return indices[:k]
+
+
+def ranked_indices(scores, doc_ids, first_k):
+    """
+    All the indices in the order of top_k_indices, lazily: the first first_k are
+    selected, then twice as many, etc. for callers that rarely go past the first ones
+    """
+    k = max(first_k, 1)
+    start = 0
+    while start < len(scores):
+        indices = top_k_indices(scores, doc_ids, k)
+        yield from indices[start:]
+        start = len(indices)
+        k *= 2
+
+
+def sort_by_score(docs, doc_ids, scores, score_threshold=None):
+    if score_threshold:
+        keep = [idx for idx, s in enumerate(scores) if not s < score_threshold]
+        scores = [scores[idx] for idx in keep]
+        docs = [docs[idx] for idx in keep]
+        if doc_ids is not None:
+            doc_ids = [doc_ids[idx] for idx in keep]
+
+    order = top_k_indices(scores, doc_ids, len(scores))
+    docs = [docs[idx] for idx in order]
+    if doc_ids is not None:
+        doc_ids = [doc_ids[idx] for idx in order]
+    scores = [scores[idx] for idx in order]
+
+    return docs, doc_ids, scores
+
+
+def lexical_ranking(
+        query,
+        docs,
+        ranking_fn,
+        doc_ids=None,
+        score_threshold=None,
+        sparse_index=None,
+        doc_rows=None,
+        tokenizer="code",
+):
+    scores = lexical_scores(query, docs, ranking_fn, sparse_index, doc_rows, tokenizer)
+    return sort_by_score(docs, doc_ids, scores, score_threshold)
+
+
+def lexical_scores(query, docs, ranking_fn, sparse_index=None, doc_rows=None, tokenizer="code"):
+    """The scores of the docs for the query, in the order of the docs"""
+    tokenize = TOKENIZERS[tokenizer]
+    if sparse_index is not None:
+        # docs are the rows doc_rows of the prebuilt index
+        scores = sparse_index.scores(ranking_fn, query, doc_rows)
+    elif ranking_fn == "bm25":
+        tokenized_query, tokenized_docs = tokenize_query_and_docs(query, docs, tokenize)
+        bm25 = BM25Okapi(tokenized_docs)
+        scores = bm25.get_scores(tokenized_query)
+    elif ranking_fn == "tfidf":
+        tfidf_vectorizer = TfidfVectorizer(tokenizer=tokenize)
+        X = tfidf_vectorizer.fit_transform(docs).toarray()  # (n_fn, n_features)
+        y = tfidf_vectorizer.transform([query]).toarray()  # (1, n_features)
+        scores = cosine_similarity(X, y).tolist()  # (n_fn, 1)
+    elif ranking_fn == "jaccard_sim":
+        tokenized_query, tokenized_docs = tokenize_query_and_docs(query, docs, tokenize)
+        scores = [jaccard_similarity(tokenized_query, d, containment=False) for d in tokenized_docs]
+    else:
+        raise NotImplementedError
+
+    return scores
+
+
+MODEL_PATHS = {
+    "unixcoder": "microsoft/unixcoder-base",
+}
+
+
+def encoder_devices(device="auto"):
+    """The devices to run an encoder on: every GPU, or the CPU if there is none or if asked to"""
+    if device == "cpu" or (device == "auto" and not torch.cuda.is_available()):
+        return [torch.device("cpu")]
+    if not torch.cuda.is_available():
+        raise ValueError("no CUDA device is available")
+    return [torch.device("cuda", i) for i in range(torch.cuda.device_count())]
+
+
+class EmbeddingReranking:
+    """Reranks documents by the cosine similarity of their embeddings to the query's"""
+
+    def encode(self, texts: List[str]):
+        raise NotImplementedError
+
+    def rerank(
+            self,
+            query: str,
+            docs: List[str],
+            doc_ids: List[str] = None,
+            score_threshold=None,
+            embedding_index=None,
+            doc_rows=None,
+            query_embedding=None
+    ):
+        scores = self.scores(query, docs, embedding_index, doc_rows, query_embedding)
+        return sort_by_score(docs, doc_ids, scores, score_threshold)
+
+    def scores(self, query, docs, embedding_index=None, doc_rows=None, query_embedding=None):
+        """The cosine similarities of the docs to the query, in the order of the docs"""
+        if embedding_index is not None:
+            # docs are the rows doc_rows of the precomputed embeddings
+            query_rep = self.encode([query])[0] if query_embedding is None else query_embedding
+            return embedding_index.cosine_similarity(query_rep, doc_rows).tolist()
+        else:
+            reps = self.encode([query] + docs)
+            return cosine_similarity_to_query(reps[0], reps[1:]).tolist()
+
+
+class SemanticReranking(EmbeddingReranking):
+
+    def __init__(self, model_type="unixcoder", device=None, **kwargs):
+        self.model_type = model_type
+        if model_type not in MODEL_PATHS:
+            raise NotImplementedError
+
+        model_path = kwargs.get("model_path") or MODEL_PATHS[model_type]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModel.from_pretrained(model_path)
+
+        # maximum sequence length for query and documents
+        self.max_sequence_length = kwargs.get("max_sequence_length", 256)
+        self.batch_size = kwargs.get("batch_size", 64)
+        self.hidden_size = model.config.hidden_size
+
+        # the model is moved to its device once, in fp16 on GPUs; on CPU its linear
+        # layers can be dynamically quantized to int8
+        self.device = torch.device("cpu") if device is None else device
+        if self.device.type == "cuda":
+            model = model.to(device=self.device, dtype=torch.float16)
+        elif kwargs.get("quantize_int8", False):
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model.eval()
+
+    def text_to_tensor(
+            self,
+            text: str,
+            pad_to_max: bool = False,
+    ):
+        text = text.strip()
+
+        # tokenizer automatic padding is explicitly disabled since its inconsistent behavior
+        token_ids = self.tokenizer.encode(
+            text,
+            add_special_tokens=False,
+            max_length=self.max_sequence_length,
+            pad_to_max_length=False,
+            truncation=True
+        )
+
+        if pad_to_max and len(token_ids) < self.max_sequence_length:
+            token_ids = token_ids + [self.tokenizer.pad_token_id] * (self.max_sequence_length - len(token_ids))
+        if len(token_ids) > self.max_sequence_length:
+            token_ids = token_ids[0:self.max_sequence_length]
+
+        return torch.tensor(token_ids, dtype=torch.long)
+
+    def get_pad_id(self):
+        return self.tokenizer.pad_token_id
+
+    def get_attn_mask(self, tokens_tensor):
+        return tokens_tensor != self.get_pad_id()
+
+    def get_representations(self, list_input_ids):
+        """
+        Mean-pooled last hidden states of the (unpadded) input ids, as a
+        (len(list_input_ids), hidden_size) tensor. The inputs are batched by length
+        and each batch is only padded to its longest input.
+        """
+        pooled_output = torch.zeros(len(list_input_ids), self.hidden_size)
+        order = sorted(range(len(list_input_ids)), key=lambda i: len(list_input_ids[i]))
+
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            width = max(1, max(len(list_input_ids[i]) for i in batch))
+            input_ids = torch.full((len(batch), width), self.get_pad_id(), dtype=torch.long)
+            for row, i in enumerate(batch):
+                input_ids[row, :len(list_input_ids[i])] = list_input_ids[i]
+            input_ids = input_ids.to(device=self.device)
+            attention_mask = self.get_attn_mask(input_ids)
+
+            output = self.model(input_ids, attention_mask)
+            token_embeddings = output.last_hidden_state  # bsz x seq_len x hid_dim
+
+            mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
+            sum_embeddings = torch.sum(token_embeddings * mask_expanded, 1)
+            sum_mask = torch.clamp(mask_expanded.sum(1), min=1e-9)
+            sequence_embeddings = sum_embeddings / sum_mask  # bsz x hid_dim
+
+            pooled_output[batch] = sequence_embeddings.float().cpu()
+
+        return pooled_output
+
+    def encode(self, texts: List[str]):
+        """Pooled representations of texts as a (len(texts), hidden_size) float32 array"""
+        with torch.no_grad():
+            pooled_output = self.get_representations([self.text_to_tensor(t) for t in texts])
+        return pooled_output.numpy()
@@ -0,0 +1,173 @@
+import math
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.metrics.pairwise import cosine_similarity
+
+
+def term_matrix(tokenized_docs, vocabulary):
+    # Documents x terms matrix of raw counts, with the terms of each row in the order
+    # of their first occurrence in the document
+    indptr = [0]
+    indices = []
+    data = []
+    for tokens in tokenized_docs:
+        counts = {}
+        for t in tokens:
+            col = vocabulary.setdefault(t, len(vocabulary))
+            counts[col] = counts.get(col, 0) + 1
+        indices.extend(counts.keys())
+        data.extend(counts.values())
+        indptr.append(len(indices))
+
+    return csr_matrix(
+        (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(tokenized_docs), len(vocabulary))
+    )
+
+
+def row_of_entries(matrix):
+    return np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+
+def terms_by_first_occurrence(matrix):
+    _, first = np.unique(matrix.indices, return_index=True)
+    return matrix.indices[np.sort(first)]
+
+
+class SparseIndex:
+    """
+    Inverted index over the chunks of a repository, so that a query can be scored
+    against any subset of them without re-tokenizing the chunks or fitting a new
+    model. The scores are the same as those of BM25Okapi (rank_bm25), TfidfVectorizer
+    followed by cosine_similarity (scikit-learn), and jaccard_similarity, with the
+    candidate chunks as the corpus. Queries are tokenized like the chunks, with tokenize.
+    """
+
+    def __init__(self, docs, tokenized_docs, tokenize):
+        self.tokenize = tokenize
+        self.vocabulary = {}
+        self.term_freqs = term_matrix(tokenized_docs, self.vocabulary)
+        self.doc_lengths = np.array([len(tokens) for tokens in tokenized_docs], dtype=np.int64)
+        self.num_unique_terms = np.diff(self.term_freqs.indptr)
+
+        # TfidfVectorizer lowercases the text before tokenizing it
+        self.lowercase_vocabulary = {}
+        self.lowercase_term_freqs = term_matrix(
+            [tokenize(d.lower()) for d in docs], self.lowercase_vocabulary
+        )
+        self.lowercase_terms = list(self.lowercase_vocabulary)
+
+        # log(i + 0.5) as computed by rank_bm25, for every possible document frequency
+        self.log_half = np.array([math.log(i + 0.5) for i in range(len(docs) + 1)])
+
+    def __len__(self):
+        return self.term_freqs.shape[0]
+
+    def scores(self, ranking_fn, query, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if ranking_fn == "bm25":
+            return self.bm25_scores(self.tokenize(query), rows).tolist()
+        elif ranking_fn == "tfidf":
+            # kept as single-element lists, like the output of cosine_similarity
+            return self.tfidf_scores(self.tokenize(query.lower()), rows).reshape(-1, 1).tolist()
+        elif ranking_fn == "jaccard_sim":
+            return self.jaccard_scores(self.tokenize(query), rows).tolist()
+        else:
+            raise NotImplementedError
+
+    def query_term_freqs(self, sub, vocabulary, terms):
+        """Dense (rows x terms) counts of the given terms in the rows of sub"""
+        lookup = np.full(sub.shape[1], -1, dtype=np.int64)
+        for j, t in enumerate(terms):
+            lookup[vocabulary[t]] = j
+
+        cols = lookup[sub.indices]
+        mask = cols >= 0
+        freqs = np.zeros((sub.shape[0], len(terms)))
+        freqs[row_of_entries(sub)[mask], cols[mask]] = sub.data[mask]
+        return freqs
+
+    def bm25_scores(self, tokenized_query, rows, k1=1.5, b=0.75, epsilon=0.25):
+        sub = self.term_freqs[rows]
+        n = len(rows)
+
+        doc_freqs = np.bincount(sub.indices, minlength=sub.shape[1])
+        present = doc_freqs > 0
+        idf = self.log_half[n - doc_freqs] - self.log_half[doc_freqs]
+
+        # rank_bm25 averages the idf before flooring it, summing over the terms in the
+        # order they first appear in the corpus
+        corpus_terms = terms_by_first_occurrence(sub)
+        average_idf = np.cumsum(idf[corpus_terms])[-1] / len(corpus_terms) if len(corpus_terms) else 0.0
+        idf[present & (idf < 0)] = epsilon * average_idf
+
+        doc_len = self.doc_lengths[rows]
+        avgdl = doc_len.sum() / n
+
+        terms = [t for t in dict.fromkeys(tokenized_query) if t in self.vocabulary and present[self.vocabulary[t]]]
+        term_idx = {t: j for j, t in enumerate(terms)}
+        freqs = self.query_term_freqs(sub, self.vocabulary, terms)
+
+        score = np.zeros(n)
+        for q in tokenized_query:
+            if q not in term_idx:
+                continue
+            q_freq = freqs[:, term_idx[q]]
+            score += idf[self.vocabulary[q]] * (q_freq * (k1 + 1) /
+                                                (q_freq + k1 * (1 - b + b * doc_len / avgdl)))
+        return score
+
+    def tfidf_scores(self, tokenized_query, rows):
+        # Exact ties are common (e.g. duplicated chunks), and the order of tied chunks
+        # depends on the rounding of the scores. So rather than computing the cosine
+        # directly, the counts are laid out as TfidfVectorizer would lay them out,
+        # with the features sorted by name and the terms of each row in the order they
+        # first appear in the corpus, and go through the same scikit-learn steps.
+        sub = self.lowercase_term_freqs[rows]
+        n = len(rows)
+
+        corpus_terms = terms_by_first_occurrence(sub)
+        occurrence = np.empty(sub.shape[1], dtype=np.int64)
+        occurrence[corpus_terms] = np.arange(len(corpus_terms))
+        by_name = sorted(range(len(corpus_terms)), key=lambda i: self.lowercase_terms[corpus_terms[i]])
+        feature = np.empty(len(corpus_terms), dtype=np.int64)
+        feature[by_name] = np.arange(len(corpus_terms))
+
+        order = np.lexsort((occurrence[sub.indices], row_of_entries(sub)))
+        counts = csr_matrix(
+            (sub.data[order], feature[occurrence[sub.indices[order]]], sub.indptr),
+            shape=(n, len(corpus_terms))
+        )
+
+        present = np.zeros(sub.shape[1], dtype=bool)
+        present[corpus_terms] = True
+        query_counts = {}
+        for t in tokenized_query:
+            col = self.lowercase_vocabulary.get(t)
+            if col is not None and present[col]:
+                f = feature[occurrence[col]]
+                query_counts[f] = query_counts.get(f, 0) + 1
+        query_features = sorted(query_counts)
+        query_counts = csr_matrix(
+            ([float(query_counts[f]) for f in query_features], query_features, [0, len(query_features)]),
+            shape=(1, len(corpus_terms))
+        )
+
+        transformer = TfidfTransformer()
+        X = transformer.fit_transform(counts)
+        y = transformer.transform(query_counts)
+        return cosine_similarity(X.toarray(), y.toarray())[:, 0]
+
+    def jaccard_scores(self, tokenized_query, rows):
+        sub = self.term_freqs[rows]
+
+        query_terms = set(tokenized_query)
+        in_query = np.zeros(sub.shape[1], dtype=bool)
+        for t in query_terms:
+            if t in self.vocabulary:
+                in_query[self.vocabulary[t]] = True
+
+        intersection = np.bincount(row_of_entries(sub)[in_query[sub.indices]], minlength=len(rows))
+        union = len(query_terms) + self.num_unique_terms[rows] - intersection
+        return intersection / union
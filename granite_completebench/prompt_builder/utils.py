@@ -0,0 +1,85 @@
+# Copyright Amazon.com, Inc. or its affiliates. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import os
+from typing import List
+from nltk.tokenize import word_tokenize
+from ..eval_utils import split_identifier_into_parts
+
+WORD_REGEX = re.compile(r'\w+')
+
+# The \w+ runs, except where word_tokenize splits English contractions inside them:
+# "cannot" into "can", "not", "gonna" into "gon", "na" etc., "wanna" into "wan", "na" and
+# "don't" into "do", "n't", the last two only before a space or punctuation that it
+# pads with spaces (approximating its sentence splitting for a period followed by a space)
+CONTRACTION_END = r"""(?=[\s;@#$%&?!*()\[\]{}<>"]|[:,](?!\d)|--|\.\.|\.[\])}>"']*\s*$|\.\s|'\s|'$|$)"""
+CONTRACTION_REGEX = re.compile(
+    r"(?i:\b(?:can(?=not\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|wan(?=na" + CONTRACTION_END + r")))"
+    r"|\w+?(?=(?i:n't)" + CONTRACTION_END + r")"
+    r"|\w+"
+)
+CONTRACTION_MARKERS = ("n't", "cannot", "gimme", "gonna", "gotta", "lemme", "wanna")
+
+
+def tokenize_nltk(text):
+    words = word_tokenize(text)
+    output_list = []
+    for w in words:
+        w_list = WORD_REGEX.findall(w)
+        output_list.extend(w_list)
+    return output_list
+
+
+def tokenize_code(text):
+    # Same tokens as tokenize_nltk in a single regex pass, without sentence splitting
+    # and the Treebank rules for English prose. Most code has no contractions, so
+    # those are only looked for if the text may contain one
+    lower = text.lower()
+    if any(m in lower for m in CONTRACTION_MARKERS):
+        return CONTRACTION_REGEX.findall(text)
+    return WORD_REGEX.findall(text)
+
+
+def tokenize_code_subwords(text):
+    # tokenize_code, followed by the lowercased camelCase or snake_case parts of each
+    # identifier that has several, so that e.g. getUserName also matches user_name
+    output_list = []
+    for w in tokenize_code(text):
+        output_list.append(w)
+        parts = [p.lower() for p in split_identifier_into_parts(w) if p and p != "_"]
+        if len(parts) > 1:
+            output_list.extend(parts)
+    return output_list
+
+
+TOKENIZERS = {
+    "code": tokenize_code,
+    "code_subwords": tokenize_code_subwords,
+    "nltk": tokenize_nltk,
+}
+
+
+def file_distance(src_file, dest_file):
+    distance = -1
+    try:
+        commonpath = os.path.commonpath([src_file, dest_file])
+        rel_file1_path = os.path.relpath(src_file, commonpath)
+        rel_file2_path = os.path.relpath(dest_file, commonpath)
+        distance = rel_file1_path.count(os.sep) + rel_file2_path.count(os.sep)
+    except Exception as e:
+        # print(e, src_file, dest_file)
+        pass
+
+    return distance
+
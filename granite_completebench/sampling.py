@@ -0,0 +1,123 @@
+from bisect import bisect_left
+from dataclasses import dataclass
+import math
+import os
+
+import numpy as np
+
+from .cli import SampleArgs
+from .sharding import task_hash
+from .types import Example
+
+# Upper bounds (in characters) of the groundtruth lengths stratified apart
+GROUNDTRUTH_LENGTH_BINS = [8, 16, 32, 64]
+
+BOOTSTRAP_RESAMPLES = 1000
+# Bounds the memory of a batch of resamples, in resampled examples
+BOOTSTRAP_BATCH_SIZE = 1 << 20
+
+
+def stratum(ex: Example) -> tuple[str, str, int]:
+    """The repository, file type and groundtruth length bin of an example"""
+    metadata = ex["metadata"]
+    extension = os.path.splitext(metadata["file"])[1]
+    length_bin = bisect_left(GROUNDTRUTH_LENGTH_BINS, len(ex["groundtruth"].strip()))
+    return metadata["repository"], extension, length_bin
+
+
+def allocate(sizes: list[int], keys: list[str], n: int) -> list[int]:
+    """
+    Splits n among strata in proportion to their sizes, giving the rest of the rounding
+    to the largest remainders, and among equal remainders to the lowest hash of the key
+    of the stratum, so that small strata aren't favored by their name
+    """
+    total = sum(sizes)
+    quotas = [size * n / total for size in sizes]
+    counts = [math.floor(quota) for quota in quotas]
+    order = sorted(range(len(sizes)), key=lambda i: (counts[i] - quotas[i], task_hash(keys[i])))
+    for i in order[: n - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+@dataclass(frozen=True)
+class Sample:
+    """
+    A subset of the examples of a task, stratified by repository, file type and
+    groundtruth length. It only depends on the examples, so generate and evaluate
+    select the same one, and the sample of a larger size mostly contains it.
+    """
+
+    fraction: float | None = None
+    size: int | None = None
+
+    @staticmethod
+    def from_args(args: SampleArgs) -> "Sample | None":
+        if args.sample_fraction is None and args.sample_size is None:
+            return None
+        return Sample(args.sample_fraction, args.sample_size)
+
+    @property
+    def name(self) -> str:
+        if self.size is not None:
+            return f"sample-{self.size}"
+        return f"sample-{self.fraction:g}"
+
+    def select(self, examples: list[Example]) -> list[Example]:
+        """The examples of the sample, in their order"""
+        if self.size is not None:
+            n = min(self.size, len(examples))
+        else:
+            assert self.fraction is not None
+            n = max(1, round(self.fraction * len(examples)))
+
+        strata: dict[tuple[str, str, int], list[int]] = {}
+        for i, ex in enumerate(examples):
+            strata.setdefault(stratum(ex), []).append(i)
+        keys = sorted(strata)
+
+        counts = allocate([len(strata[key]) for key in keys], [repr(key) for key in keys], n)
+        selected = []
+        for key, count in zip(keys, counts):
+            # within a stratum, the examples whose task_id has the lowest hash
+            members = sorted(
+                strata[key], key=lambda i: task_hash(examples[i]["metadata"]["task_id"])
+            )
+            selected += members[:count]
+
+        return [examples[i] for i in sorted(selected)]
+
+
+def select_sample(examples: list[Example], sample: Sample | None) -> list[Example]:
+    if sample is None:
+        return examples
+    return sample.select(examples)
+
+
+def bootstrap_ci(
+    values: np.ndarray,
+    confidence: float = 0.95,
+    resamples: int = BOOTSTRAP_RESAMPLES,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Percentile bootstrap confidence intervals of the mean of each row of values, whose
+    columns are the examples. The rows are resampled together, and with a fixed seed,
+    so that the intervals of a set of results are reproducible.
+    """
+    num_rows, n = values.shape
+    rng = np.random.default_rng(seed)
+    means = np.empty((resamples, num_rows))
+    batch = max(1, BOOTSTRAP_BATCH_SIZE // n)
+    for start in range(0, resamples, batch):
+        end = min(start + batch, resamples)
+        indices = rng.integers(0, n, size=(end - start, n), dtype=np.int32)
+        # how many times each resample draws each example, so that the means of all
+        # the resamples of the batch are one matrix product
+        indices += np.arange(end - start, dtype=np.int32)[:, None] * n
+        counts = np.bincount(indices.ravel(), minlength=(end - start) * n)
+        means[start:end] = counts.reshape(end - start, n) @ values.T / n
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    return low, high
@@ -0,0 +1,152 @@
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+from transformers import PreTrainedTokenizer
+
+from .eval_metric import (
+    create_example_pool,
+    index_examples,
+    postprocess_samples,
+    score_samples,
+    write_result_files,
+)
+from .postprocess import PostProcessor, create_postprocessor
+from .profiling import Profiler
+from .types import Example, Metrics, Prediction
+from .watchdog import WatchdogPool
+
+
+@dataclass
+class ScoreResult:
+    """The scores of the predictions with one postprocessor, in the order of the predictions"""
+
+    metrics: Metrics
+    task_ids: list[str]
+    # the postprocessed predictions, as in prediction_truncated.jsonl
+    truncated: list[dict]
+    em: np.ndarray
+    # edit similarity, from 0 to 100
+    es: np.ndarray
+    stop: np.ndarray
+    id_em: np.ndarray
+    id_precision: np.ndarray
+    id_recall: np.ndarray
+    id_f1: np.ndarray
+    # "ok", or "timeout"/"crash" for the predictions scored without postprocessing
+    outcome: np.ndarray
+
+
+def to_records(data: Any) -> list[dict]:
+    """
+    The rows of an iterable of dicts, or of an Arrow table or record batch or an
+    iterable of them, as dicts
+    """
+    if hasattr(data, "to_pylist"):
+        return data.to_pylist()
+
+    records = []
+    for item in data:
+        if hasattr(item, "to_pylist"):
+            records.extend(item.to_pylist())
+        else:
+            records.append(item)
+    return records
+
+
+def score(
+    predictions: Iterable[Prediction] | Any,
+    examples: Iterable[Example] | Any,
+    postprocessors: Iterable[str | PostProcessor],
+    language: str,
+    tokenizer: PreTrainedTokenizer | None = None,
+    timeout: float | None = 30,
+    pool: WatchdogPool | None = None,
+    results_dir: Path | None = None,
+    profiler: Profiler | None = None,
+) -> dict[str, ScoreResult]:
+    """
+    Scores predictions against their examples, which may include examples without
+    predictions, with each postprocessor, as evaluate does but in memory: nothing is
+    read or written unless results_dir is given, in which case the files of evaluate
+    are written to a directory per postprocessor in it.
+
+    Predictions and examples can be iterables of dicts or Arrow tables or batches.
+    Postprocessors given by name run in pool, which must have been created with
+    create_example_pool so that it can be reused across calls, or in a pool for this
+    call if it is None; PostProcessor objects always run in a pool of their own.
+    """
+    if profiler is None:
+        profiler = Profiler()
+
+    samples: list[Prediction] = to_records(predictions)  # type: ignore[assignment]
+    if len(samples) == 0:
+        # the metrics are averages over the predictions
+        raise ValueError("there are no predictions to score")
+    task_ids = [s["task_id"] for s in samples]
+    if len(set(task_ids)) != len(task_ids):
+        raise ValueError("there are several predictions for the same task_id")
+
+    predicted = set(task_ids)
+    indexed, retrieval_stats = index_examples(
+        ex for ex in to_records(examples) if ex["metadata"]["task_id"] in predicted
+    )
+    missing = predicted - indexed.keys()
+    if len(missing) > 0:
+        raise ValueError(f"no examples for the predictions of {sorted(missing)[:5]}")
+    matched_examples = [indexed[task_id] for task_id in task_ids]
+
+    postprocessors = list(postprocessors)
+    if pool is None and any(isinstance(p, str) for p in postprocessors):
+        pool_context = create_example_pool(timeout=timeout)
+    else:
+        pool_context = nullcontext(pool)
+
+    results: dict[str, ScoreResult] = {}
+    with pool_context as named_pool:
+        for postprocessor in postprocessors:
+            if isinstance(postprocessor, str):
+                postprocessor = create_postprocessor(postprocessor, language)
+                postprocessor_pool = named_pool
+            else:
+                postprocessor_pool = None
+
+            truncated_samples, em_labels, example_latencies = postprocess_samples(
+                samples,
+                matched_examples,
+                language,
+                postprocessor,
+                profiler,
+                tokenizer,
+                timeout,
+                postprocessor_pool,
+                progress=False,
+            )
+            res, detailed_results = score_samples(
+                samples, truncated_samples, em_labels, example_latencies, retrieval_stats, profiler
+            )
+
+            if results_dir is not None:
+                write_result_files(
+                    Path(results_dir) / postprocessor.name, truncated_samples, detailed_results, res
+                )
+
+            results[postprocessor.name] = ScoreResult(
+                metrics=res,
+                task_ids=task_ids,
+                truncated=truncated_samples,
+                em=np.array([dr["em"] for dr in detailed_results], dtype=bool),
+                es=np.array([dr["es"] for dr in detailed_results], dtype=np.float64),
+                stop=np.array([dr["stop"] for dr in detailed_results], dtype=bool),
+                id_em=np.array([dr["id_em"] for dr in detailed_results], dtype=bool),
+                id_precision=np.array(
+                    [dr["id_precision"] for dr in detailed_results], dtype=np.float64
+                ),
+                id_recall=np.array([dr["id_recall"] for dr in detailed_results], dtype=np.float64),
+                id_f1=np.array([dr["id_f1"] for dr in detailed_results], dtype=np.float64),
+                outcome=np.array([dr["outcome"] for dr in detailed_results]),
+            )
+
+    return results
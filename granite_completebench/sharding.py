@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+import hashlib
+
+from .cli import ShardArgs
+from .types import Example
+
+
+def task_hash(task_id: str) -> int:
+    # a digest rather than hash(), which is salted differently in every process
+    digest = hashlib.sha256(task_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def shard_of(task_id: str, num_shards: int) -> int:
+    return task_hash(task_id) % num_shards
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    One of count parts of the examples of a task, which are assigned to them by a
+    hash of their task_id, so that hosts agree on them without coordinating
+    """
+
+    index: int
+    count: int
+
+    @staticmethod
+    def from_args(args: ShardArgs) -> "Shard | None":
+        if args.num_shards == 1:
+            return None
+        return Shard(args.shard_index, args.num_shards)
+
+    @property
+    def name(self) -> str:
+        return f"shard-{self.index}-of-{self.count}"
+
+    def contains(self, task_id: str) -> bool:
+        return shard_of(task_id, self.count) == self.index
+
+
+def select_shard(examples: list[Example], shard: Shard | None) -> list[Example]:
+    if shard is None:
+        return examples
+    return [ex for ex in examples if shard.contains(ex["metadata"]["task_id"])]
@@ -1,4 +1,4 @@
-from typing import TypedDict
+from typing import NotRequired, TypedDict
 
 
 class ExampleMetadata(TypedDict):
@@ -16,9 +16,21 @@ class CrossFileItem(TypedDict):
     score: float
 
 
+class RetrievalStats(TypedDict):
+    # Times are in seconds, from choosing the nearby files to selecting the chunks
+    latency: float
+    num_files: int
+    num_candidates: int
+    # Only when the candidates were reranked
+    ranking_latency: NotRequired[float]
+    num_scored: NotRequired[int]
+
+
 class CrossFileContext(TypedDict):
     text: str
     list: list[CrossFileItem]
+    # Only recorded by build-context
+    retrieval: NotRequired[RetrievalStats]
 
 
 class Example(TypedDict):
@@ -34,6 +46,17 @@ class Prediction(TypedDict):
     templated: str
     output: str
     stop_reason: str
+    # Generation statistics, when reported by the backend; times are in seconds
+    prompt_tokens: NotRequired[int]
+    generated_tokens: NotRequired[int]
+    latency: NotRequired[float]
+    ttft: NotRequired[float]
+    tokens_per_second: NotRequired[float]
+    # Only recorded when streaming
+    inter_token_latencies: NotRequired[list[float]]
+    early_stop_tokens: NotRequired[int]
+    tokens_saved: NotRequired[int]
+    time_saved: NotRequired[float]
 
 
 class Metrics(TypedDict):
@@ -45,6 +68,46 @@ class Metrics(TypedDict):
     id_recall: float
     id_f1: float
     total: int
+    # 95% bootstrap confidence intervals of em, es and stop over the examples
+    em_ci_low: NotRequired[float]
+    em_ci_high: NotRequired[float]
+    es_ci_low: NotRequired[float]
+    es_ci_high: NotRequired[float]
+    stop_ci_low: NotRequired[float]
+    stop_ci_high: NotRequired[float]
+    # Aggregated generation statistics, when present in the predictions; times are in ms
+    latency_p50: NotRequired[float]
+    latency_p95: NotRequired[float]
+    latency_p99: NotRequired[float]
+    ttft_p50: NotRequired[float]
+    ttft_p95: NotRequired[float]
+    ttft_p99: NotRequired[float]
+    tokens_per_second: NotRequired[float]
+    prompt_tokens: NotRequired[float]
+    generated_tokens: NotRequired[float]
+    inter_token_latency_p50: NotRequired[float]
+    inter_token_latency_p95: NotRequired[float]
+    tokens_saved: NotRequired[float]
+    time_saved: NotRequired[float]
+    # Estimated generated tokens per example discarded by postprocessing
+    wasted_tokens: NotRequired[float]
+    # Aggregated retrieval statistics, when recorded in the prompts; times are in ms
+    retrieval_latency_p50: NotRequired[float]
+    retrieval_latency_p95: NotRequired[float]
+    retrieval_candidates: NotRequired[float]
+    # Replaying the predictions through the streaming postprocessor, with --replay-stream:
+    # % of predictions it cut, and decode tokens and time (ms) per example after the cut
+    stream_stop: NotRequired[float]
+    stream_tokens_saved: NotRequired[float]
+    stream_time_saved: NotRequired[float]
+    # Time (ms) taken by the evaluation pool per example, and the examples whose
+    # postprocessing timed out or crashed its worker, which are scored unpostprocessed
+    example_latency_p50: NotRequired[float]
+    example_latency_p95: NotRequired[float]
+    example_latency_p99: NotRequired[float]
+    example_latency_max: NotRequired[float]
+    timeouts: NotRequired[int]
+    crashes: NotRequired[int]
 
 
 class LabelledMetrics(Metrics):
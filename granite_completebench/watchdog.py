@@ -0,0 +1,174 @@
+import multiprocessing as mp
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Iterable, Iterator, Literal
+
+
+def _work(fn: Callable[[Any], Any], conn: Connection):
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+
+        index, arg = task
+        start = time.perf_counter()
+        try:
+            value = fn(arg)
+        except Exception:
+            conn.send((index, False, traceback.format_exc(), time.perf_counter() - start))
+        else:
+            conn.send((index, True, value, time.perf_counter() - start))
+
+
+@dataclass
+class TaskResult:
+    index: int
+    # "timeout" if the task missed its deadline, "crash" if its worker died
+    outcome: Literal["ok", "timeout", "crash"]
+    value: Any
+    # seconds the task ran in its worker, or from sending it to the worker until it
+    # was found to have missed its deadline or crashed
+    elapsed: float
+
+
+class _Worker:
+    def __init__(self, fn: Callable[[Any], Any]):
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(target=_work, args=(fn, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WatchdogPool:
+    """
+    A pool of worker processes, each running one task at a time, where the parent
+    enforces a deadline per task: a worker that misses it is killed and replaced,
+    so that a pathological example can't stall the examples queued behind it.
+    Unlike timeouts based on SIGALRM, this also covers native code like tree-sitter
+    and works from any thread.
+
+    Tasks can be submitted while results are collected, so that the pool can be fed
+    by a generator that produces them over time. Deadlines are only checked when
+    results are collected, so that should happen regularly.
+    """
+
+    def __init__(self, fn: Callable[[Any], Any], processes: int, timeout: float | None = None):
+        self.fn = fn
+        self.timeout = timeout
+        self.workers = [_Worker(fn) for _ in range(processes)]
+        self.idle = list(self.workers)
+        self.queued: deque[tuple[int, Any]] = deque()
+        # connection -> (worker, index of its task, time it was sent)
+        self.running: dict[Connection, tuple[_Worker, int, float]] = {}
+        self.num_submitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.kill()
+        self.workers = []
+
+    @property
+    def num_unfinished(self) -> int:
+        return len(self.queued) + len(self.running)
+
+    def submit(self, task: Any) -> int:
+        """Queues a task, returning its index, the number of tasks submitted before it"""
+        index = self.num_submitted
+        self.num_submitted += 1
+        self.queued.append((index, task))
+        self._dispatch()
+        return index
+
+    def results(self, timeout: float | None = None) -> list[TaskResult]:
+        """
+        Results of the tasks that complete within timeout seconds, or by the first
+        deadline if timeout is None, including the tasks that missed their deadline.
+        An exception raised by fn is raised again here.
+        """
+        self._dispatch()
+        if len(self.running) == 0:
+            return []
+
+        wait_time = timeout
+        if self.timeout is not None:
+            first_start = min(start for _, _, start in self.running.values())
+            until_deadline = max(0.0, first_start + self.timeout - time.perf_counter())
+            wait_time = until_deadline if timeout is None else min(timeout, until_deadline)
+
+        results = []
+        for conn in wait(list(self.running), wait_time):
+            worker, index, start = self.running.pop(conn)  # type: ignore[index]
+            try:
+                _, ok, value, elapsed = worker.conn.recv()
+            except EOFError:
+                self.idle.append(self._replace(worker))
+                results.append(TaskResult(index, "crash", None, time.perf_counter() - start))
+                continue
+
+            self.idle.append(worker)
+            if not ok:
+                raise RuntimeError(f"task {index} failed in a worker process:\n{value}")
+            results.append(TaskResult(index, "ok", value, elapsed))
+
+        if self.timeout is not None:
+            now = time.perf_counter()
+            for conn, (worker, index, start) in list(self.running.items()):
+                if now - start >= self.timeout:
+                    del self.running[conn]
+                    self.idle.append(self._replace(worker))
+                    results.append(TaskResult(index, "timeout", None, now - start))
+
+        self._dispatch()
+        return results
+
+    def imap_unordered(self, tasks: Iterable[Any]) -> Iterator[TaskResult]:
+        """
+        Submits all the tasks, then yields their results in the order they complete,
+        with the index of each task in tasks. The pool must not be used for anything
+        else until they are all done.
+        """
+        first = self.num_submitted
+        for task in tasks:
+            self.submit(task)
+
+        while self.num_unfinished > 0:
+            for result in self.results():
+                result.index -= first
+                yield result
+
+    def _dispatch(self):
+        while len(self.idle) > 0 and len(self.queued) > 0:
+            index, task = self.queued.popleft()
+            worker = self.idle.pop()
+            worker.conn.send((index, task))
+            self.running[worker.conn] = (worker, index, time.perf_counter())
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        new_worker = _Worker(self.fn)
+        self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
@@ -122,6 +122,16 @@ export function Metrics() {
           <b>Stop %</b> Percentage of cases where the model stops generating
           before hitting the token limit, or whether postprocessing finds a
           place to cut the output short.
+          <br />
+          <b>Latency p50/p95/p99</b> Percentiles of the time to generate a
+          completion, in milliseconds. Only shown when the generation backend
+          reported timings.
+          <br />
+          <b>Retrieval p50/p95</b> Percentiles of the time to retrieve the
+          cross-file context of an example, in milliseconds, and{" "}
+          <b>Retrieval Candidates</b> the average number of chunks ranked to
+          find it. Only shown when the context was built with{" "}
+          <code>build-context</code>, which can be limited to a time budget.
         </p>
       </div>
     </div>
@@ -1,9 +1,5 @@
 import { Link } from "react-router";
-import {
-  METRIC_DESCRIPTIONS,
-  METRICS,
-  MetricsStore,
-} from "../utils/fetchMetrics";
+import { METRIC_DESCRIPTIONS, MetricsStore } from "../utils/fetchMetrics";
 
 interface MetricsTableProps {
   store: MetricsStore;
@@ -18,7 +14,7 @@ export function MetricsTable({ store, postprocessor }: MetricsTableProps) {
         <col />
         <col />
       </colgroup>
-      {METRICS.map((metric) => (
+      {store.metrics.map((metric) => (
         <colgroup key={metric}>
           {store.languages.map((language) => (
             <col key={metric + "-" + language} />
@@ -29,16 +25,16 @@ export function MetricsTable({ store, postprocessor }: MetricsTableProps) {
         <tr>
           <th />
           <th />
-          {Object.entries(METRIC_DESCRIPTIONS).map(([metric, description]) => (
+          {store.metrics.map((metric) => (
             <th colSpan={store.languages.length} key={metric}>
-              {description}
+              {METRIC_DESCRIPTIONS[metric]}
             </th>
           ))}
         </tr>
         <tr>
           <th>Model</th>
           <th>template</th>
-          {METRICS.map((metric) =>
+          {store.metrics.map((metric) =>
             store.languages.map((language) => (
               <th key={metric + "-" + language}>{language}</th>
             )),
@@ -53,7 +49,7 @@ export function MetricsTable({ store, postprocessor }: MetricsTableProps) {
               {i == 0 ? <th rowSpan={store.templates.length}>{model}</th> : ""}
               <th>{template}</th>
               {/* Row Values */}
-              {METRICS.map((metric) =>
+              {store.metrics.map((metric) =>
                 store.languages.map((language) => (
                   <td key={metric + "-" + language}>
                     {language != "Average" ? (
@@ -4,8 +4,14 @@ export const METRIC_DESCRIPTIONS: { [K in MetricName]: string } = {
   exactMatch: "Exact Match %",
   editSimilarity: "Edit Similarity",
   stop: "Stop %",
+  latencyP50: "Latency p50 (ms)",
+  latencyP95: "Latency p95 (ms)",
+  latencyP99: "Latency p99 (ms)",
+  retrievalLatencyP50: "Retrieval p50 (ms)",
+  retrievalLatencyP95: "Retrieval p95 (ms)",
+  retrievalCandidates: "Retrieval Candidates",
 };
-export const METRICS = Object.keys(METRIC_DESCRIPTIONS) as [MetricName];
+export const METRICS = Object.keys(METRIC_DESCRIPTIONS) as MetricName[];
 
 interface MetricsKey {
   model: string;
@@ -22,6 +28,14 @@ interface MetricsValue extends MetricsKey {
   exactMatch: number;
   editSimilarity: number;
   stop: number;
+  // Only present when the generation backend reported timings
+  latencyP50?: number;
+  latencyP95?: number;
+  latencyP99?: number;
+  // Only present when the retrieved contexts were built with retrieval statistics
+  retrievalLatencyP50?: number;
+  retrievalLatencyP95?: number;
+  retrievalCandidates?: number;
 }
 
 type MetricName = Exclude<keyof MetricsValue, keyof MetricsKey>;
@@ -33,6 +47,7 @@ export class MetricsStore {
   languages: string[] = [];
   templates: string[] = [];
   postprocessors: string[] = [];
+  metrics: MetricName[] = [];
 
   constructor() {
     this.values = new Map();
@@ -60,43 +75,59 @@ export class MetricsStore {
     this.languages = Array.from(languages);
     this.templates = Array.from(templates);
     this.postprocessors = Array.from(postprocessors);
+    this.metrics = METRICS.filter((metric) =>
+      data.some((value: MetricsValue) => value[metric] !== undefined),
+    );
 
     this._addAverages();
   }
 
   getFormattedMetric(key: MetricsKey, metric: MetricName) {
     const keyString = makeKeyString(key);
-    const value = this.values.get(keyString);
-    if (value) {
-      return value[metric].toFixed(2);
+    const metricValue = this.values.get(keyString)?.[metric];
+    if (metricValue !== undefined) {
+      return metricValue.toFixed(2);
     }
     return "";
   }
 
   _addAverages() {
     const newStore = new Map(this.values);
-    const counts = new Map<string, number>();
+    // Counted per metric, since the latency metrics may be missing for some languages
+    const counts = new Map<string, Map<MetricName, number>>();
     for (const [_key, value] of this.values) {
       const averageKeyString = makeKeyString({
         ...value,
         language: "Average",
       });
-      const averageValue = newStore.get(averageKeyString);
-      if (averageValue) {
-        for (const metric of METRICS) {
-          averageValue[metric] += value[metric];
+      let averageValue = newStore.get(averageKeyString);
+      if (!averageValue) {
+        averageValue = {
+          model: value.model,
+          language: "Average",
+          template: value.template,
+          postprocess: value.postprocess,
+          exactMatch: 0,
+          editSimilarity: 0,
+          stop: 0,
+        };
+        newStore.set(averageKeyString, averageValue);
+        counts.set(averageKeyString, new Map());
+      }
+      const metricCounts = counts.get(averageKeyString)!;
+      for (const metric of METRICS) {
+        const metricValue = value[metric];
+        if (metricValue !== undefined) {
+          averageValue[metric] = (averageValue[metric] ?? 0) + metricValue;
+          metricCounts.set(metric, (metricCounts.get(metric) ?? 0) + 1);
         }
-        counts.set(averageKeyString, (counts.get(averageKeyString) ?? 0) + 1);
-      } else {
-        newStore.set(averageKeyString, { ...value });
-        counts.set(averageKeyString, 1);
       }
     }
-    for (const [key, count] of counts) {
+    for (const [key, metricCounts] of counts) {
       const value = newStore.get(key);
       if (value) {
-        for (const metric of METRICS) {
-          value[metric] /= count;
+        for (const [metric, count] of metricCounts) {
+          value[metric] = value[metric]! / count;
         }
       }
     }